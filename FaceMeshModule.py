@@ -1,25 +1,43 @@
 import cv2 as cv
-import mediapipe as mp
+import numpy as np
+import time
+from driver_face import DriverFaceSelector
+from landmark_backends import LandmarkBackend
 
 
-class FaceMeshGenerator:
+class FaceMeshGenerator(LandmarkBackend):
     """
     A class to generate a facemesh on a video output
+
+    The "mediapipe" landmark backend (see landmark_backends.py), returning all 468 landmarks.
     """
 
+    name = "mediapipe"
+
+    NUM_LANDMARKS = 468 # Number of landmarks in MediaPipe's face mesh (without iris refinement)
+    FACE_EXTREMES = (10, 152, 234, 454) # Forehead, chin and both cheek edges, used to bound the face for ROI tracking
+
     # Initializes FaceMeshGenerator
-    def __init__(self, mode=False, num_faces=2, min_detection_con=0.5, min_track_con=0.5):
+    def __init__(self, mode=False, num_faces=1, min_detection_con=0.5, min_track_con=0.5,
+                 track_roi=False, roi_padding=0.3, roi_size=256, driver_policy="largest", seat_region=None):
         """
         Initialize FaceMesh detector with specified parameters
 
         :param bool mode: Static or video mode
-        :param int num_faces: Max number of faces
+        :param int num_faces: Max number of faces (default: only the driver, the fastest setting)
         :param float min_detection_con: Minimum confidence threshold for face detect
         :param float min_trac_con: Maximum confidence threshold for face detect
+        :param bool track_roi: After a detection, only run inference on a padded crop around the last face
+        :param float roi_padding: Padding added on each side of the face box, as a fraction of the face size
+        :param int roi_size: Side length in pixels the face crop is resized to before inference
+        :param str driver_policy: How the driver is picked when several faces are found (see DriverFaceSelector)
+        :param tuple seat_region: (x0, y0, x1, y1) driver seat area as fractions of the frame, for the "region" policy
 
         :raises Runtime Error: In case of failed generation of Face Mesh
         """
         try:
+            import mediapipe as mp # Imported with the model, so it can load on a startup thread (see driveguard.py)
+
             self.results = None
             self.mode = mode
             self.num_faces = num_faces
@@ -29,28 +47,91 @@ class FaceMeshGenerator:
             self.mp_faceDetector = mp.solutions.face_mesh # Gets MediaPipe's face mesh solution module
             
             # Creates FaceMesh object with the parameters
-            self.face_mesh = self.mp_faceDetector.FaceMesh(
-                static_image_mode=self.mode,
-                max_num_faces=self.num_faces,
-                min_detection_confidence=self.min_detection_con,
-                min_tracking_confidence=self.min_track_con
-            )
+            self.face_mesh = self._create_graph()
+            # Face crops get their own graph, so the video-mode tracker of each graph always sees the same coordinate frame
+            self.roi_face_mesh = self._create_graph() if track_roi else None
 
             self.mp_Draw = mp.solutions.drawing_utils # Gets drawing utils from MediaPipe to visualize landmarks
             self.drawSpecs = self.mp_Draw.DrawingSpec(thickness=1, circle_radius=2) # Creates landmark drawing specifications
+
+            # Buffers reused between frames by the array output mode (allocated on first use)
+            self._landmark_indices = None
+            self._norm_buffer = None
+            self._pixel_buffer = None
+
+            self.latency_monitor = None # Optional LatencyMonitor recording the color conversion, inference and landmark stages
+
+            # Face region tracking
+            self.track_roi = track_roi
+            self.roi_padding = roi_padding
+            self.roi_size = roi_size
+            self.roi = None # (x0, y0, x1, y1) square pixel box searched in the next frame (may extend past the frame), None for a full-frame search
+            self.region = None # (x, y, width, height) of the frame region the last results are relative to
+            self._roi_canvas = None # Full-resolution square crop of the last ROI search, padded past the frame edges
+            self.roi_frames = 0 # Frames processed on a face crop
+            self.full_frames = 0 # Frames processed on the full frame
+
+            # Driver face selection
+            self.driver_selector = DriverFaceSelector(driver_policy, seat_region)
+            self.face_order = [] # Indices of the detected faces, driver first (empty when no driver was found)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize FaceMeshGenerator: {str(e)}") # In case of failed initialization
 
 
+    # Creates a FaceMesh graph with the generator's parameters
+    def _create_graph(self):
+        return self.mp_faceDetector.FaceMesh(
+            static_image_mode=self.mode,
+            max_num_faces=self.num_faces,
+            min_detection_confidence=self.min_detection_con,
+            min_tracking_confidence=self.min_track_con
+        )
+
+
+    # Forgets the faces tracked so far
+    def reset(self):
+        """
+        Replaces the video-mode graphs and clears the ROI and driver position, so the next frame is searched
+        like the first frame of a new video instead of being tracked from an unrelated one
+
+        :return None
+        """
+        for graph in (self.face_mesh, self.roi_face_mesh):
+            if graph is not None:
+                graph.close()
+        self.face_mesh = self._create_graph()
+        self.roi_face_mesh = self._create_graph() if self.track_roi else None
+        self.results = None
+        self.roi = None
+        self.region = None
+        self.face_order = []
+        self.driver_selector.last_center = None
+
+
     # Processes a video frame and generates face mesh landmarks
-    def create_face_mesh(self, frame, draw=True):
+    def create_face_mesh(self, frame, draw=True, as_array=False, indices=None, all_faces=False):
         """
         Create face mesh landmarks for the given frame
 
+        Only the driver's landmarks are returned, picked by driver_policy when several faces are found. With
+        all_faces the other faces are returned too, each separately and after the driver.
+
+        With as_array the landmarks are returned as an int32 NumPy array of shape (faces, points, 2)
+        instead of a dictionary. The array is a view into a buffer reused on the next call, so copy it
+        if it has to outlive the frame.
+
+        With track_roi, inference runs on a downscaled crop around the face found in the previous frame
+        and the landmarks are mapped back to full-frame pixels. The crop is always square, padded with a
+        black border where it extends past the frame, so the face is never stretched. When no face is
+        found in the crop, the full frame is searched again.
+
         :param frame: Frame of video to process
         :param draw: Whether or not to draw face mesh on frame
+        :param bool as_array: Return landmarks as a NumPy array instead of a dictionary
+        :param list indices: Landmark IDs to return in array mode (default: all 468, in ID order)
+        :param bool all_faces: Also return the faces other than the driver
 
-        :return tuple frame, landmarks_dict: processed frame and dictionary of landmarks
+        :return tuple frame, landmarks: processed frame and dictionary (or array) of landmarks, a list of dictionaries with all_faces
         :raises ValueError: No input frame
         :raises Runtime Error: Error processing the frame
         """
@@ -58,30 +139,200 @@ class FaceMeshGenerator:
             raise ValueError("Input frame cannot be None") # In case of no frame
 
         try:
-            frame_rgb = cv.cvtColor(frame, cv.COLOR_BGR2RGB) # Converts frame from OpenCV BGR colors to RGB
-            self.results = self.face_mesh.process(frame_rgb) # Detects face landmarks using MediaPipe
-            landmarks_dict = {} # Emtpy dict of face landmarks
+            monitor = self.latency_monitor
+            ih, iw = frame.shape[:2]
+            self.results = None
 
-            # Checks to see if face landmarks detected
-            if self.results.multi_face_landmarks:
+            convert_time = inference_time = 0.0 # Both searches count when the crop misses
+            self._roi_canvas = None
+
+            # Searches the crop around the last face first
+            if self.track_roi and self.roi is not None:
+                x0, y0, x1, y1 = self.roi
+                start = time.perf_counter()
+                # Pads the part of the square outside the frame instead of stretching the clipped crop
+                cx0, cy0, cx1, cy1 = max(0, x0), max(0, y0), min(iw, x1), min(ih, y1)
+                canvas = cv.copyMakeBorder(frame[cy0:cy1, cx0:cx1], cy0 - y0, y1 - cy1, cx0 - x0, x1 - cx1,
+                                           cv.BORDER_CONSTANT, value=0)
+                crop = cv.resize(canvas, (self.roi_size, self.roi_size), interpolation=cv.INTER_AREA)
+                frame_rgb = cv.cvtColor(crop, cv.COLOR_BGR2RGB) # Converts crop from OpenCV BGR colors to RGB
+                converted = time.perf_counter()
+                self.results = self.roi_face_mesh.process(frame_rgb) # Detects face landmarks using MediaPipe
+                inferred = time.perf_counter()
+                convert_time += converted - start
+                inference_time += inferred - converted
+                self.region = (x0, y0, x1 - x0, y1 - y0)
+                if self.results.multi_face_landmarks:
+                    self.roi_frames += 1
+                    self._roi_canvas = canvas if draw else None
+                else:
+                    self.results = None # Tracking lost, falls back to the full frame
+
+            if self.results is None:
+                start = time.perf_counter()
+                frame_rgb = cv.cvtColor(frame, cv.COLOR_BGR2RGB) # Converts frame from OpenCV BGR colors to RGB
+                converted = time.perf_counter()
+                self.results = self.face_mesh.process(frame_rgb) # Detects face landmarks using MediaPipe
+                inferred = time.perf_counter()
+                convert_time += converted - start
+                inference_time += inferred - converted
+                self.region = (0, 0, iw, ih)
+                self.full_frames += 1
+
+            if monitor is not None:
+                monitor.record("color_convert", convert_time)
+                monitor.record("inference", inference_time)
+
+            self.face_order = self.order_faces(iw, ih)
+            if self.track_roi:
+                self.roi = self.face_roi(iw, ih)
+
+            if draw and self.results.multi_face_landmarks:
+                # Draws on the searched region, since the results are normalized to it
+                rx, ry, rw, rh = self.region
+                region = self._roi_canvas if self._roi_canvas is not None else frame[ry:ry + rh, rx:rx + rw]
                 for face_lms in self.results.multi_face_landmarks: # Iterates through each face landmark
-                    if draw:
-                        # Draws face mesh contours
-                        self.mp_Draw.draw_landmarks(
-                            frame, # Specified frame
-                            face_lms, # Landmarks
-                            self.mp_faceDetector.FACEMESH_CONTOURS, # Contour connections for face mesh
-                            self.drawSpecs, # Draw specs for landmarks
-                            self.drawSpecs # Draw specs for connections
-                        )
-
-                    # Convert normalized landmarks to pixel coordinates (frame dimentions height/width)
-                    ih, iw, _ = frame.shape
-                    # Loops through each landmark point by ID
-                    for ID, lm in enumerate(face_lms.landmark):
-                        x, y = int(lm.x * iw), int(lm.y * ih) # Convert normalized coordinate to pixel coordinate
-                        landmarks_dict[ID] = (x, y) # Adds coordinate to dictionary under landmark ID
-
-            return frame, landmarks_dict # Returns frame and dictionary of coordinates
+                    # Draws face mesh contours
+                    self.mp_Draw.draw_landmarks(
+                        region, # Specified frame
+                        face_lms, # Landmarks
+                        self.mp_faceDetector.FACEMESH_CONTOURS, # Contour connections for face mesh
+                        self.drawSpecs, # Draw specs for landmarks
+                        self.drawSpecs # Draw specs for connections
+                    )
+                if self._roi_canvas is not None:
+                    # Copies the drawn crop back, without its padding
+                    cx0, cy0 = max(0, rx), max(0, ry)
+                    cx1, cy1 = min(iw, rx + rw), min(ih, ry + rh)
+                    frame[cy0:cy1, cx0:cx1] = region[cy0 - ry:cy1 - ry, cx0 - rx:cx1 - rx]
+
+            if as_array:
+                landmarks = self.landmarks_to_array(indices, all_faces)
+                if monitor is not None:
+                    monitor.record("landmarks", time.perf_counter() - inferred)
+                return frame, landmarks # Returns frame and array of coordinates
+
+            faces_dicts = [] # One dict of face landmarks per face, driver first
+
+            # Checks to see if face landmarks detected
+            order = self.face_order if all_faces else self.face_order[:1]
+            for face in order: # Iterates through the landmarks of each face
+                face_lms = self.results.multi_face_landmarks[face]
+                landmarks_dict = {} # Emtpy dict of face landmarks
+                # Convert normalized landmarks to pixel coordinates (searched region offset and dimensions)
+                rx, ry, rw, rh = self.region
+                # Loops through each landmark point by ID
+                for ID, lm in enumerate(face_lms.landmark):
+                    x, y = int(rx + lm.x * rw), int(ry + lm.y * rh) # Convert normalized coordinate to pixel coordinate
+                    landmarks_dict[ID] = (x, y) # Adds coordinate to dictionary under landmark ID
+                faces_dicts.append(landmarks_dict)
+            landmarks_dict = faces_dicts if all_faces else (faces_dicts[0] if faces_dicts else {})
+
+            if monitor is not None:
+                monitor.record("landmarks", time.perf_counter() - inferred)
+            return frame, landmarks_dict # Returns frame and dictionary (or list of dictionaries) of coordinates
         except Exception as e:
-            raise RuntimeError(f"Error processing frame: {str(e)}") # In case of error processing frame
\ No newline at end of file
+            raise RuntimeError(f"Error processing frame: {str(e)}") # In case of error processing frame
+
+
+    # Orders the detected faces, driver first
+    def order_faces(self, iw, ih):
+        """
+        Pick the driver among the detected faces with the driver selector
+
+        :param int iw: Frame width in pixels
+        :param int ih: Frame height in pixels
+
+        :return list: Indices into the MediaPipe results, driver first, or an empty list if no driver was found
+        """
+        if not self.results.multi_face_landmarks:
+            return []
+        if len(self.results.multi_face_landmarks) == 1 and self.driver_selector.policy == "largest":
+            return [0] # Single-face fast path, the only face is the driver ("nearest" still has to track its position)
+
+        # Bounds every face with its extreme landmarks, in frame pixels
+        rx, ry, rw, rh = self.region
+        boxes = []
+        for face_lms in self.results.multi_face_landmarks:
+            lms = face_lms.landmark
+            xs = [rx + lms[i].x * rw for i in self.FACE_EXTREMES]
+            ys = [ry + lms[i].y * rh for i in self.FACE_EXTREMES]
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+
+        driver = self.driver_selector.select(boxes, (iw, ih))
+        if driver is None:
+            return []
+        return [driver] + [face for face in range(len(boxes)) if face != driver]
+
+
+    # Calculates the crop searched in the next frame from the last detected face
+    def face_roi(self, iw, ih):
+        """
+        Bound the driver's face with its extreme landmarks and pad it into a square crop
+
+        The box stays square near the frame edges, the part outside the frame is padded when the crop is taken.
+
+        :param int iw: Frame width in pixels
+        :param int ih: Frame height in pixels
+
+        :return tuple: (x0, y0, x1, y1) square pixel box, or None if no driver was detected
+        """
+        if not self.face_order:
+            return None
+
+        rx, ry, rw, rh = self.region
+        lms = self.results.multi_face_landmarks[self.face_order[0]].landmark
+        xs = [rx + lms[i].x * rw for i in self.FACE_EXTREMES]
+        ys = [ry + lms[i].y * rh for i in self.FACE_EXTREMES]
+
+        # Square box around the face center, padded on every side
+        cx, cy = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+        half = max(max(xs) - min(xs), max(ys) - min(ys)) * (0.5 + self.roi_padding)
+        side = max(2, int(2 * half))
+        x0, y0 = int(cx - half), int(cy - half)
+        x1, y1 = x0 + side, y0 + side
+        if min(iw, x1) - max(0, x0) < 2 or min(ih, y1) - max(0, y0) < 2:
+            return None # Face left the frame
+        return x0, y0, x1, y1
+
+
+    # Converts the latest MediaPipe results to a (faces, points, 2) pixel coordinate array
+    def landmarks_to_array(self, indices=None, all_faces=False):
+        """
+        Convert the landmarks of the last processed frame into pixel coordinates in one vectorized step
+
+        Only the requested landmark IDs are read from the MediaPipe results, and the normalized and
+        pixel buffers are preallocated for num_faces faces and reused between frames.
+
+        :param list indices: Landmark IDs to convert (default: all 468, in ID order)
+        :param bool all_faces: Convert every face instead of only the driver's
+
+        :return numpy.ndarray: int32 array of shape (faces, points, 2) holding (x, y) pixel coordinates, driver first
+        """
+        if indices is None:
+            indices = range(self.NUM_LANDMARKS)
+        indices = tuple(indices)
+
+        # (Re)allocate the buffers only when the requested subset changes
+        if indices != self._landmark_indices:
+            self._landmark_indices = indices
+            self._norm_buffer = np.empty((self.num_faces, len(indices), 2), dtype=np.float32)
+            self._pixel_buffer = np.empty((self.num_faces, len(indices), 2), dtype=np.int32)
+
+        faces = 0
+        if self.results is not None and self.results.multi_face_landmarks:
+            order = self.face_order if all_faces else self.face_order[:1]
+            for face in order[:self.num_faces]:
+                lms = self.results.multi_face_landmarks[face].landmark
+                # Gathers only the requested normalized coordinates into the preallocated buffer
+                self._norm_buffer[faces] = [(lms[i].x, lms[i].y) for i in indices]
+                faces += 1
+
+        # Scales and offsets every face and landmark to frame pixels at once, truncating like int() does
+        rx, ry, rw, rh = self.region
+        norm = self._norm_buffer[:faces]
+        norm *= np.array((rw, rh), dtype=np.float32)
+        norm += np.array((rx, ry), dtype=np.float32)
+        pixels = self._pixel_buffer[:faces]
+        np.copyto(pixels, norm, casting='unsafe')
+        return pixels
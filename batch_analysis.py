@@ -0,0 +1,267 @@
+import argparse
+import csv
+import json
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2 as cv
+
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v") # File types picked up when a directory is given
+
+_worker_generator = None # FaceMeshGenerator shared by every video analyzed in a worker process
+
+
+class OfflineSink:
+    """
+    A class that stands in for SleepDatabase and MicroConnection when analyzing recorded videos
+
+    Sleep events of a recording are written to its summary instead of the database, and no alert is sent to the board.
+    """
+
+    # Ignores the database upload of a sleep event
+    def take_sleep_timestamp(self, driver_id=""):
+        """
+        Does nothing, sleep events are collected from the timeline instead
+
+        :return None
+        """
+
+
+    # Ignores the drowsiness aggregates
+    def take_drowsiness_metrics(self, row):
+        """
+        Does nothing, the timeline already holds the EAR of every frame
+
+        :param dict row: Dictionary returned by DrowsinessMetrics.flush
+
+        :return None
+        """
+
+
+    # Ignores the hardware alert of a sleep event
+    def sleep_warning(self, duration=None, captured_at=None):
+        """
+        Does nothing, recorded drives don't trigger the LED, buzzer or servo
+
+        :return None
+        """
+
+
+class VideoTimeline:
+    """
+    A class that writes the per-frame EAR/state timeline of one video and collects its sleep events
+    """
+
+    # Initializes VideoTimeline
+    def __init__(self, csv_file, sleep_seconds):
+        """
+        Initializes the timeline writer
+
+        :param file csv_file: Open file the timeline is written to
+        :param float sleep_seconds: Seconds the eyes must stay closed to be considered asleep
+
+        :return None
+        """
+        self.writer = csv.writer(csv_file)
+        self.writer.writerow(["frame", "time_s", "ear", "asleep"])
+        self.sleep_seconds = sleep_seconds
+
+        self.frames = 0
+        self.face_frames = 0 # Frames with a detected face
+        self.events = [] # Detected sleep events
+        self._was_asleep = False
+
+
+    # Records one processed frame, used as the SleepDetector frame callback
+    def add_frame(self, frame_index, frame_time, ear, asleep):
+        """
+        Writes a timeline row and tracks the start and end of sleep events
+
+        :param int frame_index: Index of the processed frame
+        :param float frame_time: Time of the frame within the video in seconds
+        :param float ear: Eye aspect ratio of the frame (None without a face)
+        :param bool asleep: Sleep status after the frame
+
+        :return None
+        """
+        self.frames += 1
+        if ear is not None:
+            self.face_frames += 1
+
+        self.writer.writerow([frame_index, f"{frame_time:.3f}", "" if ear is None else f"{ear:.4f}", int(asleep)])
+
+        if asleep and not self._was_asleep:
+            # The eyes closed sleep_seconds before the detection
+            self.events.append({
+                "onset_s": round(max(0.0, frame_time - self.sleep_seconds), 3),
+                "detected_s": round(frame_time, 3),
+                "end_s": None
+            })
+        elif not asleep and self._was_asleep:
+            self.events[-1]["end_s"] = round(frame_time, 3)
+        self._was_asleep = asleep
+
+
+# Creates the face mesh generator of a worker process
+def _init_worker():
+    """
+    Process pool initializer: builds one FaceMeshGenerator per worker, reused (and reset) for all of its videos
+
+    :return None
+    """
+    global _worker_generator
+    from FaceMeshModule import FaceMeshGenerator
+    _worker_generator = FaceMeshGenerator()
+
+
+# Analyzes one video inside a worker process
+def analyze_video(video_path, output_base, ear_threshold, consec_frames):
+    """
+    Runs a headless SleepDetector over a recorded video and writes its timeline and summary
+
+    Writes <output_base>_timeline.csv with one row per frame and <output_base>_summary.json with the sleep events.
+
+    :param str video_path: Path of the video
+    :param str output_base: Output path without the _timeline.csv/_summary.json suffix
+    :param float ear_threshold: Threshold of which eyes are considered closed
+    :param int consec_frames: The amount of consecutive frames below the ear threshold to be considered asleep
+
+    :return dict: Summary of the video and its sleep events
+    :raises IOError: If the video cannot be opened
+    :raises Exception: Whatever stopped the detector before the end of the video
+    """
+    from sleep_detector import SleepDetector
+
+    # Reads the frame rate up front to report the video duration
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Error: couldn't open the video {video_path}!")
+    fps = cap.get(cv.CAP_PROP_FPS)
+    cap.release()
+    if fps <= 0:
+        fps = SleepDetector.NOMINAL_FPS # Same rate SleepDetector assumes when the container doesn't report one
+
+    timeline_path = f"{output_base}_timeline.csv"
+    start = time.perf_counter()
+    sink = OfflineSink()
+    _worker_generator.reset() # No face tracked in the previous video carries over
+    with open(timeline_path, "w", newline="") as csv_file:
+        timeline = VideoTimeline(csv_file, consec_frames / SleepDetector.NOMINAL_FPS)
+        detector = SleepDetector(
+            video_path=video_path,
+            ear_threshold=ear_threshold,
+            consec_frames=consec_frames,
+            asleep=False,
+            database=sink,
+            microcontroller=sink,
+            headless=True,
+            generator=_worker_generator,
+            frame_callback=timeline.add_frame
+        )
+        detector.process_video()
+    if detector.error is not None:
+        raise detector.error # Recorded by analyze_videos instead of a partial summary
+    elapsed = time.perf_counter() - start
+
+    duration = detector.frames_read / fps
+    summary = {
+        "video": video_path,
+        "timeline": timeline_path,
+        "frames": detector.frames_read,
+        "face_frames": timeline.face_frames,
+        "fps": fps,
+        "duration_s": round(duration, 3),
+        "processing_s": round(elapsed, 3),
+        "realtime_factor": round(duration / elapsed, 2) if elapsed > 0 else None,
+        "sleep_events": timeline.events
+    }
+    with open(f"{output_base}_summary.json", "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    return summary
+
+
+# Collects the videos from files and directories
+def find_videos(paths):
+    """
+    Expands directories into the video files they contain
+
+    :param list paths: Video files and/or directories
+
+    :return list: Sorted video file paths
+    """
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            videos.append(path)
+    return sorted(videos)
+
+
+# Analyzes many videos in parallel
+def analyze_videos(paths, output_dir, ear_threshold=0.24, consec_frames=90, workers=None):
+    """
+    Fans the videos out across a process pool and writes a timeline and summary per video plus batch_summary.json
+
+    Each worker process holds one FaceMeshGenerator, reset before every video, so throughput scales with the
+    number of cores.
+
+    :param list paths: Video files and/or directories of videos
+    :param str output_dir: Directory for the timelines and summaries
+    :param float ear_threshold: Threshold of which eyes are considered closed
+    :param int consec_frames: The amount of consecutive frames below the ear threshold to be considered asleep
+    :param int workers: Number of worker processes (default: number of CPUs)
+
+    :return list: Summary of each video, in input order (failed videos have an "error" entry)
+    """
+    videos = find_videos(paths)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Gives each video a unique output name, even when file names repeat across directories
+    output_bases = []
+    used_names = set()
+    for video in videos:
+        name = os.path.splitext(os.path.basename(video))[0]
+        unique_name, suffix = name, 1
+        while unique_name in used_names:
+            suffix += 1
+            unique_name = f"{name}_{suffix}"
+        used_names.add(unique_name)
+        output_bases.append(os.path.join(output_dir, unique_name))
+
+    summaries = [None] * len(videos)
+    context = multiprocessing.get_context("spawn") # MediaPipe graphs don't survive a fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(analyze_video, video, output_base, ear_threshold, consec_frames): i
+            for i, (video, output_base) in enumerate(zip(videos, output_bases))
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                summaries[i] = {"video": videos[i], "error": str(e)}
+            print(f"Analyzed {videos[i]} ({sum(s is not None for s in summaries)}/{len(videos)})")
+
+    with open(os.path.join(output_dir, "batch_summary.json"), "w") as summary_file:
+        json.dump(summaries, summary_file, indent=2)
+    return summaries
+
+
+# Allows batch analysis to be run from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze recorded drive videos for sleep events in parallel")
+    parser.add_argument("paths", nargs="+", help="Video files and/or directories of videos")
+    parser.add_argument("--output", default="analysis", help="Directory for timelines and summaries")
+    parser.add_argument("--ear-threshold", type=float, default=0.24, help="Eye aspect ratio threshold")
+    parser.add_argument("--consec-frames", type=int, default=90, help="Consecutive closed-eye frames to be asleep")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    analyze_videos(args.paths, args.output, args.ear_threshold, args.consec_frames, args.workers)
@@ -0,0 +1,597 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+from datetime import datetime
+import numpy as np
+from eye_aspect_ratio import EyeAspectRatioKernel
+from latency_stats import LatencyWindow
+
+
+# Landmark IDs used for the EAR of each eye (same as SleepDetector)
+RIGHT_EYE_EAR = [33, 159, 158, 133, 153, 145]
+LEFT_EYE_EAR = [362, 380, 374, 263, 386, 385]
+
+# Landmark IDs SleepDetector requests from the face mesh (both eye outlines and the EAR landmarks)
+LANDMARK_IDS = sorted(set(RIGHT_EYE_EAR + LEFT_EYE_EAR + [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246,
+                                                         362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385, 384, 398]))
+
+RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080)) # (width, height) of the face mesh benchmark frames
+
+
+# Creates random landmarks in both the dictionary and the array format
+def synthetic_landmarks(faces=1, width=1280, height=720, seed=0):
+    """
+    Create a random set of 468 face mesh landmarks in pixel coordinates
+
+    :param int faces: Number of faces to generate
+    :param int width: Frame width in pixels
+    :param int height: Frame height in pixels
+    :param int seed: Seed of the random generator
+
+    :return tuple landmarks_dict, landmarks_array: First face as a dictionary and all faces as a (faces, 468, 2) array
+    """
+    rng = np.random.default_rng(seed)
+    landmarks_array = rng.integers(0, (width, height), size=(faces, 468, 2)).astype(np.int32)
+    landmarks_dict = {ID: (int(x), int(y)) for ID, (x, y) in enumerate(landmarks_array[0])}
+    return landmarks_dict, landmarks_array
+
+
+# Creates a landmark stream of a driver blinking and occasionally falling asleep
+def synthetic_landmark_stream(landmark_ids, frames=100000, fps=30.0, seed=0):
+    """
+    Create per-frame landmarks whose eyes are open (EAR around 0.3), blink every few seconds and close for
+    four seconds once a minute, so the sleep detection goes through all of its states
+
+    :param list landmark_ids: Landmark IDs of each frame, in order (must include the EAR landmarks)
+    :param int frames: Number of frames
+    :param float fps: Frame rate the frame times are generated at
+    :param int seed: Seed of the random generator
+
+    :return tuple frame_times, landmarks: float64 frame times and an int32 (frames, 1, points, 2) landmark array
+    """
+    rng = np.random.default_rng(seed)
+    frame_times = np.arange(frames) / fps
+    ears = rng.normal(0.3, 0.02, frames)
+    ears[(frame_times % 4.0) < 0.15] = 0.08 # Blinks
+    ears[(frame_times % 60.0) >= 56.0] = 0.08 # Sleep episodes
+
+    landmarks = np.tile(rng.integers(0, (1280, 720), size=(len(landmark_ids), 2)).astype(np.int32), (frames, 1, 1, 1))
+    positions = {landmark_id: pos for pos, landmark_id in enumerate(landmark_ids)}
+    height = np.round(30.0 * ears).astype(np.int32) # EAR = 4h / (2 * 60) for a 60 pixel wide eye
+    for center, (p1, p2, p3, p4, p5, p6) in (((500, 300), RIGHT_EYE_EAR), ((700, 300), LEFT_EYE_EAR)):
+        cx, cy = center
+        landmarks[:, 0, positions[p1]] = (cx - 30, cy)
+        landmarks[:, 0, positions[p4]] = (cx + 30, cy)
+        for top, bottom, x in ((p2, p6, cx - 10), (p3, p5, cx + 10)):
+            landmarks[:, 0, positions[top], 0] = x
+            landmarks[:, 0, positions[top], 1] = cy - height
+            landmarks[:, 0, positions[bottom], 0] = x
+            landmarks[:, 0, positions[bottom], 1] = cy + height
+    return frame_times, landmarks
+
+
+# Compares the per-eye EAR path against the batched EAR kernel
+def benchmark_ear(iterations=100000, faces=1):
+    """
+    Time the per-frame EAR calculation of the original per-eye path and of the batched kernel
+
+    :param int iterations: Number of frames to time
+    :param int faces: Number of faces per frame for the batched kernel
+
+    :return dict: Microseconds per frame for each path and the speedup of the kernel
+    """
+    from sleep_detector import SleepDetector # Imported here so the other benchmarks don't need MediaPipe
+
+    landmarks_dict, landmarks_array = synthetic_landmarks(faces)
+    kernel = EyeAspectRatioKernel([RIGHT_EYE_EAR, LEFT_EYE_EAR], max_faces=faces)
+
+    # Both paths have to agree before their timings mean anything
+    expected = (SleepDetector.eye_aspect_ratio(RIGHT_EYE_EAR, landmarks_dict) +
+                SleepDetector.eye_aspect_ratio(LEFT_EYE_EAR, landmarks_dict)) / 2.0
+    actual = float(kernel.compute(landmarks_array)[0].mean())
+    if not np.isclose(expected, actual, rtol=1e-5):
+        raise AssertionError(f"Batched EAR {actual} does not match per-eye EAR {expected}")
+
+    def per_eye():
+        right_ear = SleepDetector.eye_aspect_ratio(RIGHT_EYE_EAR, landmarks_dict)
+        left_ear = SleepDetector.eye_aspect_ratio(LEFT_EYE_EAR, landmarks_dict)
+        return (right_ear + left_ear) / 2.0
+
+    def batched():
+        return kernel.compute(landmarks_array, all_faces=True)
+
+    per_eye_us = min(timeit.repeat(per_eye, number=iterations, repeat=3)) / iterations * 1e6
+    batched_us = min(timeit.repeat(batched, number=iterations, repeat=3)) / iterations * 1e6
+    return {
+        "per_eye_us": per_eye_us,
+        "batched_us": batched_us,
+        "speedup": per_eye_us / batched_us
+    }
+
+
+# Loads the frames the face mesh benchmark runs on
+def benchmark_frames(resolution, frames=60, video_path=None, seed=0):
+    """
+    Read frames from a recorded video, or create synthetic ones, at the given resolution
+
+    Synthetic frames are noise without a face, so they only time the face detection stage of the face mesh.
+    A recorded drive times the full detection and landmark pipeline.
+
+    :param tuple resolution: (width, height) of the frames
+    :param int frames: Number of frames
+    :param str video_path: Recorded video to read the frames from (default: synthetic frames)
+    :param int seed: Seed of the random generator
+
+    :return list: BGR frames
+    :raises IOError: If the video cannot be read
+    """
+    import cv2 as cv
+
+    if video_path is None:
+        rng = np.random.default_rng(seed)
+        return [rng.integers(0, 256, size=(resolution[1], resolution[0], 3), dtype=np.uint8) for _ in range(frames)]
+
+    cap = cv.VideoCapture(video_path)
+    loaded = []
+    while len(loaded) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        loaded.append(cv.resize(frame, resolution))
+    cap.release()
+    if not loaded:
+        raise IOError(f"Error: couldn't read the video {video_path}!")
+    return loaded
+
+
+# Times create_face_mesh at several resolutions
+def benchmark_face_mesh(resolutions=RESOLUTIONS, frames=60, video_path=None, warmup=5, generator_options=None,
+                        landmark_backend="mediapipe"):
+    """
+    Time create_face_mesh of a landmark backend on frames of every resolution, the way SleepDetector calls it
+
+    :param tuple resolutions: (width, height) pairs to benchmark
+    :param int frames: Timed frames per resolution, the frames are cycled if the video is shorter
+    :param str video_path: Recorded video to take the frames from (default: synthetic frames without a face)
+    :param int warmup: Untimed frames run first at every resolution
+    :param dict generator_options: Keyword arguments of the landmark backend
+    :param str landmark_backend: Landmark backend to time, "mediapipe" or "opencv_eyes"
+
+    :return dict: Per resolution "<width>x<height>": fps, latency percentiles and fraction of frames with a face
+    """
+    from landmark_backends import create_backend
+
+    indices = LANDMARK_IDS
+    results = {}
+    for resolution in resolutions:
+        generator = create_backend(landmark_backend, **(generator_options or {})) # A new graph per resolution, as after a restart
+        source = benchmark_frames(resolution, min(frames, 300), video_path)
+        for i in range(warmup):
+            generator.create_face_mesh(source[i % len(source)], draw=False, as_array=True, indices=indices)
+
+        window = LatencyWindow(frames)
+        found = 0
+        start = time.perf_counter()
+        for i in range(frames):
+            frame_start = time.perf_counter()
+            _, landmarks = generator.create_face_mesh(source[i % len(source)], draw=False, as_array=True, indices=indices)
+            window.record(time.perf_counter() - frame_start)
+            found += len(landmarks) > 0
+        elapsed = time.perf_counter() - start
+
+        results[f"{resolution[0]}x{resolution[1]}"] = {
+            "frames": frames,
+            "fps": frames / elapsed,
+            "face_fraction": found / frames,
+            **window.summary()
+        }
+    return results
+
+
+# Builds a SleepDetector that runs without a camera, MediaPipe, serial board or database
+def _offline_detector(frame_times, landmarks, **options):
+    """
+    Record the landmark stream and create a SleepDetector that replays it through LandmarkReplay
+
+    :return tuple detector, replay, path: The detector, the replay it uses as generator and the recording path
+    """
+    from batch_analysis import OfflineSink
+    from landmark_recording import LandmarkRecorder, LandmarkReplay
+    from sleep_detector import SleepDetector
+
+    handle, path = tempfile.mkstemp(suffix=".dglm")
+    os.close(handle)
+    recorder = LandmarkRecorder(path, LANDMARK_IDS)
+    for frame_time, frame_landmarks in zip(frame_times, landmarks):
+        recorder.write(frame_time, frame_time, frame_landmarks)
+    recorder.close()
+
+    replay = LandmarkReplay(path)
+    sink = OfflineSink()
+    detector = SleepDetector(path, 0.24, 90, asleep=False, database=sink, microcontroller=sink, headless=True,
+                             generator=replay, **options)
+    return detector, replay, path
+
+
+# Times the EAR and sleep state machine on a synthetic landmark stream
+def benchmark_detection(frames=100000, fps=30.0):
+    """
+    Time SleepDetector.process_landmarks (EAR plus check_asleep) per frame, with and without the drowsiness
+    metrics, and the batched SleepDetector.replay_landmarks over the same stream
+
+    :param int frames: Frames in the synthetic stream
+    :param float fps: Frame rate of the stream
+
+    :return dict: Frames per second, per-frame latency percentiles and detected sleep events of each path
+    """
+    frame_times, landmarks = synthetic_landmark_stream(LANDMARK_IDS, frames, fps)
+
+    results = {}
+    for name, options in (("process_landmarks", {}), ("process_landmarks_metrics", {"perclos_threshold": 0.15, "smooth_ear": True})):
+        detector, replay, path = _offline_detector(frame_times, landmarks, **options)
+        try:
+            events = 0
+            window = LatencyWindow(frames)
+            start = time.perf_counter()
+            for frame_time, frame_landmarks in zip(frame_times.tolist(), landmarks):
+                frame_start = time.perf_counter()
+                asleep = detector.asleep
+                detector.process_landmarks(frame_landmarks, None, frame_time)
+                window.record(time.perf_counter() - frame_start)
+                events += detector.asleep and not asleep
+            elapsed = time.perf_counter() - start
+            results[name] = {"frames": frames, "fps": frames / elapsed, "sleep_events": events, **window.summary()}
+        finally:
+            os.remove(path)
+
+    detector, replay, path = _offline_detector(frame_times, landmarks)
+    try:
+        states = []
+        detector.frame_callback = lambda index, frame_time, ear, asleep: states.append(asleep)
+        start = time.perf_counter()
+        detector.replay_landmarks(replay)
+        elapsed = time.perf_counter() - start
+        events = int(np.count_nonzero(np.diff(np.array(states, dtype=np.int8)) == 1) + (states[0] if states else 0))
+        results["replay_landmarks"] = {"frames": frames, "fps": frames / elapsed, "sleep_events": events}
+    finally:
+        os.remove(path)
+    return results
+
+
+class SQLiteSleepDatabase:
+    """
+    A class that stands in for SleepDatabase with an in-memory SQLite database, for benchmarking without PostgreSQL
+
+    It has the same tables and insert methods, so SleepEventWriter can upload to it unchanged. Its SQL is a SQLite
+    rewrite of SleepDatabase's, so it times the writer path but not SleepDatabase's own statements (see
+    RecordingConnection for those).
+    """
+
+    # Initializes SQLiteSleepDatabase
+    def __init__(self, path=":memory:"):
+        """
+        :param str path: SQLite database path (default: in memory)
+
+        :return None
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False) # Used by the writer thread
+        self.connection.executescript("""
+            CREATE TABLE driver (driver_id TEXT NOT NULL DEFAULT '', driver_asleep TIMESTAMP NOT NULL,
+                PRIMARY KEY (driver_id, driver_asleep));
+            CREATE TABLE driver_hourly (driver_id TEXT NOT NULL DEFAULT '', sleep_hour TIMESTAMP NOT NULL,
+                frequency INTEGER NOT NULL, PRIMARY KEY (driver_id, sleep_hour));
+            CREATE TABLE driver_metrics (minute TIMESTAMP NOT NULL, stream TEXT NOT NULL DEFAULT '',
+                face_frames INTEGER NOT NULL, mean_ear REAL, perclos REAL, blinks INTEGER NOT NULL,
+                mean_blink_duration REAL, flush_id TEXT NOT NULL DEFAULT '', PRIMARY KEY (minute, stream, flush_id));
+            CREATE VIEW driver_metrics_minutes AS SELECT minute, stream, SUM(face_frames) AS face_frames,
+                SUM(mean_ear * face_frames) / NULLIF(SUM(face_frames), 0) AS mean_ear,
+                SUM(perclos * face_frames) / NULLIF(SUM(face_frames), 0) AS perclos, SUM(blinks) AS blinks,
+                SUM(mean_blink_duration * blinks) / NULLIF(SUM(blinks), 0) AS mean_blink_duration
+                FROM driver_metrics GROUP BY minute, stream;
+        """)
+
+
+    # Inserts sleep timestamps and updates the hourly rollup in one transaction
+    def insert_sleep_timestamps(self, timestamps, driver_id=""):
+        """
+        :param list timestamps: datetime objects of the sleep events
+        :param str driver_id: Driver or vehicle the events belong to
+
+        :return None
+        """
+        with self.connection:
+            inserted = []
+            for timestamp in timestamps:
+                if self.connection.execute("INSERT OR IGNORE INTO driver VALUES (?, ?)", (driver_id, timestamp.isoformat())).rowcount:
+                    inserted.append((driver_id, timestamp.replace(minute=0, second=0, microsecond=0).isoformat()))
+            self.connection.executemany("""INSERT INTO driver_hourly VALUES (?, ?, 1)
+                ON CONFLICT (driver_id, sleep_hour) DO UPDATE SET frequency = frequency + 1""", inserted)
+
+
+    # Inserts per-minute drowsiness aggregates in one transaction
+    def insert_drowsiness_metrics(self, rows):
+        """
+        :param list rows: Dictionaries returned by DrowsinessMetrics.flush
+
+        :return None
+        """
+        with self.connection:
+            self.connection.executemany("""INSERT OR IGNORE INTO driver_metrics VALUES
+                (:minute, :stream, :face_frames, :mean_ear, :perclos, :blinks, :mean_blink_duration, :flush_id)""",
+                [{"stream": "", **row, "minute": row["minute"].isoformat(), "flush_id": row.get("flush_id") or uuid.uuid4().hex}
+                 for row in rows])
+
+
+    # Counts the stored sleep events
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM driver").fetchone()[0]
+
+
+class RecordingConnection:
+    """
+    A class that stands in for a psycopg2 connection and its cursor, counting the statements and commits
+
+    SleepDatabase runs against it unchanged, so a change to its SQL or batching shows up as more or fewer
+    statements and round trips per event. No SQL is executed, the server side cost needs a PostgreSQL server.
+    """
+
+    # Initializes RecordingConnection
+    def __init__(self):
+        self.statements = 0 # execute and executemany calls, each one a round trip
+        self.rows = 0 # Parameter sets sent (executemany sends one per row)
+        self.commits = 0
+        self.rowcount = 0
+
+
+    # Cursor interface
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.statements += 1
+        self.rows += 1
+
+    def executemany(self, sql, params):
+        self.statements += 1
+        self.rows += len(params)
+
+    def fetchone(self):
+        return (True,)
+
+    def fetchall(self):
+        return []
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+# Runs SleepDatabase's own insert methods against a RecordingConnection
+def benchmark_sleep_database(events=20000, batch_sizes=(1, 50)):
+    """
+    Time SleepDatabase.insert_sleep_timestamps and insert_drowsiness_metrics on the client side, and count the
+    statements and commits they send per event
+
+    :param int events: Number of sleep events (and metric rows) inserted per measurement
+    :param tuple batch_sizes: Events per call
+
+    :return dict: Per batch size: client events per second, statements and commits per event
+    """
+    from sleep_database import SleepDatabase
+    from datetime import timedelta
+
+    base = datetime(2024, 1, 1)
+    timestamps = [base + timedelta(milliseconds=i) for i in range(events)]
+    rows = [{"minute": base + timedelta(minutes=i), "face_frames": 1800, "mean_ear": 0.3, "perclos": 0.05,
+             "blinks": 15, "mean_blink_duration": 0.2} for i in range(events)]
+
+    results = {}
+    for batch_size in batch_sizes:
+        for name, insert, items in (("sleep", "insert_sleep_timestamps", timestamps), ("metrics", "insert_drowsiness_metrics", rows)):
+            database = SleepDatabase.__new__(SleepDatabase) # Skips connect(), nothing to connect to
+            database.connection = database.cursor = RecordingConnection()
+            method = getattr(database, insert)
+            start = time.perf_counter()
+            for i in range(0, events, batch_size):
+                method(items[i:i + batch_size])
+            elapsed = time.perf_counter() - start
+            results[f"{name}_batch_{batch_size}"] = {
+                "client_events_per_second": events / elapsed,
+                "statements_per_event": database.connection.statements / events,
+                "commits_per_event": database.connection.commits / events
+            }
+    return results
+
+
+# Times sleep event inserts, directly and through the SleepEventWriter
+def benchmark_inserts(events=20000, batch_sizes=(1, 50)):
+    """
+    Time event inserts into the SQLite stand-in, per batch size, and through a SleepEventWriter: how long
+    take_sleep_timestamp blocks the detection loop and how fast the writer thread drains its queue
+
+    :param int events: Number of sleep events inserted per measurement
+    :param tuple batch_sizes: Events per transaction of the direct inserts
+
+    :return dict: Events per second of every path and the enqueue latency percentiles of the writer
+    """
+    from sleep_event_writer import SleepEventWriter
+    from datetime import timedelta
+
+    base = datetime(2024, 1, 1)
+    timestamps = [base + timedelta(milliseconds=i) for i in range(events)] # Unique, so every event is inserted
+
+    results = {}
+    for batch_size in batch_sizes:
+        database = SQLiteSleepDatabase()
+        start = time.perf_counter()
+        for i in range(0, events, batch_size):
+            database.insert_sleep_timestamps(timestamps[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        results[f"direct_batch_{batch_size}"] = {"events": database.count(), "events_per_second": events / elapsed}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = SQLiteSleepDatabase()
+        writer = SleepEventWriter(database, spool_path=os.path.join(directory, "bench.spool"), max_pending=events)
+        window = LatencyWindow(events)
+        start = time.perf_counter()
+        for _ in range(events):
+            event_start = time.perf_counter()
+            writer.take_sleep_timestamp()
+            window.record(time.perf_counter() - event_start)
+        enqueued = time.perf_counter() - start
+        deadline = time.monotonic() + 60.0
+        while writer.inserted + writer.spooled < events and time.monotonic() < deadline:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        writer.close()
+        results["writer"] = {
+            "events": writer.inserted,
+            "enqueue_per_second": events / enqueued,
+            "events_per_second": events / elapsed,
+            "enqueue_latency": window.summary()
+        }
+    return results
+
+
+# Collects the versions and machine the results were measured on
+def environment():
+    """
+    :return dict: Date, Python, platform, CPU count and library versions
+    """
+    info = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__
+    }
+    for module in ("cv2", "mediapipe"):
+        try:
+            info[module] = __import__(module).__version__
+        except Exception:
+            info[module] = None
+    return info
+
+
+# Flattens nested results into dotted keys
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+# Compares a run against a baseline run
+def compare_results(baseline, current, tolerance=0.15):
+    """
+    Find the measurements that got worse by more than the tolerance
+
+    Throughputs (fps, per_second, speedup) must not drop and latencies (_us, p50_ms, p95_ms) and costs
+    (_per_event) must not rise. A benchmark of the current run that now fails, or a measurement of the baseline
+    missing from a benchmark that ran, is a regression too. Benchmarks left out of the current run are skipped.
+
+    :param dict baseline: Results of the baseline run
+    :param dict current: Results of the current run
+    :param float tolerance: Allowed relative change
+
+    :return list: (key, baseline value, current value or error) of every regression, current is None when missing
+    """
+    regressions = []
+    for benchmark in sorted(baseline.keys() & current.keys()):
+        if "error" in current[benchmark] and "error" not in baseline[benchmark]:
+            regressions.append((f"{benchmark}.error", None, current[benchmark]["error"]))
+            continue
+        old, new = _flatten(baseline[benchmark], f"{benchmark}."), _flatten(current[benchmark], f"{benchmark}.")
+        for key in sorted(old):
+            name = key.rsplit(".", 1)[-1]
+            if name in ("fps", "speedup") or name.endswith("per_second"):
+                worse = key not in new or new[key] < old[key] * (1.0 - tolerance)
+            elif name.endswith("_us") or name in ("p50_ms", "p95_ms") or name.endswith("_per_event"):
+                worse = key not in new or new[key] > old[key] * (1.0 + tolerance)
+            else:
+                continue
+            if worse:
+                regressions.append((key, old[key], new.get(key)))
+    return regressions
+
+
+# Runs the selected benchmarks
+def run_benchmarks(names, frames=60, video_path=None, stream_frames=100000, events=20000, cascade_path=None):
+    """
+    Runs every selected benchmark, recording the error of a benchmark that can't run here instead of stopping
+
+    :param list names: Benchmarks to run, out of "ear", "face_mesh", "eye_backend", "detection", "inserts" and "sleep_database"
+    :param int frames: Timed frames per resolution of the face mesh and eye backend benchmarks
+    :param str video_path: Recorded video for the face mesh and eye backend benchmarks (default: synthetic frames)
+    :param int stream_frames: Frames of the synthetic landmark stream
+    :param int events: Sleep events of the insert and sleep_database benchmarks
+    :param str cascade_path: Face cascade of the eye backend benchmark (default: see EyeLandmarkBackend)
+
+    :return dict: Results per benchmark
+    """
+    benchmarks = {
+        "ear": lambda: benchmark_ear(),
+        "face_mesh": lambda: benchmark_face_mesh(frames=frames, video_path=video_path),
+        "eye_backend": lambda: benchmark_face_mesh(frames=frames, video_path=video_path, landmark_backend="opencv_eyes",
+                                                   generator_options={"cascade_path": cascade_path}),
+        "detection": lambda: benchmark_detection(stream_frames),
+        "inserts": lambda: benchmark_inserts(events),
+        "sleep_database": lambda: benchmark_sleep_database(events)
+    }
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        try:
+            results[name] = benchmarks[name]()
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+
+# Allows the benchmarks to be run from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DriveGuard performance benchmarks")
+    parser.add_argument("--only", default="ear,face_mesh,eye_backend,detection,inserts,sleep_database", help="Comma-separated benchmarks to run")
+    parser.add_argument("--video", default=None, help="Recorded drive for the landmark benchmarks (default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=60, help="Timed frames per landmark benchmark resolution")
+    parser.add_argument("--stream-frames", type=int, default=100000, help="Frames of the synthetic landmark stream")
+    parser.add_argument("--events", type=int, default=20000, help="Sleep events of the insert benchmarks")
+    parser.add_argument("--cascade", default=None, help="Face cascade XML of the eye backend benchmark (needed with OpenCV 5)")
+    parser.add_argument("--output", default="bench_output.json", help="JSON file receiving the results")
+    parser.add_argument("--compare", default=None, help="Baseline JSON file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change before a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only.split(","), args.frames, args.video, args.stream_frames, args.events, args.cascade)
+    with open(args.output, "w") as output_file:
+        json.dump({"environment": environment(), "results": results}, output_file, indent=2)
+
+    for key, value in _flatten(results).items():
+        print(f"{key:<60} {value:>14.3f}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name}: skipped ({result['error']})")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(json.load(baseline_file)["results"], results, args.tolerance)
+        for key, old, new in regressions:
+            if old is None:
+                print(f"REGRESSION {key}: {new}")
+            elif new is None:
+                print(f"REGRESSION {key}: {old:.3f} -> missing")
+            else:
+                print(f"REGRESSION {key}: {old:.3f} -> {new:.3f}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,359 @@
+import argparse
+import json
+import threading
+import time
+import cv2 as cv
+from sleep_detector import SleepDetector
+
+
+class StreamSink:
+    """
+    A class that stands in for the database and microcontroller of one stream
+
+    Every stream gets its own sink, which counts the stream's sleep events and forwards them to the database
+    writer and alert channel shared by all streams.
+    """
+
+    # Initializes StreamSink
+    def __init__(self, name, database, microcontroller=None):
+        """
+        :param str name: Name of the stream
+        :param class database: Shared SleepEventWriter (or SleepDatabase)
+        :param class microcontroller: Shared MicroConnection (default: no hardware alert)
+
+        :return None
+        """
+        self.name = name
+        self.database = database
+        self.microcontroller = microcontroller
+        self.events = 0 # Sleep events detected on this stream
+
+
+    # Forwards a sleep event to the shared database writer, recorded under the stream name
+    def take_sleep_timestamp(self):
+        self.events += 1
+        self.database.take_sleep_timestamp(self.name)
+
+
+    # Forwards a per-minute drowsiness aggregate to the shared database writer, tagged with the stream name
+    def take_drowsiness_metrics(self, row):
+        self.database.take_drowsiness_metrics({**row, "stream": self.name})
+
+
+    # Forwards the warning to the shared alert channel
+    def sleep_warning(self, duration=None, captured_at=None):
+        print(f"{self.name}: driver asleep")
+        if self.microcontroller is not None:
+            self.microcontroller.sleep_warning(duration, captured_at) # Overlapping warnings of several streams merge into one alert
+
+
+class CameraStream:
+    """
+    A class that holds the capture, detector, state and metrics of one camera stream
+    """
+
+    # Initializes CameraStream
+    def __init__(self, name, detector):
+        """
+        Opens the stream's capture on its own thread
+
+        :param str name: Name of the stream
+        :param class detector: SleepDetector of the stream, with a StreamSink as database and microcontroller
+
+        :return None
+        :raises IOError: If the video source cannot be opened
+        """
+        self.name = name
+        self.detector = detector
+        detector.threaded_capture = True # A stalled camera only blocks its own capture thread
+        self.capture = detector.open_capture()
+        if not self.capture.isOpened():
+            self.capture.release()
+            raise IOError(f"Error: couldn't open the video {detector.video_path} of stream {name}!")
+
+        self.live = isinstance(detector.video_path, int)
+        fps = self.capture.get(cv.CAP_PROP_FPS)
+        self.video_fps = fps if fps > 0 else SleepDetector.NOMINAL_FPS
+        self.busy = False # Set while a worker processes one of its frames
+        self.finished = False # Set once the source ended
+        self.errors = 0 # Frames that failed to process
+        self.last_frame = None # time.monotonic() the last frame was taken for processing
+        self.started = time.monotonic()
+
+
+    # Takes the newest captured frame without waiting
+    def take_frame(self):
+        """
+        :return tuple ret, frame, timestamp: Whether a frame was waiting, the frame and its capture time
+        """
+        ret, frame, timestamp = self.capture.read_with_timestamp(timeout=0)
+        if not ret and not self.capture.isOpened():
+            self.finished = True
+        return ret, frame, timestamp
+
+
+    # Runs detection on one frame of the stream
+    def process(self, frame, timestamp):
+        """
+        Runs the stream's SleepDetector on a frame, honoring its adaptive scheduler and max_frame_age
+
+        :param numpy.ndarray frame: Video frame
+        :param float timestamp: time.monotonic() capture time of the frame
+
+        :return None
+        """
+        detector = self.detector
+        self.last_frame = time.monotonic()
+        detector.frames_read += 1
+        frame_time = timestamp if self.live else (detector.frames_read - 1) / self.video_fps
+
+        detector.frame_delay = time.monotonic() - timestamp
+        if detector.max_frame_age is not None and detector.frame_delay > detector.max_frame_age:
+            detector.stale_frames += 1
+            return
+        if detector.scheduler is not None and not detector.scheduler.should_process(frame_time):
+            detector.skipped_frames += 1
+            return
+
+        start = time.perf_counter()
+        detector.process_frame(frame, timestamp, frame_time)
+        detector.latency_monitor.record("frame", time.perf_counter() - start)
+        detector.latency_monitor.tick()
+
+
+    # Summarizes the state and metrics of the stream
+    def summary(self):
+        """
+        :return dict: Frame counts, processing rate, sleep state and per-stage latencies of the stream
+        """
+        detector = self.detector
+        elapsed = time.monotonic() - self.started
+        return {
+            "frames_read": detector.frames_read,
+            "frames_processed": detector.frames_processed,
+            "processed_fps": round(detector.frames_processed / elapsed, 2) if elapsed > 0 else None,
+            "dropped_frames": self.capture.dropped_frames,
+            "stale_frames": detector.stale_frames,
+            "skipped_frames": detector.skipped_frames,
+            "errors": self.errors,
+            "asleep": detector.asleep,
+            "sleep_events": detector.database.events,
+            "drowsiness": detector.metrics.summary() if detector.metrics is not None else None,
+            "last_frame_age_s": round(time.monotonic() - self.last_frame, 3) if self.last_frame else None,
+            "finished": self.finished,
+            "latency": detector.latency_monitor.summary()
+        }
+
+
+class CameraSupervisor:
+    """
+    A class that runs several camera streams in one process with one database writer and one alert channel
+
+    Each stream has its own capture thread, SleepDetector, FaceMeshGenerator and metrics. A small pool of
+    worker threads serves the streams round-robin, only taking frames that are already captured, so a camera
+    that stalls is skipped instead of holding up the others, and no stream can take turns from the rest.
+    """
+
+    # Initializes CameraSupervisor
+    def __init__(self, streams, database=None, microcontroller=None, workers=None, idle_wait=0.005):
+        """
+        Creates the shared writer and a CameraStream per stream configuration
+
+        :param list streams: One dictionary per stream: "name", "video_path", optional "generator" (landmark backend
+                             keyword arguments) and any other SleepDetector keyword arguments (landmark_backend, frame_budget...)
+        :param class database: Shared SleepEventWriter (default: a new one)
+        :param class microcontroller: Shared MicroConnection (default: no hardware alert)
+        :param int workers: Number of inference threads (default: one per stream, at most 4)
+        :param float idle_wait: Seconds a worker waits when no stream has a frame ready
+
+        :return None
+        """
+        from sleep_event_writer import SleepEventWriter
+
+        self.database = database if database else SleepEventWriter()
+        self.microcontroller = microcontroller
+        self.workers = workers if workers else min(len(streams), 4)
+        self.idle_wait = idle_wait
+
+        self.streams = []
+        for i, config in enumerate(streams):
+            config = dict(config)
+            name = config.pop("name", f"stream{i}")
+            sink = StreamSink(name, self.database, microcontroller)
+            detector = SleepDetector(
+                video_path=config.pop("video_path"),
+                ear_threshold=config.pop("ear_threshold", 0.24),
+                consec_frames=config.pop("consec_frames", 90),
+                asleep=False,
+                database=sink,
+                microcontroller=sink,
+                generator_options=config.pop("generator", {}),
+                headless=True,
+                **config
+            )
+            self.streams.append(CameraStream(name, detector))
+
+        self.running = False
+        self._lock = threading.Lock()
+        self._cursor = 0 # Stream the next round-robin search starts at
+        self._threads = []
+
+
+    # Picks the next stream with a frame ready
+    def _next_frame(self):
+        """
+        Round-robin search for a stream that isn't being processed and has a captured frame
+
+        :return tuple: (stream, frame, timestamp), or None if no stream has a frame ready
+        """
+        with self._lock:
+            count = len(self.streams)
+            for offset in range(count):
+                stream = self.streams[(self._cursor + offset) % count]
+                if stream.busy or stream.finished:
+                    continue
+                ret, frame, timestamp = stream.take_frame()
+                if ret:
+                    stream.busy = True
+                    self._cursor = (self._cursor + offset + 1) % count # The next search starts after this stream
+                    return stream, frame, timestamp
+            return None
+
+
+    # Processes frames until stopped, runs in each worker thread
+    def _work(self):
+        """
+        Worker thread: processes the frame of the next ready stream, or waits briefly when none is ready
+
+        :return None
+        """
+        while self.running:
+            item = self._next_frame()
+            if item is None:
+                if all(stream.finished for stream in self.streams):
+                    self.running = False
+                    return
+                time.sleep(self.idle_wait)
+                continue
+
+            stream, frame, timestamp = item
+            try:
+                stream.process(frame, timestamp)
+            except Exception as e:
+                stream.errors += 1
+                print(f"{stream.name}: {e}")
+            finally:
+                stream.busy = False
+
+
+    # Starts the worker threads
+    def start(self):
+        """
+        :return None
+        """
+        self.running = True
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+
+    # Runs until every stream ended or stop() is called
+    def run(self, report_interval=None, reporter=None):
+        """
+        Starts the workers and waits for them, reporting the stream metrics periodically
+
+        :param float report_interval: Seconds between reports (default: no reports)
+        :param function reporter: Called as reporter(summary) on each report (default: print_summary)
+
+        :return dict: Final summary of every stream
+        """
+        self.start()
+        reporter = reporter if reporter else print_summary
+        last_report = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                time.sleep(0.1)
+                if report_interval is not None and time.monotonic() - last_report >= report_interval:
+                    reporter(self.summary())
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return self.summary()
+
+
+    # Summarizes every stream
+    def summary(self):
+        """
+        :return dict: Stream name to its CameraStream summary
+        """
+        return {stream.name: stream.summary() for stream in self.streams}
+
+
+    # Stops the workers and releases every capture
+    def stop(self, timeout=2.0):
+        """
+        Stops the worker threads and the stream captures, the shared writer and alert channel stay open
+
+        :param float timeout: Seconds to wait for each worker thread
+
+        :return None
+        """
+        self.running = False
+        for thread in self._threads:
+            thread.join(timeout)
+        for stream in self.streams:
+            stream.capture.release()
+            stream.detector.flush_metrics()
+
+
+# Prints one line per stream, usable as a reporter
+def print_summary(summary):
+    """
+    :param dict summary: Summary returned by CameraSupervisor.summary
+
+    :return None
+    """
+    for name, stream in summary.items():
+        print(f"{name:<12} frames {stream['frames_processed']:>7} ({stream['processed_fps']} fps)"
+              f"  dropped {stream['dropped_frames']:>5}  asleep {int(stream['asleep'])}  events {stream['sleep_events']}")
+
+
+# Reads a supervisor configuration file
+def load_config(path):
+    """
+    Read a JSON configuration of the form
+    {"workers": 2, "microcontroller": {"port": "COM5"}, "streams": [{"name": "driver", "video_path": 0}, ...]}
+
+    "microcontroller" holds MicroConnection keyword arguments, or null to run without the alert hardware.
+
+    :param str path: Path of the configuration file
+
+    :return dict: The configuration
+    """
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+# Allows the supervisor to be run from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run sleep detection on several camera streams")
+    parser.add_argument("config", help="JSON configuration of the streams")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between stream reports")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    from sleep_event_writer import SleepEventWriter
+    from micro_connection import MicroConnection
+
+    microcontroller = MicroConnection(**config["microcontroller"]) if config.get("microcontroller") is not None else None
+    writer = SleepEventWriter() # One writer and database connection shared by every stream
+    supervisor = CameraSupervisor(config["streams"], writer, microcontroller, config.get("workers"))
+    try:
+        print_summary(supervisor.run(args.report_interval))
+    finally:
+        if microcontroller is not None:
+            microcontroller.close()
+        writer.close()
@@ -3,19 +3,53 @@ import digitalio
 import time
 import usb_cdc
 import pwmio
+import supervisor
 
-# Set up LEDs
-led = digitalio.DigitalInOut(board.D3)
-led.direction = digitalio.Direction.OUTPUT
+# Serial commands (single bytes are kept for older hosts)
+# b'1'                  Alert with the default pattern at full intensity
+# b'0'                  Stop the alert
+# b'?'                  Readiness ping, answered with b'R'
+# b'#A<p><i>\n'         Alert with pattern digit <p> (see PATTERNS) and intensity digit <i> (1-9)
+# b'#S\n'               Stop the alert
+FRAME_START = ord('#')
+FRAME_END = ord('\n')
+MAX_FRAME_LENGTH = 8 # Longer frames are discarded as noise, up to their FRAME_END
 
-# Set up buzzer
-buzzer = pwmio.PWMOut(board.D2, duty_cycle=0, frequency=2000, variable_frequency=True)
+# Buzzer on time, buzzer off time (milliseconds) and whether the servo sweeps, for each alert pattern
+PATTERNS = (
+    (1000, 0, True), # 0: Steady buzzer (default)
+    (250, 250, True), # 1: Pulsed buzzer
+    (100, 100, True), # 2: Fast beeping
+    (0, 1000, False) # 3: Silent, LED only
+)
+DEFAULT_PATTERN = 0
+MAX_INTENSITY = 9
 
-# Set up servo
-servo = pwmio.PWMOut(board.D4, duty_cycle = 0, frequency=50)
+MAX_BUZZER_DUTY = 60000 # Buzzer duty cycle at full intensity
+BUZZER_FREQUENCY = 2000
 
-# Set up reference to serial channel
-usb = usb_cdc.data
+SWEEP_ANGLES = tuple(range(0, 181, 10)) + tuple(range(180, -1, -10)) # Servo sweeps back and forth once per alert
+SERVO_STEP_MS = 20 # Milliseconds between servo steps
+LOOP_SLEEP = 0.002 # Delay per loop iteration, keeps commands handled within milliseconds
+
+# supervisor.ticks_ms() is an integer that wraps around every 2**29 ms (about 6.2 days), unlike time.monotonic(),
+# a float that loses millisecond resolution after a few hours of uptime
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+# Computes the milliseconds from tick b to tick a
+def ticks_diff(a, b):
+    # """
+    # Difference of two supervisor.ticks_ms() values that stays correct across the wrap around
+
+    # :param int a: Later tick
+    # :param int b: Earlier tick
+
+    # :return int: a - b in milliseconds, valid for differences up to TICKS_HALFPERIOD
+    # """
+    return ((a - b + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
 
 
 # Converts angle to PWM duty cycle for the servo motor
@@ -32,30 +66,163 @@ def angle_to_duty_cycle(angle):
     return int(min_duty + (angle / 180) * (max_duty - min_duty)) # Calculate duty cycle between the min and max
 
 
-while True:
-    if usb.in_waiting > 0: # Check for data 
-        data = usb.read(1)
-        if data: # Checks if data is received
-            if data == b'1': # Turn everything on
-                led.value = True
-
-                buzzer.frequency = 2000
-                buzzer.duty_cycle = 60000
-                
-                # Sweeps servo motor back and forth
-                for angle in range(0, 181, 10):
-                    servo.duty_cycle = angle_to_duty_cycle(angle)
-                    time.sleep(0.02)
-                for angle in range(180, -1, -10):
-                    servo.duty_cycle = angle_to_duty_cycle(angle)
-                    time.sleep(0.02)
-
-                # Release servo position/torque
-                servo.duty_cycle = 0
-                
-            elif data == b'0': # Turn everything off
-                led.value = False
-                buzzer.duty_cycle = 0
-                servo.duty_cycle = 0
-
-    time.sleep(0.05) # Delay for processing
\ No newline at end of file
+class CommandParser:
+    # """
+    # Turns the bytes received over serial into commands, one byte at a time
+
+    # Commands are ("alert", pattern, intensity), ("stop",) or ("ping",)
+    # """
+
+    # Initializes CommandParser
+    def __init__(self):
+        self.frame = None # Bytes of the frame being received, None outside a frame
+        self.discarding = False # Skipping the rest of a too long frame until its FRAME_END
+
+    # Feeds one received byte, returns a command once one is complete
+    def feed(self, byte):
+        # """
+        # :param int byte: Received byte
+
+        # :return tuple: Completed command, or None
+        # """
+        if self.discarding:
+            self.discarding = byte != FRAME_END # Bytes of a garbled frame are never read as single-byte commands
+            return None
+
+        if self.frame is None:
+            if byte == FRAME_START:
+                self.frame = bytearray()
+            elif byte == ord('1'):
+                return ("alert", DEFAULT_PATTERN, MAX_INTENSITY)
+            elif byte == ord('0'):
+                return ("stop",)
+            elif byte == ord('?'):
+                return ("ping",)
+            return None
+
+        if byte != FRAME_END:
+            self.frame.append(byte)
+            if len(self.frame) > MAX_FRAME_LENGTH:
+                self.frame = None
+                self.discarding = True # Drops the rest of the frame, waits for the next one
+            return None
+
+        frame, self.frame = self.frame, None
+        if frame == b'S':
+            return ("stop",)
+        if len(frame) == 3 and frame[0] == ord('A'):
+            pattern = frame[1] - ord('0')
+            intensity = frame[2] - ord('0')
+            if 0 <= pattern < len(PATTERNS) and 1 <= intensity <= MAX_INTENSITY:
+                return ("alert", pattern, intensity)
+        return None # Unknown or malformed frame
+
+
+class AlertController:
+    # """
+    # Drives the LED, buzzer and servo as a time-sliced state machine
+
+    # update() only does the work due at the given time and returns right away, so the main loop
+    # can keep reading commands while an alert runs
+    # """
+
+    # Initializes AlertController
+    def __init__(self, led, buzzer, servo):
+        self.led = led
+        self.buzzer = buzzer
+        self.servo = servo
+        self.active = False
+        self.pattern = PATTERNS[DEFAULT_PATTERN]
+        self.buzzer_duty = MAX_BUZZER_DUTY
+        self.started = 0 # supervisor.ticks_ms() the alert (or its latest pattern) started
+        self.sweep_started = 0 # supervisor.ticks_ms() the servo sweep started
+        self.sweep_step = len(SWEEP_ANGLES) # Next servo step, len(SWEEP_ANGLES) when the sweep is done
+
+    # Applies a command from the CommandParser
+    def handle(self, command, now):
+        if command[0] == "alert":
+            self.start(command[1], command[2], now)
+        elif command[0] == "stop":
+            self.stop()
+
+    # Turns everything on with a pattern and intensity
+    def start(self, pattern, intensity, now):
+        # A new alert while one is running only changes the pattern/intensity, the servo keeps its sweep
+        restart_sweep = not self.active
+        self.active = True
+        self.pattern = PATTERNS[pattern]
+        self.buzzer_duty = MAX_BUZZER_DUTY * intensity // MAX_INTENSITY
+        self.started = now
+
+        self.led.value = True
+        self.buzzer.frequency = BUZZER_FREQUENCY
+        if restart_sweep and self.pattern[2]:
+            self.sweep_started = now
+            self.sweep_step = 0
+        self.update(now)
+
+    # Turns everything off
+    def stop(self):
+        self.active = False
+        self.sweep_step = len(SWEEP_ANGLES)
+        self.led.value = False
+        self.buzzer.duty_cycle = 0
+        self.servo.duty_cycle = 0
+
+    # Does the buzzer and servo work due at time now
+    def update(self, now):
+        if not self.active:
+            return
+        on_time, off_time, _ = self.pattern
+        elapsed = ticks_diff(now, self.started)
+
+        # Buzzer follows the on/off cycle of the pattern
+        if off_time == 0 or elapsed % (on_time + off_time) < on_time:
+            self.buzzer.duty_cycle = self.buzzer_duty
+        else:
+            self.buzzer.duty_cycle = 0
+
+        # Servo moves one step every SERVO_STEP_MS, then releases its position/torque
+        if self.sweep_step < len(SWEEP_ANGLES):
+            due_step = min(ticks_diff(now, self.sweep_started) // SERVO_STEP_MS, len(SWEEP_ANGLES))
+            if due_step >= len(SWEEP_ANGLES):
+                self.servo.duty_cycle = 0
+                self.sweep_step = len(SWEEP_ANGLES)
+            elif due_step >= self.sweep_step:
+                self.servo.duty_cycle = angle_to_duty_cycle(SWEEP_ANGLES[due_step])
+                self.sweep_step = due_step + 1
+
+
+# Sets up the hardware and runs the command loop
+def main():
+    # Set up LEDs
+    led = digitalio.DigitalInOut(board.D3)
+    led.direction = digitalio.Direction.OUTPUT
+
+    # Set up buzzer
+    buzzer = pwmio.PWMOut(board.D2, duty_cycle=0, frequency=BUZZER_FREQUENCY, variable_frequency=True)
+
+    # Set up servo
+    servo = pwmio.PWMOut(board.D4, duty_cycle = 0, frequency=50)
+
+    # Set up reference to serial channel
+    usb = usb_cdc.data
+
+    controller = AlertController(led, buzzer, servo)
+    parser = CommandParser()
+
+    while True:
+        now = supervisor.ticks_ms()
+        if usb.in_waiting > 0: # Check for data
+            for byte in usb.read(usb.in_waiting): # Handles every received byte right away, even mid-alert
+                command = parser.feed(byte)
+                if command and command[0] == "ping":
+                    usb.write(b'R') # Tells the host the board is ready
+                elif command:
+                    controller.handle(command, now)
+        controller.update(now)
+        time.sleep(LOOP_SLEEP) # Short delay, servo steps and buzzer pulses are timed by update
+
+
+if __name__ == "__main__":
+    main()
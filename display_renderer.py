@@ -0,0 +1,187 @@
+import threading
+import time
+import numpy as np
+import cv2 as cv
+
+
+class DisplayRenderer:
+    """
+    A class that draws the preview on its own thread at a limited frame rate and shows it from the caller's thread
+
+    The detection loop only hands over the latest frame with its eye landmarks and moves on. The renderer thread
+    takes the newest frame once per display interval and resizes and draws it, so frames submitted while it is busy
+    or waiting are skipped and the drawing never slows detection down. The window calls (imshow, waitKey) stay on
+    the thread that calls pump(), normally the main thread, since HighGUI isn't supported on other threads on
+    macOS and with some Qt builds.
+    """
+
+    POLL_INTERVAL = 0.03 # Seconds between window event checks while no new frame was drawn
+
+    # Initializes DisplayRenderer
+    def __init__(self, window_name="DriveGuard", size=(1280, 720), fps=30.0, latency_monitor=None):
+        """
+        Starts the renderer thread
+
+        :param str window_name: Title of the preview window
+        :param tuple size: (width, height) of the preview in pixels
+        :param float fps: Maximum number of frames shown per second
+        :param class latency_monitor: LatencyMonitor receiving the draw and display latencies (default: none)
+
+        :return None
+        :raises ValueError: If fps is not positive
+        """
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+
+        self.window_name = window_name
+        self.size = size
+        self.fps = fps
+        self.latency_monitor = latency_monitor
+        self.closed = False # Set once 'p' is pressed or the window is closed
+        self.rendered = 0 # Frames drawn
+        self.shown = 0 # Frames shown in the window
+        self.skipped = 0 # Frames replaced by a newer one before they were drawn
+
+        # Two preview buffers: the renderer draws into one while the caller shows the other
+        self._buffers = [np.empty((size[1], size[0], 3), dtype=np.uint8) for _ in range(2)]
+        self._ready = None # Index of the drawn buffer waiting to be shown
+        self._showing = None # Index of the buffer the caller is showing
+        self._pending = None # Latest submitted (frame, points, color)
+        self._next_render = 0.0 # time.monotonic() the next frame may be drawn at
+        self._last_poll = 0.0 # time.monotonic() of the last waitKey
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    # Checks if a submitted frame would be drawn
+    def due(self):
+        """
+        Lets the caller skip preparing (e.g. copying) frames that the rate limit would drop anyway
+
+        :return bool: Whether the display interval has passed and no frame is waiting to be drawn
+        """
+        return self._pending is None and time.monotonic() >= self._next_render
+
+
+    # Hands a frame over to the renderer
+    def submit(self, frame, points=None, color=None):
+        """
+        Replaces the frame waiting to be drawn, returns without drawing anything
+
+        The frame is kept by reference and must not be modified afterwards, the points are copied.
+
+        :param numpy.ndarray frame: Video frame to show
+        :param numpy.ndarray points: (points, 2) eye landmark pixel coordinates to draw (default: none)
+        :param tuple color: BGR color of the landmarks
+
+        :return None
+        """
+        points = None if points is None else np.array(points, dtype=np.float32)
+        with self._condition:
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = (frame, points, color)
+            self._condition.notify()
+
+
+    # Shows the latest drawn frame and handles the window events
+    def pump(self):
+        """
+        Called by the detection loop on the thread that owns the window (the main thread) after every frame
+
+        Shows a newly drawn preview, and checks the keys and window state when a frame was shown or every
+        POLL_INTERVAL, so the loop doesn't pay for waitKey on every frame.
+
+        :return bool: Whether the preview was closed ('p' pressed or window closed)
+        """
+        with self._condition:
+            ready, self._ready = self._ready, None
+            if ready is not None:
+                self._showing = ready
+        if ready is None and (not self.shown or time.monotonic() - self._last_poll < self.POLL_INTERVAL):
+            return self.closed
+
+        start = time.perf_counter()
+        if ready is not None:
+            cv.imshow(self.window_name, self._buffers[ready])
+            self.shown += 1
+        key = cv.waitKey(1)
+        self._last_poll = time.monotonic()
+        if ready is not None and self.latency_monitor is not None:
+            self.latency_monitor.record("display", time.perf_counter() - start)
+        if key & 0xFF == ord('p') or cv.getWindowProperty(self.window_name, cv.WND_PROP_VISIBLE) < 1:
+            self.closed = True
+        return self.closed
+
+
+    # Draws the latest frame at most fps times per second until stopped
+    def _run(self):
+        """
+        Renderer thread: draws the latest frame into the buffer the caller isn't showing, then waits out the
+        display interval
+
+        :return None
+        """
+        interval = 1.0 / self.fps
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._stopped)
+                if self._stopped:
+                    return
+                pending, self._pending = self._pending, None
+                target = 1 if self._showing == 0 else 0
+                if self._ready == target:
+                    self._ready = None # Replaced by the newer frame drawn below
+
+            self._render(self._buffers[target], *pending)
+            with self._condition:
+                self._ready = target
+            self.rendered += 1
+            self._next_render = time.monotonic() + interval
+
+            # Frames submitted during the display interval replace each other, only the newest is drawn
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped, max(0.0, self._next_render - time.monotonic()))
+
+
+    # Draws a frame into a preview buffer
+    def _render(self, buffer, frame, points, color):
+        """
+        Resizes the frame into the buffer and draws the eye landmarks scaled to the preview
+
+        :param numpy.ndarray buffer: Preview buffer to draw into
+        :param numpy.ndarray frame: Video frame to show
+        :param numpy.ndarray points: (points, 2) eye landmark pixel coordinates, or None
+        :param tuple color: BGR color of the landmarks
+
+        :return None
+        """
+        start = time.perf_counter()
+        cv.resize(frame, self.size, dst=buffer)
+        if points is not None:
+            # Maps the landmarks from frame pixels to preview pixels in one operation
+            points *= (self.size[0] / frame.shape[1], self.size[1] / frame.shape[0])
+            for x, y in points.astype(np.int32).tolist():
+                cv.circle(buffer, (x, y), 4, color, cv.FILLED) # Draws circle on each eye landmark
+        if self.latency_monitor is not None:
+            self.latency_monitor.record("draw", time.perf_counter() - start)
+
+
+    # Stops the renderer and closes the window
+    def close(self, timeout=1.0):
+        """
+        Stops the renderer thread and closes the preview window, from the thread that calls pump()
+
+        :param float timeout: Seconds to wait for the renderer thread to finish
+
+        :return None
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self.shown:
+            cv.destroyWindow(self.window_name)
@@ -1,23 +1,61 @@
+import time
+started_at = time.monotonic() # Startup reference for the time to the first processed frame
+
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+from landmark_backends import create_backend
+from micro_connection import MicroConnection
+from latency_stats import LatencyMonitor
 from sleep_detector import SleepDetector
 from sleep_database import SleepDatabase
+from sleep_event_writer import SleepEventWriter
+
+
+VIDEO_PATH = 0 # Change number for video path depending on intended webcam
+LANDMARK_BACKEND = "mediapipe" # "opencv_eyes" for the eye-only backend on CPUs too slow for the face mesh
+FRAME_BUDGET = None # Seconds per frame the face mesh may take before switching to opencv_eyes (None: never switch)
 
+# Loads the face mesh model, opens the camera, waits for the microcontroller and connects to the database at the
+# same time, so startup takes as long as the slowest step instead of all of them added up
+latency_monitor = LatencyMonitor()
+with ThreadPoolExecutor(max_workers=4) as startup:
+    generator_future = startup.submit(create_backend, LANDMARK_BACKEND, FRAME_BUDGET)
+    capture_future = startup.submit(cv.VideoCapture, VIDEO_PATH)
+    microcontroller_future = startup.submit(MicroConnection, latency_monitor=latency_monitor)
+    database_future = startup.submit(SleepDatabase)
+
+    # Initializes sleep database, detection still starts if it is unreachable (the writer keeps retrying)
+    try:
+        sleep_database = database_future.result()
+    except Exception as e:
+        print(f"Database unavailable at startup: {e}")
+        sleep_database = None
 
-# Initializes sleep database
-sleep_database = SleepDatabase()
 """
 Uncomment each of the 2 following method calls to display sleep trends/info from database
 """
 #sleep_database.most_common_sleep_hour()
 #sleep_database.plot_sleep_trend()
 
+# Uploads sleep timestamps on a background thread so a slow database never stalls the video
+sleep_writer = SleepEventWriter(sleep_database)
+
 # Initializes sleep detector
 sleep_detector = SleepDetector(
-        video_path=0, # Change number for video path depending on intended webcam
+        video_path=VIDEO_PATH,
         ear_threshold=0.24, # Calibration for eye detection
         consec_frames=90, # Approximately 3 seconds for sleep
         asleep=False,
-        database=sleep_database # Passes the already created database connection to be used within the SleepDetector class
+        database=sleep_writer, # Passes the already created database connection, through the write-behind queue, to be used within the SleepDetector class
+        generator=generator_future.result(),
+        microcontroller=microcontroller_future.result(),
+        latency_monitor=latency_monitor,
+        capture=capture_future.result(), # Camera opened during startup
+        started_at=started_at # Prints the time to the first processed frame
     )
 sleep_detector.process_video() # Initializes video capture
 
-sleep_database.close_connection() # Closes database connection
\ No newline at end of file
+sleep_detector.microcontroller.close() # Turns off any active alert and closes the serial port
+sleep_writer.close() # Uploads (or spools) the remaining sleep timestamps
+if sleep_database is not None:
+    sleep_database.close_connection() # Closes database connection
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class DriverFaceSelector:
+    """
+    A class that picks which of the detected faces is the driver
+
+    Policies:
+    - "largest": the face with the largest bounding box, normally the one closest to the camera
+    - "region": the largest face whose center lies inside seat_region, no driver if nobody is in it
+    - "nearest": the face closest to the last driver position (the largest one until a driver was seen)
+    """
+
+    POLICIES = ("largest", "region", "nearest")
+
+    # Initializes DriverFaceSelector
+    def __init__(self, policy="largest", seat_region=None):
+        """
+        Initializes the selector with its policy
+
+        :param str policy: One of POLICIES
+        :param tuple seat_region: (x0, y0, x1, y1) driver seat area as fractions of the frame size, used by "region"
+
+        :return None
+        :raises ValueError: If the policy is unknown, or "region" is used without a seat_region
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown driver policy {policy!r}, use one of {', '.join(self.POLICIES)}")
+        if policy == "region" and seat_region is None:
+            raise ValueError("The region policy needs a seat_region")
+
+        self.policy = policy
+        self.seat_region = None if seat_region is None else np.asarray(seat_region, dtype=np.float64)
+        self.last_center = None # (x, y) pixel center of the last selected driver face
+
+
+    # Picks the driver among the detected faces
+    def select(self, boxes, frame_size):
+        """
+        Selects the driver face from the face bounding boxes
+
+        :param numpy.ndarray boxes: (faces, 4) array of (x0, y0, x1, y1) pixel boxes
+        :param tuple frame_size: (width, height) of the frame in pixels
+
+        :return int: Index of the driver face, or None if no face qualifies
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return None
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        areas = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+        candidates = np.arange(len(boxes))
+
+        if self.policy == "region":
+            region = self.seat_region * np.tile(frame_size, 2) # Fractions to pixels
+            inside = np.all((centers >= region[:2]) & (centers <= region[2:]), axis=1)
+            candidates = candidates[inside]
+            if len(candidates) == 0:
+                return None
+
+        if self.policy == "nearest" and self.last_center is not None:
+            distances = np.hypot(*(centers[candidates] - self.last_center).T)
+            driver = candidates[np.argmin(distances)]
+        else:
+            driver = candidates[np.argmax(areas[candidates])]
+
+        self.last_center = centers[driver]
+        return int(driver)
@@ -0,0 +1,262 @@
+import math
+import time
+import uuid
+from datetime import datetime
+import numpy as np
+
+
+class SlidingWindow:
+    """
+    A class that keeps the (time, value) samples of the last window_seconds in a fixed-size ring of arrays
+
+    The sum of the values is kept up to date on every push, so the mean and count over the window cost O(1)
+    and no memory is allocated after construction. Each sample is evicted exactly once, so a push is O(1)
+    amortized. If more than capacity samples arrive within the window, the oldest ones are evicted early.
+    """
+
+    # Initializes SlidingWindow
+    def __init__(self, window_seconds, capacity):
+        """
+        :param float window_seconds: Length of the window in seconds
+        :param int capacity: Maximum number of samples kept
+
+        :return None
+        """
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.times = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.clear()
+
+
+    # Empties the window
+    def clear(self):
+        self.start = 0 # Position of the oldest sample
+        self.count = 0
+        self.total = 0.0 # Sum of the values in the window
+
+
+    # Adds a sample and evicts the samples that left the window
+    def push(self, sample_time, value):
+        """
+        :param float sample_time: Time of the sample in seconds, not earlier than the previous sample
+        :param float value: Value of the sample
+
+        :return None
+        """
+        self.evict(sample_time)
+        if self.count == self.capacity:
+            self._pop()
+        end = (self.start + self.count) % self.capacity
+        self.times[end] = sample_time
+        self.values[end] = value
+        self.count += 1
+        self.total += value
+
+
+    # Evicts the samples older than the window
+    def evict(self, now):
+        """
+        :param float now: Current time in seconds
+
+        :return None
+        """
+        oldest = now - self.window_seconds
+        while self.count and self.times[self.start] <= oldest:
+            self._pop()
+
+
+    # Removes the oldest sample
+    def _pop(self):
+        self.total -= float(self.values[self.start])
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        if self.count == 0:
+            self.total = 0.0 # Drops the rounding error accumulated by the running sum
+
+
+    # Returns the mean value over the window
+    def mean(self):
+        """
+        :return float: Mean of the values in the window (None if empty)
+        """
+        return self.total / self.count if self.count else None
+
+
+class DrowsinessMetrics:
+    """
+    A class that estimates drowsiness indicators from the per-frame EAR in O(1) time and fixed memory per frame
+
+    - smoothed EAR: exponential moving average of the EAR
+    - PERCLOS: fraction of the face frames of the last window_seconds with the eyes closed
+    - blink rate: eye closures shorter than max_blink_seconds per minute, over the last window_seconds
+    - blink duration: mean duration of those blinks
+
+    It also sums the same indicators per minute, update returns the aggregate of every finished minute so it
+    can be logged as one row instead of one row per frame. The periods follow the wall clock (with the default
+    aggregate_seconds, from hh:mm:00 to hh:mm+1:00), so a partial period flushed at a stop or restart has the
+    same label as the rest of its minute and the database merges them.
+    """
+
+    # Initializes DrowsinessMetrics
+    def __init__(self, ear_threshold, window_seconds=60.0, smoothing=0.3, max_blink_seconds=1.0, max_fps=60.0,
+                 aggregate_seconds=60.0):
+        """
+        :param float ear_threshold: Threshold of which eyes are considered closed
+        :param float window_seconds: Length of the sliding PERCLOS/blink window in seconds
+        :param float smoothing: Weight of the newest EAR in the moving average (1.0 disables smoothing)
+        :param float max_blink_seconds: Longest eye closure counted as a blink, longer ones are microsleeps
+        :param float max_fps: Highest expected frame rate, sizes the rings so a full window fits
+        :param float aggregate_seconds: Length of each logged aggregate
+
+        :return None
+        """
+        self.ear_threshold = ear_threshold
+        self.window_seconds = window_seconds
+        self.smoothing = smoothing
+        self.max_blink_seconds = max_blink_seconds
+        self.aggregate_seconds = aggregate_seconds
+
+        frames = max(2, math.ceil(window_seconds * max_fps))
+        self.closed_frames = SlidingWindow(window_seconds, frames) # 1.0 for closed eyes, 0.0 for open eyes
+        self.blinks = SlidingWindow(window_seconds, frames // 2) # Duration of each blink, at its end time
+        self._minute = None # Sums of the current aggregate
+        self._minute_start = None # Wall clock start of the current aggregate, in seconds since the epoch
+        self.reset()
+
+
+    # Forgets every frame seen so far
+    def reset(self):
+        """
+        Empties the windows and the moving average, the current aggregate is kept until flushed
+
+        :return None
+        """
+        self.closed_frames.clear()
+        self.blinks.clear()
+        self.smoothed_ear = None
+        self.closed_since = None # Frame time the current eye closure started
+        self.started = None # Frame time of the first update
+        self.last_time = None # Frame time of the last update
+        self._wall_offset = None # time.time() minus frame time, labels the aggregates with wall clock minutes
+
+
+    # Updates every indicator with a frame
+    def update(self, frame_time, ear):
+        """
+        A frame time earlier than the last one starts over, as when a new recording is processed.
+
+        :param float frame_time: Time of the frame in seconds, increasing
+        :param float ear: Mean EAR of the frame (None or NaN without a face)
+
+        :return dict: Aggregate of the previous period when this frame starts a new one, otherwise None
+        """
+        finished = None
+        if self.last_time is not None and frame_time < self.last_time:
+            finished = self.flush()
+            self.reset()
+        if self.started is None:
+            self.started = frame_time
+            self._wall_offset = time.time() - frame_time
+        self.last_time = frame_time
+
+        wall_time = frame_time + self._wall_offset
+        if self._minute_start is None or wall_time - self._minute_start >= self.aggregate_seconds:
+            finished = self.flush() or finished
+            self._minute_start = wall_time - wall_time % self.aggregate_seconds # Start of the wall clock period
+            self._minute = [0, 0.0, 0, 0, 0.0] # Face frames, EAR sum, closed frames, blinks, blink duration sum
+
+        if ear is None or ear != ear:
+            return finished # Without a face the eye state is unknown, the windows are left as they are
+
+        self.smoothed_ear = ear if self.smoothed_ear is None else self.smoothed_ear + self.smoothing * (ear - self.smoothed_ear)
+        closed = ear < self.ear_threshold
+        self.closed_frames.push(frame_time, 1.0 if closed else 0.0)
+        self.blinks.evict(frame_time)
+
+        minute = self._minute
+        minute[0] += 1
+        minute[1] += ear
+        if closed:
+            minute[2] += 1
+            if self.closed_since is None:
+                self.closed_since = frame_time
+        elif self.closed_since is not None:
+            duration = frame_time - self.closed_since
+            self.closed_since = None
+            if duration <= self.max_blink_seconds:
+                self.blinks.push(frame_time, duration)
+                minute[3] += 1
+                minute[4] += duration
+        return finished
+
+
+    # Returns the aggregate of the current period and starts a new one
+    def flush(self):
+        """
+        :return dict: minute (wall clock start of the period), face_frames, mean_ear, perclos, blinks and
+                      mean_blink_duration of the period, and a random flush_id that makes re-inserting it harmless,
+                      or None if nothing was aggregated
+        """
+        minute, self._minute = self._minute, None
+        if minute is None:
+            return None
+        face_frames, ear_sum, closed, blinks, blink_sum = minute
+        start = self._minute_start
+        self._minute_start = None
+        return {
+            "minute": datetime.fromtimestamp(start),
+            "face_frames": face_frames,
+            "mean_ear": ear_sum / face_frames if face_frames else None,
+            "perclos": closed / face_frames if face_frames else None,
+            "blinks": blinks,
+            "mean_blink_duration": blink_sum / blinks if blinks else None,
+            "flush_id": uuid.uuid4().hex
+        }
+
+
+    # Checks if a whole window was seen
+    def ready(self, frame_time):
+        """
+        :param float frame_time: Time of the current frame in seconds
+
+        :return bool: Whether the indicators cover a full window, so they can trigger alerts
+        """
+        return self.started is not None and frame_time - self.started >= self.window_seconds
+
+
+    # Fraction of the face frames in the window with the eyes closed
+    def perclos(self):
+        """
+        :return float: PERCLOS over the window (None without face frames)
+        """
+        return self.closed_frames.mean()
+
+
+    # Blinks per minute over the window
+    def blink_rate(self):
+        """
+        :return float: Blinks per minute
+        """
+        return self.blinks.count * 60.0 / self.window_seconds
+
+
+    # Mean blink duration over the window
+    def blink_duration(self):
+        """
+        :return float: Mean blink duration in seconds (None without blinks)
+        """
+        return self.blinks.mean()
+
+
+    # Returns every indicator
+    def summary(self):
+        """
+        :return dict: smoothed_ear, perclos, blink_rate and blink_duration
+        """
+        return {
+            "smoothed_ear": self.smoothed_ear,
+            "perclos": self.perclos(),
+            "blink_rate": self.blink_rate(),
+            "blink_duration": self.blink_duration()
+        }
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class EyeAspectRatioKernel:
+    """
+    A class to calculate the eye aspect ratio (EAR) of several eyes and faces in one batched NumPy operation
+    """
+
+    # Initializes EyeAspectRatioKernel
+    def __init__(self, eyes, landmark_ids=None, max_faces=1):
+        """
+        Initialize the kernel with the landmark indices of each eye and preallocate its buffers
+
+        Each eye is given as the 6 landmark IDs p1-p6 used by the EAR formula. When the landmarks are
+        passed as a subset (see FaceMeshGenerator.create_face_mesh indices), landmark_ids lists the
+        IDs in the order they appear in that subset.
+
+        :param list eyes: List of 6-point landmark ID lists, one per eye
+        :param list landmark_ids: Landmark IDs of the subset array (default: full 468-point array)
+        :param int max_faces: Number of faces to preallocate buffers for
+
+        :return None
+        :raises ValueError: If an eye does not have exactly 6 points or uses an ID missing from landmark_ids
+        """
+        if any(len(eye) != 6 for eye in eyes):
+            raise ValueError("Each eye needs exactly 6 landmark indices")
+
+        # Translate landmark IDs to positions within the subset array
+        if landmark_ids is not None:
+            positions = {landmark_id: pos for pos, landmark_id in enumerate(landmark_ids)}
+            try:
+                eyes = [[positions[landmark_id] for landmark_id in eye] for eye in eyes]
+            except KeyError as e:
+                raise ValueError(f"Landmark {e} is not in landmark_ids")
+
+        ids = np.asarray(eyes, dtype=np.intp)
+        self.num_eyes = len(eyes)
+
+        # Point pairs for the distances (p2, p6), (p3, p5) and (p1, p4) of every eye, gathered with one np.take
+        pairs = ids[:, [1, 2, 0]].ravel(), ids[:, [5, 4, 3]].ravel()
+        self._pairs = np.concatenate(pairs)
+
+        self.max_faces = 0
+        self._faces = None
+        self._allocate(max(1, max_faces), np.int32)
+
+
+    # Allocates the buffers reused between frames
+    def _allocate(self, max_faces, dtype):
+        """
+        Allocate the point, distance and result buffers for the given number of faces
+
+        :param int max_faces: Number of faces the buffers hold
+        :param dtype: Data type of the landmark coordinates
+
+        :return None
+        """
+        pairs = self.num_eyes * 3
+        self.max_faces = max_faces
+        self._points = np.empty((max_faces, 2 * pairs, 2), dtype=dtype)
+        self._diff = np.empty((max_faces, pairs, 2), dtype=np.float32)
+        self._dist = np.empty((max_faces, pairs), dtype=np.float32)
+        self._ear = np.empty((max_faces, self.num_eyes), dtype=np.float32)
+        self._faces = None # Forces the views to be rebuilt
+
+
+    # Builds the buffer views for a number of faces
+    def _build_views(self, faces):
+        """
+        Slice the buffers into the views used by compute, so they are only rebuilt when the face count changes
+
+        :param int faces: Number of faces processed
+
+        :return None
+        """
+        pairs = self.num_eyes * 3
+        self._faces = faces
+        self._points_view = self._points[:faces]
+        self._first_view = self._points_view[:, :pairs]
+        self._second_view = self._points_view[:, pairs:]
+        self._diff_view = self._diff[:faces]
+        self._dx_view = self._diff_view[..., 0]
+        self._dy_view = self._diff_view[..., 1]
+        self._dist_view = self._dist[:faces]
+        dist = self._dist_view.reshape(faces, self.num_eyes, 3)
+        self._vertical_1, self._vertical_2, self._width = dist[..., 0], dist[..., 1], dist[..., 2]
+        self._ear_view = self._ear[:faces]
+
+
+    # Calculates the EAR of every eye for every face
+    def compute(self, landmarks, all_faces=False):
+        """
+        Calculate the eye aspect ratio of every eye in one batched operation
+
+        EAR = (||p2-p6|| + ||p3-p5||) / (2||p1-p4||)
+
+        The returned array is a view into a buffer reused on the next call.
+
+        :param numpy.ndarray landmarks: Landmark coordinates of shape (faces, points, 2)
+        :param bool all_faces: Calculate every face instead of only the first one
+
+        :return numpy.ndarray: float32 array of shape (faces, eyes) with the EAR of each eye
+        """
+        faces = landmarks.shape[0] if all_faces else min(1, landmarks.shape[0])
+        if faces > self.max_faces or landmarks.dtype != self._points.dtype:
+            self._allocate(max(faces, self.max_faces), landmarks.dtype)
+        if faces != self._faces:
+            self._build_views(faces)
+
+        # Gathers both points of every distance, then takes all euclidean distances at once
+        np.take(landmarks[:faces], self._pairs, axis=1, out=self._points_view, mode='clip')
+        np.subtract(self._first_view, self._second_view, out=self._diff_view)
+        np.hypot(self._dx_view, self._dy_view, out=self._dist_view)
+
+        # Combines the three distances of each eye into its ratio
+        ear = self._ear_view
+        np.add(self._vertical_1, self._vertical_2, out=ear)
+        np.divide(ear, self._width, out=ear)
+        ear *= 0.5
+        return ear
@@ -0,0 +1,5 @@
+# Stand-in for the CircuitPython board module, to run code.py on a computer (see firmware_stubs/simulate.py)
+# Pins are plain names, the stub peripherals only keep them for inspection
+D2 = "D2"
+D3 = "D3"
+D4 = "D4"
@@ -0,0 +1,18 @@
+# Stand-in for the CircuitPython digitalio module, to run code.py on a computer (see firmware_stubs/simulate.py)
+
+
+class Direction:
+    INPUT = "input"
+    OUTPUT = "output"
+
+
+class DigitalInOut:
+    # """
+    # Digital pin that only remembers its direction and value
+    # """
+
+    # Initializes DigitalInOut
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.value = False
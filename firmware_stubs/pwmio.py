@@ -0,0 +1,14 @@
+# Stand-in for the CircuitPython pwmio module, to run code.py on a computer (see firmware_stubs/simulate.py)
+
+
+class PWMOut:
+    # """
+    # PWM output that only remembers its duty cycle and frequency
+    # """
+
+    # Initializes PWMOut
+    def __init__(self, pin, duty_cycle=0, frequency=500, variable_frequency=False):
+        self.pin = pin
+        self.duty_cycle = duty_cycle
+        self.frequency = frequency
+        self.variable_frequency = variable_frequency
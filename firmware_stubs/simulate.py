@@ -0,0 +1,68 @@
+import importlib.util
+import os
+import sys
+
+# Runs the command parser, the alert state machine and the tick arithmetic of code.py against the stub
+# CircuitPython modules of this folder: python firmware_stubs/simulate.py
+STUBS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, STUBS)
+
+import board
+import digitalio
+import pwmio
+import supervisor
+
+
+# Loads code.py under another name, "code" is also a standard library module
+def load_firmware():
+    """
+    :return module: code.py, imported with the stub modules
+    """
+    spec = importlib.util.spec_from_file_location("firmware", os.path.join(os.path.dirname(STUBS), "code.py"))
+    firmware = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(firmware)
+    return firmware
+
+
+# Feeds bytes to a parser and collects the commands
+def parse(firmware, data):
+    parser = firmware.CommandParser()
+    return [command for command in map(parser.feed, data) if command]
+
+
+# Checks the parser, ticks_diff and the alert state machine, raises AssertionError on a failure
+def main():
+    firmware = load_firmware()
+
+    # Single bytes, frames, and garbled frames whose bytes must not be read as commands
+    assert parse(firmware, b'1?0') == [("alert", 0, 9), ("ping",), ("stop",)]
+    assert parse(firmware, b'#A25\n#S\n') == [("alert", 2, 5), ("stop",)]
+    assert parse(firmware, b'#A9\n#A25\n') == [("alert", 2, 5)] # Unknown pattern is ignored
+    assert parse(firmware, b'#xxxxxxxxx10101\n0') == [("stop",)] # Too long frame is skipped up to its end
+
+    # Tick differences across the wrap around
+    top = firmware.TICKS_MAX
+    assert firmware.ticks_diff(5, top - 4) == 10
+    assert firmware.ticks_diff(top - 4, 5) == -10
+    supervisor.set_ticks_ms(top - 100)
+    assert 0 <= firmware.ticks_diff(supervisor.ticks_ms(), top - 100) < 50
+
+    # Alert started right before the wrap around: pulsed buzzer, servo sweep, then an early stop
+    led = digitalio.DigitalInOut(board.D3)
+    buzzer = pwmio.PWMOut(board.D2)
+    servo = pwmio.PWMOut(board.D4)
+    controller = firmware.AlertController(led, buzzer, servo)
+    start = top - 30
+    controller.start(1, 9, start)
+    assert led.value and buzzer.duty_cycle == firmware.MAX_BUZZER_DUTY
+    controller.update((start + 260) % firmware.TICKS_PERIOD) # Off half of the 250 ms pulse, after the wrap
+    assert buzzer.duty_cycle == 0 and controller.sweep_step == 260 // firmware.SERVO_STEP_MS + 1
+    controller.update((start + 510) % firmware.TICKS_PERIOD)
+    assert buzzer.duty_cycle == firmware.MAX_BUZZER_DUTY
+    controller.handle(("stop",), (start + 520) % firmware.TICKS_PERIOD)
+    assert not led.value and buzzer.duty_cycle == 0 and servo.duty_cycle == 0
+    print("code.py checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# Stand-in for the CircuitPython supervisor module, to run code.py on a computer (see firmware_stubs/simulate.py)
+import time
+
+TICKS_PERIOD = 1 << 29 # Same wrap around as CircuitPython's ticks_ms
+
+_offset = 0 # Milliseconds added to the clock, lets a run start right before the wrap around
+
+
+# Milliseconds since an arbitrary start, wrapping around like on the board
+def ticks_ms():
+    return (time.monotonic_ns() // 1000000 + _offset) % TICKS_PERIOD
+
+
+# Moves the clock so that ticks_ms() currently returns ticks
+def set_ticks_ms(ticks):
+    global _offset
+    _offset = (ticks - time.monotonic_ns() // 1000000) % TICKS_PERIOD
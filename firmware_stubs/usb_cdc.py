@@ -0,0 +1,39 @@
+# Stand-in for the CircuitPython usb_cdc module, to run boot.py and code.py on a computer (see firmware_stubs/simulate.py)
+
+
+class Serial:
+    # """
+    # Data port backed by two byte buffers: send() queues bytes from the host, written holds the board's answers
+    # """
+
+    # Initializes Serial
+    def __init__(self):
+        self.received = bytearray() # Bytes sent by the host, not read by code.py yet
+        self.written = bytearray() # Bytes code.py wrote back to the host
+
+    # Queues bytes as if the host had sent them
+    def send(self, data):
+        self.received += data
+
+    @property
+    def in_waiting(self):
+        return len(self.received)
+
+    # Reads up to size received bytes
+    def read(self, size=1):
+        data = bytes(self.received[:size])
+        del self.received[:size]
+        return data
+
+    # Writes bytes back to the host
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+
+data = Serial()
+
+
+# Matches usb_cdc.enable called by boot.py, the stub data port is always on
+def enable(console=True, data=False):
+    pass
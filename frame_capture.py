@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+import cv2 as cv
+
+
+class FrameCapture:
+    """
+    A class that reads frames from a video source on its own thread into a small bounded queue
+
+    Every frame is stored with its capture timestamp. With drop_stale the queue follows a "latest frame wins"
+    policy: when it is full the oldest frame is discarded, so a slow consumer always gets the freshest frames
+    instead of a backlog of old ones.
+    """
+
+    # Initializes FrameCapture
+    def __init__(self, video_path, queue_size=1, drop_stale=True):
+        """
+        Opens the video source and starts the capture thread
+
+        :param video_path: Camera index or path of a video file
+        :param int queue_size: Maximum number of frames waiting to be processed
+        :param bool drop_stale: Discard the oldest frame when the queue is full (otherwise the capture thread waits)
+
+        :return None
+        :raises ValueError: If queue_size is smaller than 1
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+
+        self.cap = cv.VideoCapture(video_path)
+        self.drop_stale = drop_stale
+        self.dropped_frames = 0 # Frames discarded because a newer one arrived
+
+        self._frames = deque(maxlen=queue_size) # Holds (frame, timestamp) pairs
+        self._queue_size = queue_size
+        self._condition = threading.Condition()
+        self._stopped = not self.cap.isOpened()
+
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        if not self._stopped:
+            self._thread.start()
+
+
+    # Reads frames on the capture thread until the source ends or release is called
+    def _capture_loop(self):
+        """
+        Continuously reads frames and pushes them into the queue with their capture timestamp
+
+        :return None
+        """
+        while True:
+            ret, frame = self.cap.read()
+            timestamp = time.monotonic() # Taken right after the frame is read
+
+            with self._condition:
+                if not ret or self._stopped:
+                    self._stopped = True
+                    self._condition.notify_all()
+                    return
+
+                if len(self._frames) == self._queue_size:
+                    if self.drop_stale:
+                        self.dropped_frames += 1 # The deque discards the oldest frame on append
+                    else:
+                        # Waits for the consumer so no frame of a recording is lost
+                        self._condition.wait_for(lambda: len(self._frames) < self._queue_size or self._stopped)
+                        if self._stopped:
+                            return
+
+                self._frames.append((frame, timestamp))
+                self._condition.notify_all()
+
+
+    # Checks if frames can still be read
+    def isOpened(self):
+        """
+        Mirrors cv.VideoCapture.isOpened: True while the source is running or frames are still queued
+
+        :return bool: Whether another frame may be read
+        """
+        with self._condition:
+            return not self._stopped or len(self._frames) > 0
+
+
+    # Gets a property of the underlying video capture
+    def get(self, prop_id):
+        """
+        Returns a property of the underlying cv.VideoCapture
+
+        :param int prop_id: OpenCV property ID (e.g. cv.CAP_PROP_FPS)
+
+        :return float: Property value
+        """
+        return self.cap.get(prop_id)
+
+
+    # Takes the oldest queued frame with its timestamp
+    def read_with_timestamp(self, timeout=None):
+        """
+        Waits for the next queued frame
+
+        :param float timeout: Seconds to wait for a frame (default: wait until one arrives or the source ends)
+
+        :return tuple ret, frame, timestamp: Whether a frame was read, the frame and its time.monotonic() capture time
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._frames) > 0 or self._stopped, timeout)
+            if not self._frames:
+                return False, None, None
+            frame, timestamp = self._frames.popleft()
+            self._condition.notify_all() # Wakes the capture thread if it waits for space
+            return True, frame, timestamp
+
+
+    # Reads the next frame like cv.VideoCapture.read
+    def read(self):
+        """
+        Mirrors cv.VideoCapture.read
+
+        :return tuple ret, frame: Whether a frame was read and the frame
+        """
+        ret, frame, _ = self.read_with_timestamp()
+        return ret, frame
+
+
+    # Stops the capture thread and releases the video source
+    def release(self):
+        """
+        Stops the capture thread, releases the video capture and clears the queue
+
+        :return None
+        """
+        with self._condition:
+            self._stopped = True
+            self._frames.clear()
+            self._condition.notify_all()
+
+        if self._thread.is_alive():
+            self._thread.join()
+        self.cap.release()
@@ -0,0 +1,303 @@
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import cv2 as cv
+
+
+# Maps an existing shared memory block without taking ownership of it
+def _attach(name):
+    """
+    Attach to the frame ring created by the main process
+
+    Only the main process unlinks the ring. The spawned processes share its resource tracker, so on older
+    Pythons their registration of the ring is the same entry that the main process removes on unlink.
+
+    :param str name: Name of the shared memory block
+
+    :return SharedMemory: The attached block
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+# Reads frames into the shared ring, runs in the capture process
+def _capture_process(video_path, live, slots, workers, connection, free_slots, frames, results, stop):
+    """
+    Opens the source, reports the frame shape, then reads every frame straight into a free ring slot
+
+    A live camera never waits for a slot: frames arriving while every slot is busy are grabbed without decoding
+    and dropped, so the workers always get fresh frames. Recordings wait for a slot so no frame is lost.
+
+    :return None
+    """
+    cap = cv.VideoCapture(video_path)
+    ret, first = cap.read() if cap.isOpened() else (False, None)
+    if not ret:
+        connection.send(None)
+        cap.release()
+        return
+    connection.send((first.shape, cap.get(cv.CAP_PROP_FPS)))
+    block = _attach(connection.recv())
+    ring = np.ndarray((slots,) + first.shape, dtype=np.uint8, buffer=block.buf)
+
+    index = 0
+    dropped = 0
+    pending = (first, time.monotonic()) # Frame read while probing the source
+    try:
+        while not stop.is_set():
+            try:
+                slot = free_slots.get(block=not live, timeout=None if live else 0.1)
+            except queue.Empty:
+                if live:
+                    if pending is None and not cap.grab(): # Waits for the next camera frame and discards it
+                        break
+                    pending = None
+                    dropped += 1
+                continue
+
+            if pending is not None:
+                np.copyto(ring[slot], pending[0])
+                timestamp = pending[1]
+                pending = None
+            else:
+                ret, frame = cap.read(ring[slot]) # Decodes into the slot itself
+                timestamp = time.monotonic()
+                if not ret:
+                    free_slots.put(slot)
+                    break
+                if not np.shares_memory(frame, ring[slot]):
+                    np.copyto(ring[slot], frame)
+            frames.put((slot, index, timestamp))
+            index += 1
+    finally:
+        for _ in range(workers):
+            frames.put(None) # Stops the workers once the queued frames are done
+        results.put(("end", index, dropped))
+        cap.release()
+        del ring
+        block.close()
+
+
+# Runs the face mesh on ring slots, runs in each inference process
+def _inference_worker(ring_name, shape, slots, landmark_backend, frame_budget, generator_options, indices, all_faces,
+                      frames, results):
+    """
+    Maps the ring, runs the landmark backend on the frames it is handed and returns only their landmark arrays
+
+    :return None
+    """
+    from landmark_backends import create_backend
+
+    generator = create_backend(landmark_backend, frame_budget, **generator_options)
+    block = _attach(ring_name)
+    ring = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=block.buf)
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            slot, index, timestamp = item
+            try:
+                _, landmarks = generator.create_face_mesh(ring[slot], draw=False, as_array=True, indices=indices, all_faces=all_faces)
+                landmarks = landmarks.copy() # The generator reuses its buffer
+            except Exception as e: # A frame the backend can't handle must not stop the worker, the others wait for its index
+                print(f"Inference failed on frame {index}: {e}")
+                landmarks = np.zeros((0, len(indices), 2), dtype=np.int32) # Treated as a frame without a face
+            results.put(("frame", slot, index, timestamp, landmarks))
+    finally:
+        del ring
+        block.close()
+
+
+class InferencePipeline:
+    """
+    A class that splits capture and face mesh inference across processes around a ring of shared-memory frames
+
+    The capture process decodes frames directly into free slots of the ring, inference worker processes read
+    those slots without copying and send back only the landmark arrays, and the main process gets the results
+    in frame order. The slot is only reused once the main process is done with the frame, so it can still be shown.
+    """
+
+    # Initializes InferencePipeline
+    def __init__(self, video_path, workers=2, slots=None, generator_options=None, indices=None, all_faces=False,
+                 live=None, start_timeout=10.0, landmark_backend="mediapipe", frame_budget=None):
+        """
+        Stores the pipeline settings, start() launches the processes
+
+        :param video_path: Camera index or path of a video file
+        :param int workers: Number of inference processes
+        :param int slots: Frames in the shared ring (default: two per worker plus one held by the main process)
+        :param dict generator_options: Keyword arguments of the landmark backend of each worker
+        :param list indices: Landmark IDs returned per face (default: all 468)
+        :param bool all_faces: Return every face instead of only the driver's
+        :param bool live: Drop frames when every slot is busy (default: True for camera indices)
+        :param float start_timeout: Seconds to wait for the source to deliver its first frame
+        :param str landmark_backend: Landmark backend of each worker, "mediapipe" or "opencv_eyes" (see landmark_backends.py)
+        :param float frame_budget: Switch a worker to the opencv_eyes backend while its landmarks take longer than this many seconds per frame
+
+        :return None
+        """
+        self.video_path = video_path
+        self.workers = workers
+        self.slots = slots if slots else 2 * workers + 1
+        self.generator_options = generator_options if generator_options else {}
+        self.landmark_backend = landmark_backend
+        self.frame_budget = frame_budget
+        self.indices = list(indices) if indices is not None else list(range(468))
+        self.all_faces = all_faces
+        self.live = isinstance(video_path, int) if live is None else live
+        self.start_timeout = start_timeout
+
+        self.fps = None # Frame rate reported by the source
+        self.shape = None # (height, width, channels) of the frames
+        self.frames_captured = None # Frames put into the ring, known once capture ended
+        self.dropped_frames = 0 # Camera frames dropped because every slot was busy
+        self.ring = None
+        self._block = None
+        self._processes = []
+
+
+    # Starts the capture and inference processes
+    def start(self):
+        """
+        Starts the capture process, creates the ring once the frame shape is known and starts the workers
+
+        :return None
+        :raises IOError: If the source cannot be opened or delivers no frame
+        """
+        context = multiprocessing.get_context("spawn") # MediaPipe graphs don't survive a fork
+        self._free_slots = context.Queue()
+        self._frames = context.Queue()
+        self._results = context.Queue()
+        self._stop = context.Event()
+        connection, child_connection = context.Pipe()
+
+        capture = context.Process(
+            target=_capture_process,
+            args=(self.video_path, self.live, self.slots, self.workers, child_connection,
+                  self._free_slots, self._frames, self._results, self._stop),
+            daemon=True
+        )
+        capture.start()
+        self._processes.append(capture)
+
+        # Waits for the frame shape, giving up early if the capture process died
+        info = None
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline and capture.is_alive():
+            if connection.poll(0.1):
+                info = connection.recv()
+                break
+        if info is None:
+            self.close()
+            raise IOError(f"Error: couldn't read from the video {self.video_path}!")
+        self.shape, fps = info
+        self.fps = fps if fps > 0 else None
+
+        # The main process owns the ring and unlinks it on close
+        self._block = shared_memory.SharedMemory(create=True, size=self.slots * int(np.prod(self.shape)))
+        self.ring = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=self._block.buf)
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+        connection.send(self._block.name)
+
+        for _ in range(self.workers):
+            worker = context.Process(
+                target=_inference_worker,
+                args=(self._block.name, self.shape, self.slots, self.landmark_backend, self.frame_budget,
+                      self.generator_options, self.indices, self.all_faces, self._frames, self._results),
+                daemon=True
+            )
+            worker.start()
+            self._processes.append(worker)
+
+
+    # Yields the inference results in frame order
+    def results(self, poll_interval=1.0):
+        """
+        Reorders the worker results and yields them one frame at a time
+
+        The frame is a view into the ring, valid until the next result is requested.
+
+        :param float poll_interval: Seconds between checks that the processes are still alive while waiting
+
+        :return generator: (frame_index, timestamp, landmarks, frame) tuples, landmarks of shape (faces, points, 2)
+        :raises RuntimeError: If a process died, the frames it held would never arrive
+        """
+        waiting = {} # Results that arrived ahead of their turn
+        next_index = 0
+        while self.frames_captured is None or next_index < self.frames_captured:
+            if next_index not in waiting:
+                try:
+                    message = self._results.get(timeout=poll_interval)
+                except queue.Empty:
+                    self._check_processes()
+                    continue
+                if message[0] == "end":
+                    _, self.frames_captured, self.dropped_frames = message
+                else:
+                    _, slot, index, timestamp, landmarks = message
+                    waiting[index] = (slot, timestamp, landmarks)
+                continue
+
+            slot, timestamp, landmarks = waiting.pop(next_index)
+            try:
+                yield next_index, timestamp, landmarks, self.ring[slot]
+            finally:
+                self._free_slots.put(slot) # Hands the slot back to the capture process
+            next_index += 1
+
+
+    # Raises if a pipeline process failed
+    def _check_processes(self):
+        """
+        Checks every process while waiting for a result: a crashed capture or worker process never sends the
+        frames it held, so waiting any longer would stall the pipeline forever
+
+        :return None
+        :raises RuntimeError: If a process exited with an error, or every worker exited before the last frame
+        """
+        for process in self._processes:
+            if process.exitcode not in (None, 0):
+                raise RuntimeError(f"Pipeline process {process.name} stopped unexpectedly (exit code {process.exitcode})")
+        if not any(process.is_alive() for process in self._processes[1:]):
+            raise RuntimeError("Inference workers stopped before the last frame")
+
+
+    # Stops every process and frees the ring
+    def close(self, timeout=2.0):
+        """
+        Stops capture, waits for the workers, terminates stuck processes and unlinks the shared ring
+
+        :param float timeout: Seconds to wait for each process
+
+        :return None
+        """
+        if hasattr(self, "_stop"):
+            self._stop.set()
+        for process in self._processes:
+            # Keeps reading results meanwhile, a process can't exit while its queued results are unread
+            deadline = time.monotonic() + timeout
+            while process.is_alive() and time.monotonic() < deadline:
+                try:
+                    while True:
+                        self._results.get_nowait()
+                except queue.Empty:
+                    pass
+                process.join(0.05)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+        if self._block is not None:
+            self.ring = None
+            try:
+                self._block.close()
+            except BufferError:
+                pass # A frame view is still referenced, the mapping goes away with it
+            self._block.unlink()
+            self._block = None
@@ -0,0 +1,73 @@
+class InferenceScheduler:
+    """
+    A class that decides which frames are sent through the face mesh, based on how open the eyes were last seen
+
+    While the EAR stays well above the threshold the driver is clearly awake, so only a few frames per second are
+    processed. As soon as the EAR gets close to the threshold, or no face is found, every frame is processed again.
+    An eye closure first seen after skipped frames is dated back to the last processed frame (see closure_start), so
+    skipping frames never delays an alert, at the cost of firing it up to low_rate_interval early.
+    """
+
+    # Initializes InferenceScheduler
+    def __init__(self, ear_threshold, margin=0.25, low_rate_interval=0.2):
+        """
+        Initializes the scheduler with its rates
+
+        :param float ear_threshold: Threshold of which eyes are considered closed
+        :param float margin: Fraction above ear_threshold the EAR must stay above to use the low rate
+        :param float low_rate_interval: Seconds between processed frames at the low rate
+
+        :return None
+        """
+        self.ear_threshold = ear_threshold
+        self.margin = margin
+        self.low_rate_interval = low_rate_interval
+        self.low_rate = False # Starts at full rate until open eyes are seen
+        self.last_processed = None # Frame time of the last processed frame
+        self.skipped = False # Whether frames were skipped since the last processed frame
+
+
+    # Checks if a frame should be processed
+    def should_process(self, frame_time):
+        """
+        Decides whether the frame at frame_time runs through the face mesh
+
+        :param float frame_time: Time of the frame in seconds
+
+        :return bool: True to process the frame, False to skip it
+        """
+        if not self.low_rate or self.last_processed is None:
+            return True
+        process = frame_time - self.last_processed >= self.low_rate_interval
+        self.skipped = self.skipped or not process
+        return process
+
+
+    # Returns the earliest time a closure first seen at frame_time may have started
+    def closure_start(self, frame_time):
+        """
+        Dates an eye closure back over the frames skipped before it was seen
+
+        The eyes may have closed right after the last processed (open) frame, so with skipped frames in between the
+        closure starts there. Its duration is then overestimated by at most low_rate_interval, never underestimated.
+
+        :param float frame_time: Time of the processed frame the eyes were first seen closed in
+
+        :return float: last_processed if frames were skipped since it, frame_time otherwise
+        """
+        return self.last_processed if self.skipped and self.last_processed is not None else frame_time
+
+
+    # Updates the rate with the result of a processed frame
+    def update(self, frame_time, ear):
+        """
+        Records a processed frame and picks the rate for the following frames
+
+        :param float frame_time: Time of the processed frame in seconds
+        :param float ear: Eye aspect ratio of the frame (None without a face)
+
+        :return None
+        """
+        self.last_processed = frame_time
+        self.skipped = False
+        self.low_rate = ear is not None and ear >= self.ear_threshold * (1.0 + self.margin)
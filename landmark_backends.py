@@ -0,0 +1,486 @@
+import os
+import time
+from collections import deque
+from abc import ABC, abstractmethod
+import numpy as np
+import cv2 as cv
+from driver_face import DriverFaceSelector
+
+
+class LandmarkBackend(ABC):
+    """
+    A class that defines the landmark backend interface SleepDetector consumes
+
+    A backend finds the faces of a frame and returns their landmarks in MediaPipe face mesh IDs:
+
+    - num_faces: maximum number of faces returned per frame
+    - latency_monitor: LatencyMonitor receiving the stage latencies (None for none)
+    - create_face_mesh(frame, draw, as_array, indices, all_faces): (frame, landmarks), landmarks being an int32
+      (faces, points, 2) array in indices order with as_array, otherwise a dictionary of landmark ID to (x, y)
+      (a list of them with all_faces), driver first
+    - supported_ids: landmark IDs the backend can estimate (None for all 468)
+    - reset(): forgets the tracking state, before frames of an unrelated video
+
+    FaceMeshGenerator (the full MediaPipe mesh), EyeLandmarkBackend (eye points only, OpenCV) and LandmarkReplay
+    (recorded landmarks) implement it. create_face_mesh is abstract, so a backend without it fails when it is created.
+    """
+
+    name = None # Name of the backend in BACKENDS
+    supported_ids = None
+    num_faces = 1
+    latency_monitor = None
+
+    # Forgets the tracking state, stateless backends have nothing to do
+    def reset(self):
+        pass
+
+
+    # Returns the landmarks of a frame
+    @abstractmethod
+    def create_face_mesh(self, frame, draw=True, as_array=False, indices=None, all_faces=False):
+        pass
+
+
+class EyeLandmarkBackend(LandmarkBackend):
+    """
+    A class that estimates only the eye landmarks with OpenCV, for CPUs too slow for the full face mesh
+
+    Faces are found with a Haar cascade on a downscaled grayscale frame, searching a padded box around the last
+    driver face first. The eyes are located at fixed proportions of the face box and their opening is measured
+    from the dark rows (iris, pupil, lashes) of each eye crop, so closed eyes are measured too. The eye outline
+    and EAR landmarks are then placed on an ellipse of that opening, so the EAR is ear_scale times the opening
+    divided by the eye width. The raw ratio isn't on the same scale as the face mesh EAR the detector's
+    ear_threshold was tuned on, so calibrate() sets ear_scale from open-eye frames of the driver, against the face
+    mesh when it is available; the same threshold then works whichever backend is active.
+    """
+
+    name = "opencv_eyes"
+
+    # Landmark IDs of each eye outline and of its EAR points (same as SleepDetector)
+    RIGHT_EYE = [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246]
+    LEFT_EYE = [362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385, 384, 398]
+    RIGHT_EYE_EAR = [33, 159, 158, 133, 153, 145]
+    LEFT_EYE_EAR = [362, 380, 374, 263, 386, 385]
+
+    # Eye regions as (x0, y0, x1, y1) fractions of the face box, the subject's right eye is on the image left.
+    # They start below the eyebrows, whose dark band would otherwise outweigh a closed eye.
+    EYE_REGIONS = ((0.15, 0.30, 0.45, 0.45), (0.55, 0.30, 0.85, 0.45))
+    EYE_WIDTH = 0.7 # Corner to corner eye width as a fraction of the eye region width
+
+    # Default face cascade, searched in OpenCV's data folder (opencv-python 4.x wheels) and the distro package folders.
+    # OpenCV 5 wheels don't ship the cascades, pass cascade_path there.
+    CASCADE_FILE = "haarcascade_frontalface_default.xml"
+    CASCADE_DIRS = (getattr(getattr(cv, "data", None), "haarcascades", ""), "/usr/share/opencv4/haarcascades",
+                    "/usr/share/opencv/haarcascades", "/usr/local/share/opencv4/haarcascades")
+
+    # Initializes EyeLandmarkBackend
+    def __init__(self, num_faces=1, cascade_path=None, detect_width=320, roi_padding=0.3, dark_fraction=0.15,
+                 ear_scale=1.0, driver_policy="largest", seat_region=None):
+        """
+        Loads the face cascade
+
+        :param int num_faces: Max number of faces returned
+        :param str cascade_path: Haar cascade XML of frontal faces (default: CASCADE_FILE from CASCADE_DIRS)
+        :param int detect_width: Width in pixels frames are downscaled to for the face search
+        :param float roi_padding: Padding around the last face searched first, as a fraction of the face size
+        :param float dark_fraction: Fraction of a row of the eye crop that must be dark to count as open eye
+        :param float ear_scale: Factor mapping the measured opening ratio to the face mesh EAR scale (see calibrate)
+        :param str driver_policy: How the driver is picked when several faces are found (see DriverFaceSelector)
+        :param tuple seat_region: (x0, y0, x1, y1) driver seat area as fractions of the frame, for the "region" policy
+
+        :raises RuntimeError: If the cascade cannot be found or loaded
+        """
+        cascade_path = cascade_path if cascade_path else self.find_cascade()
+        if cascade_path is None:
+            raise RuntimeError(f"Failed to initialize EyeLandmarkBackend: {self.CASCADE_FILE} not found in {', '.join(filter(None, self.CASCADE_DIRS))}. "
+                               f"OpenCV 5 doesn't ship it, pass cascade_path (it is in OpenCV's data/haarcascades and in opencv-python 4.x)")
+        self.cascade = cv.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise RuntimeError(f"Failed to initialize EyeLandmarkBackend: couldn't load the face cascade {cascade_path}")
+
+        self.num_faces = num_faces
+        self.detect_width = detect_width
+        self.roi_padding = roi_padding
+        self.dark_fraction = dark_fraction
+        self.ear_scale = ear_scale
+        self.latency_monitor = None
+        self.driver_selector = DriverFaceSelector(driver_policy, seat_region)
+        self.boxes = np.empty((0, 4), dtype=np.int32) # (x0, y0, x1, y1) face boxes of the last frame, driver first
+        self.ears = np.empty((0, 2), dtype=np.float32) # Estimated EAR of both eyes of every face of the last frame
+
+        # Unit offsets of every supported landmark from its eye center, in eye widths and openings
+        ids, eyes, offsets = [], [], []
+        for eye, (outline, ear_points) in enumerate(((self.RIGHT_EYE, self.RIGHT_EYE_EAR), (self.LEFT_EYE, self.LEFT_EYE_EAR))):
+            points = {}
+            # The outline runs from the image-left corner along the lower lid to the other corner and back along the upper lid
+            for k, landmark_id in enumerate(outline):
+                angle = np.pi - k * np.pi / 8 if k <= 8 else -(k - 8) * np.pi / 8
+                points[landmark_id] = (0.5 * np.cos(angle), 0.5 * np.sin(angle))
+            # EAR points: corners, and two vertical pairs spanning the opening
+            p1, p2, p3, p4, p5, p6 = ear_points
+            points.update({p1: (-0.5, 0.0), p4: (0.5, 0.0), p2: (-1 / 6, -0.5), p6: (-1 / 6, 0.5),
+                           p3: (1 / 6, -0.5), p5: (1 / 6, 0.5)})
+            for landmark_id, offset in points.items():
+                ids.append(landmark_id)
+                eyes.append(eye)
+                offsets.append(offset)
+        self.supported_ids = ids
+        self._eyes = np.array(eyes)
+        self._offsets = np.array(offsets, dtype=np.float32)
+        self._positions = {} # Landmark positions per requested indices tuple
+
+
+    # Looks for the default face cascade
+    @classmethod
+    def find_cascade(cls):
+        """
+        :return str: Path of the first CASCADE_FILE found in CASCADE_DIRS, or None
+        """
+        for folder in cls.CASCADE_DIRS:
+            path = os.path.join(folder, cls.CASCADE_FILE)
+            if folder and os.path.isfile(path):
+                return path
+        return None
+
+
+    # Forgets the last driver face
+    def reset(self):
+        self.boxes = self.boxes[:0]
+        self.driver_selector.last_center = None
+
+
+    # Finds the face boxes of a frame
+    def detect_faces(self, gray):
+        """
+        Searches the padded box around the last driver face first, then the whole frame
+
+        :param numpy.ndarray gray: Grayscale frame
+
+        :return numpy.ndarray: (faces, 4) int32 (x0, y0, x1, y1) pixel boxes
+        """
+        ih, iw = gray.shape
+        regions = [(0, 0, iw, ih)]
+        if len(self.boxes):
+            x0, y0, x1, y1 = self.boxes[0]
+            pad_x, pad_y = int((x1 - x0) * self.roi_padding), int((y1 - y0) * self.roi_padding)
+            regions.insert(0, (max(0, x0 - pad_x), max(0, y0 - pad_y), min(iw, x1 + pad_x), min(ih, y1 + pad_y)))
+
+        for rx0, ry0, rx1, ry1 in regions:
+            if rx1 - rx0 < 2 or ry1 - ry0 < 2: # Last face left the frame
+                continue
+            scale = min(1.0, self.detect_width / (rx1 - rx0))
+            small = cv.resize(gray[ry0:ry1, rx0:rx1], None, fx=scale, fy=scale, interpolation=cv.INTER_AREA) if scale < 1.0 else gray[ry0:ry1, rx0:rx1]
+            found = self.cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+            if len(found):
+                found = np.asarray(found, dtype=np.float64) / scale
+                boxes = np.column_stack((found[:, 0] + rx0, found[:, 1] + ry0, found[:, 0] + found[:, 2] + rx0, found[:, 1] + found[:, 3] + ry0))
+                return boxes.astype(np.int32)
+        return np.empty((0, 4), dtype=np.int32)
+
+
+    # Measures the opening of an eye
+    def eye_opening(self, crop):
+        """
+        Measures the height of the tallest band of rows that are dark enough to be the open eye
+
+        :param numpy.ndarray crop: Grayscale crop of the eye region
+
+        :return float: Opening in pixels
+        """
+        if crop.shape[0] < 3 or crop.shape[1] < 3:
+            return 0.0
+        blurred = cv.GaussianBlur(crop, (5, 5), 0)
+        _, dark = cv.threshold(blurred, 0, 1, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+        rows = dark.mean(axis=1) > self.dark_fraction
+        if not rows.any():
+            return 0.0
+        # Longest run of dark rows
+        edges = np.diff(np.concatenate(([0], rows.view(np.int8), [0])))
+        starts, ends = np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+        return float((ends - starts).max())
+
+
+    # Processes a video frame and estimates the eye landmarks
+    def create_face_mesh(self, frame, draw=True, as_array=False, indices=None, all_faces=False):
+        """
+        Estimate the eye landmarks of the driver (and the other faces with all_faces)
+
+        :param frame: Frame of video to process
+        :param draw: Whether or not to draw the face boxes and eye landmarks on the frame
+        :param bool as_array: Return landmarks as a NumPy array instead of a dictionary
+        :param list indices: Landmark IDs to return in array mode, out of supported_ids (default: all supported)
+        :param bool all_faces: Also return the faces other than the driver
+
+        :return tuple frame, landmarks: Frame and int32 (faces, points, 2) array, or dictionary (list of dictionaries with all_faces)
+        :raises ValueError: No input frame, or a requested landmark isn't an eye landmark
+        """
+        if frame is None:
+            raise ValueError("Input frame cannot be None")
+        positions = self._landmark_positions(indices)
+
+        monitor = self.latency_monitor
+        start = time.perf_counter()
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        converted = time.perf_counter()
+        boxes = self.detect_faces(gray)
+        inferred = time.perf_counter()
+
+        # Driver first, then the other faces
+        driver = self.driver_selector.select(boxes, (gray.shape[1], gray.shape[0])) if len(boxes) else None
+        if driver is None:
+            boxes = boxes[:0]
+        else:
+            order = [driver] + [face for face in range(len(boxes)) if face != driver]
+            boxes = boxes[order[:self.num_faces if all_faces else 1]]
+        self.boxes = boxes
+
+        # Eye centers, widths and openings of every face
+        geometry = np.empty((len(boxes), 2, 4), dtype=np.float32) # (cx, cy, width, opening) per eye
+        for face, (x0, y0, x1, y1) in enumerate(boxes.tolist()):
+            w, h = x1 - x0, y1 - y0
+            for eye, (ex0, ey0, ex1, ey1) in enumerate(self.EYE_REGIONS):
+                cx0, cy0, cx1, cy1 = int(x0 + ex0 * w), int(y0 + ey0 * h), int(x0 + ex1 * w), int(y0 + ey1 * h)
+                opening = self.ear_scale * self.eye_opening(gray[cy0:cy1, cx0:cx1])
+                geometry[face, eye] = ((cx0 + cx1) / 2, (cy0 + cy1) / 2, self.EYE_WIDTH * (cx1 - cx0), opening)
+        self.ears = geometry[:, :, 3] / geometry[:, :, 2]
+
+        # Places every landmark on its eye: center + offset * (width, opening)
+        eye_geometry = geometry[:, self._eyes] # (faces, supported, 4)
+        points = eye_geometry[..., :2] + self._offsets * eye_geometry[..., 2:]
+        landmarks = np.rint(points[:, positions]).astype(np.int32)
+
+        if draw:
+            for x0, y0, x1, y1 in boxes.tolist():
+                cv.rectangle(frame, (x0, y0), (x1, y1), (255, 255, 255), 1)
+            for x, y in landmarks.reshape(-1, 2).tolist():
+                cv.circle(frame, (x, y), 2, (255, 255, 255), cv.FILLED)
+
+        if monitor is not None:
+            monitor.record("color_convert", converted - start)
+            monitor.record("inference", inferred - converted)
+            monitor.record("landmarks", time.perf_counter() - inferred)
+
+        if as_array:
+            return frame, landmarks
+        ids = [self.supported_ids[pos] for pos in positions]
+        faces_dicts = [{landmark_id: (int(x), int(y)) for landmark_id, (x, y) in zip(ids, face)} for face in landmarks]
+        return frame, faces_dicts if all_faces else (faces_dicts[0] if faces_dicts else {})
+
+
+    # Calibrates the EAR scale against the face mesh or a known open-eye EAR
+    def calibrate(self, frames, reference=None, open_ear=0.3):
+        """
+        Sets ear_scale so the EAR of this backend matches the face mesh EAR the detector threshold was tuned on
+
+        Run it on frames of the driver with open eyes, e.g. the first seconds of a drive. With a reference backend
+        (a FaceMeshGenerator), the scale is the ratio of the median EAR of both backends on the same frames,
+        otherwise the median EAR is scaled to open_ear.
+
+        :param list frames: BGR frames with the driver's eyes open
+        :param class reference: Landmark backend returning the EAR landmarks on the face mesh scale (default: none)
+        :param float open_ear: Open-eye EAR on the face mesh scale, used without a reference
+
+        :return float: The new ear_scale
+        :raises ValueError: If no frame had a face found by both backends
+        """
+        from eye_aspect_ratio import EyeAspectRatioKernel
+
+        ids = sorted(set(self.RIGHT_EYE_EAR + self.LEFT_EYE_EAR))
+        kernel = EyeAspectRatioKernel([self.RIGHT_EYE_EAR, self.LEFT_EYE_EAR], landmark_ids=ids)
+        measured, expected = [], []
+        for frame in frames:
+            _, landmarks = self.create_face_mesh(frame, draw=False, as_array=True, indices=ids)
+            if not len(landmarks):
+                continue
+            ear = float(self.ears[0].mean()) / self.ear_scale # Unscaled opening ratio
+            if reference is not None:
+                _, reference_landmarks = reference.create_face_mesh(frame, draw=False, as_array=True, indices=ids)
+                if not len(reference_landmarks):
+                    continue
+                expected.append(float(kernel.compute(reference_landmarks)[0].mean()))
+            measured.append(ear)
+        if not measured or np.median(measured) <= 0:
+            raise ValueError("No open eyes found to calibrate the EAR scale on")
+        target = np.median(expected) if reference is not None else open_ear
+        self.ear_scale = float(target / np.median(measured))
+        return self.ear_scale
+
+
+    # Maps requested landmark IDs to positions in supported_ids
+    def _landmark_positions(self, indices):
+        key = tuple(indices) if indices is not None else None
+        if key not in self._positions:
+            if key is None:
+                self._positions[key] = np.arange(len(self.supported_ids))
+            else:
+                lookup = {landmark_id: pos for pos, landmark_id in enumerate(self.supported_ids)}
+                missing = [landmark_id for landmark_id in key if landmark_id not in lookup]
+                if missing:
+                    raise ValueError(f"{self.name} only estimates eye landmarks, not {missing}")
+                self._positions[key] = np.array([lookup[landmark_id] for landmark_id in key])
+        return self._positions[key]
+
+
+class AdaptiveBackend(LandmarkBackend):
+    """
+    A class that runs a primary backend and switches to a cheaper fallback when it exceeds the frame budget
+
+    Every window frames the median landmark time of the active backend is checked. Once the primary is over
+    budget, the fallback takes over; after retry_interval seconds the primary is tried again, in case the CPU
+    was only busy for a while.
+
+    With calibrate_fallback, a few frames in which the primary found a face are kept, and on the first switch the
+    fallback is calibrated against the primary on them (see EyeLandmarkBackend.calibrate), so the detector's
+    ear_threshold keeps meaning the same eye opening after the switch. The result is printed either way.
+    """
+
+    name = "adaptive"
+
+    # Initializes AdaptiveBackend
+    def __init__(self, primary, fallback, frame_budget, window=30, retry_interval=60.0, calibrate_fallback=False,
+                 calibration_frames=5):
+        """
+        :param class primary: Backend used while it stays within the budget
+        :param class fallback: Cheaper backend used while the primary is too slow
+        :param float frame_budget: Seconds a frame's landmarks may take
+        :param int window: Frames per budget check
+        :param float retry_interval: Seconds on the fallback before the primary is tried again (None to never retry)
+        :param bool calibrate_fallback: Calibrate the fallback's EAR scale against the primary on the first switch
+        :param int calibration_frames: Most recent primary frames with a face kept for the calibration
+
+        :return None
+        """
+        self.primary = primary
+        self.fallback = fallback
+        self.frame_budget = frame_budget
+        self.retry_interval = retry_interval
+        self.active = primary
+        self.switches = 0 # Times the active backend changed
+        self.switched_at = None # time.monotonic() of the last switch
+        self.num_faces = max(primary.num_faces, fallback.num_faces)
+        self._times = np.zeros(window, dtype=np.float64) # Landmark times of the active backend in the current window
+        self._count = 0
+        self.calibrate_fallback = calibrate_fallback # Cleared once the calibration was tried
+        self._samples = deque(maxlen=calibration_frames) # Frames the primary found a face in, for the calibration
+        self._sample_every = max(1, window // calibration_frames) # Fills the samples within one budget window
+
+
+    # Shares the latency monitor with both backends
+    @property
+    def latency_monitor(self):
+        return self.primary.latency_monitor
+
+    @latency_monitor.setter
+    def latency_monitor(self, monitor):
+        self.primary.latency_monitor = monitor
+        self.fallback.latency_monitor = monitor
+
+
+    # Landmark IDs of the backend currently in use
+    @property
+    def supported_ids(self):
+        return self.active.supported_ids
+
+
+    # Forgets the tracking state of both backends
+    def reset(self):
+        self.primary.reset()
+        self.fallback.reset()
+
+
+    # Switches to the other backend
+    def _switch(self, backend, reason):
+        self.active = backend
+        self.switches += 1
+        self.switched_at = time.monotonic()
+        self._count = 0
+        print(f"Landmark backend switched to {backend.name} ({reason})")
+
+
+    # Calibrates the fallback against the primary on the kept frames
+    def _calibrate(self):
+        """
+        Sets the fallback's ear_scale from the frames the primary saw before the switch, or reports why it couldn't
+
+        :return None
+        """
+        self.calibrate_fallback = False
+        try:
+            scale = self.fallback.calibrate(list(self._samples), reference=self.primary)
+            print(f"Calibrated {self.fallback.name} against {self.primary.name}: ear_scale {scale:.3f}")
+        except ValueError as e:
+            print(f"Couldn't calibrate {self.fallback.name}, ear_threshold applies to its uncalibrated ear_scale {self.fallback.ear_scale}: {e}")
+        finally:
+            self._samples.clear()
+            # Both backends ran on older frames, their tracking doesn't match the current one anymore
+            self.primary.reset()
+            self.fallback.reset()
+
+
+    # Runs the active backend and checks the budget
+    def create_face_mesh(self, frame, draw=True, as_array=False, indices=None, all_faces=False):
+        """
+        Same as the create_face_mesh of the active backend
+
+        :return tuple frame, landmarks: See LandmarkBackend
+        """
+        # Copies a calibration sample before the primary draws on the frame
+        sample = None
+        if self.calibrate_fallback and self.active is self.primary and self._count % self._sample_every == 0:
+            sample = frame.copy()
+
+        start = time.perf_counter()
+        result = self.active.create_face_mesh(frame, draw, as_array, indices, all_faces)
+        self._times[self._count % len(self._times)] = time.perf_counter() - start
+        self._count += 1
+
+        if self.active is self.primary:
+            if sample is not None and len(result[1]):
+                self._samples.append(sample)
+            if self._count >= len(self._times) and self._count % len(self._times) == 0:
+                median = float(np.median(self._times))
+                if median > self.frame_budget:
+                    if self.calibrate_fallback:
+                        self._calibrate()
+                    self._switch(self.fallback, f"{median * 1000:.1f} ms per frame, budget {self.frame_budget * 1000:.1f} ms")
+        elif self.retry_interval is not None and time.monotonic() - self.switched_at >= self.retry_interval:
+            self._switch(self.primary, "retrying")
+        return result
+
+
+# Creates the face mesh backend
+def _mediapipe(**options):
+    from FaceMeshModule import FaceMeshGenerator # Imported on use, so the OpenCV backend runs without MediaPipe
+    return FaceMeshGenerator(**options)
+
+
+BACKENDS = {"mediapipe": _mediapipe, "opencv_eyes": EyeLandmarkBackend} # Backend name to constructor
+
+SHARED_OPTIONS = ("num_faces", "driver_policy", "seat_region") # Options passed on to the fallback backend
+
+
+# Creates a landmark backend by name
+def create_backend(name="mediapipe", frame_budget=None, fallback="opencv_eyes", fallback_options=None, **options):
+    """
+    Create the configured landmark backend, wrapped in an AdaptiveBackend when a frame budget is given
+
+    :param str name: Backend name, one of BACKENDS
+    :param float frame_budget: Seconds a frame's landmarks may take before switching to the fallback (default: never switch)
+    :param str fallback: Backend name used when the budget is exceeded
+    :param dict fallback_options: Keyword arguments of the fallback backend, e.g. {"ear_scale": 1.4}; without an
+        ear_scale, the fallback is calibrated against the backend on the first switch (see AdaptiveBackend)
+    :param options: Keyword arguments of the backend; num_faces, driver_policy and seat_region also go to the fallback
+
+    :return class: The backend
+    :raises ValueError: If the backend name is unknown
+    :raises RuntimeError: If the backend cannot be initialized
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown landmark backend {name!r}, use one of {', '.join(BACKENDS)}")
+    backend = BACKENDS[name](**options)
+    if frame_budget is None or name == fallback:
+        return backend
+    fallback_options = {**{key: value for key, value in options.items() if key in SHARED_OPTIONS}, **(fallback_options or {})}
+    fallback_backend = BACKENDS[fallback](**fallback_options)
+    calibrate = "ear_scale" not in fallback_options and hasattr(fallback_backend, "calibrate")
+    return AdaptiveBackend(backend, fallback_backend, frame_budget, calibrate_fallback=calibrate)
@@ -0,0 +1,294 @@
+import argparse
+import struct
+import time
+import numpy as np
+from landmark_backends import LandmarkBackend
+
+
+MAGIC = b"DGLM" # First bytes of every landmark recording
+VERSION = 1
+HEADER = struct.Struct("<4sHcBH") # Magic, version, coordinate type ('h' int16 / 'f' float32), max faces, landmark count
+COORDINATE_TYPES = {b"h": np.int16, b"f": np.float32}
+
+
+# Builds the fixed-size record layout of a recording
+def record_dtype(num_landmarks, max_faces=1, dtype=np.int16):
+    """
+    Create the NumPy dtype of one frame record
+
+    Every record has the same size, so frame i starts at header_size + i * itemsize and the whole file can be
+    memory-mapped as one array.
+
+    :param int num_landmarks: Number of landmarks stored per face
+    :param int max_faces: Number of faces stored per frame
+    :param dtype: Coordinate type, np.int16 (pixels) or np.float32
+
+    :return numpy.dtype: Record with the capture timestamp, frame time, face count and landmark coordinates
+    """
+    return np.dtype([
+        ("timestamp", "<f8"), # time.monotonic() capture time
+        ("frame_time", "<f8"), # Time used by the sleep state machine
+        ("faces", "u1"), # Faces detected, points beyond it are zero
+        ("points", np.dtype(dtype).newbyteorder("<"), (max_faces, num_landmarks, 2))
+    ])
+
+
+class LandmarkRecorder:
+    """
+    A class that writes the per-frame landmarks of create_face_mesh to a compact binary recording
+
+    The file holds a small header with the recorded landmark IDs followed by fixed-stride frame records (see
+    record_dtype), so it can be replayed with LandmarkReplay without running the face mesh again.
+    """
+
+    # Initializes LandmarkRecorder
+    def __init__(self, path, landmark_ids, max_faces=1, dtype=np.int16, source_ids=None):
+        """
+        Creates the recording and writes its header
+
+        :param str path: Path of the recording
+        :param list landmark_ids: Landmark IDs stored per face
+        :param int max_faces: Number of faces stored per frame, further faces are dropped
+        :param dtype: Coordinate type, np.int16 (pixels, smallest) or np.float32
+        :param list source_ids: Landmark IDs of the arrays passed to write, in order (default: landmark_ids)
+
+        :return None
+        :raises ValueError: If the coordinate type is unsupported or a landmark ID is missing from source_ids
+        """
+        dtype = np.dtype(dtype)
+        codes = {np.dtype(value): code for code, value in COORDINATE_TYPES.items()}
+        if dtype not in codes:
+            raise ValueError(f"Unsupported coordinate type {dtype}, use int16 or float32")
+
+        self.landmark_ids = list(landmark_ids)
+        self.max_faces = max_faces
+        self.frames = 0
+
+        # Positions of the recorded landmarks within the arrays passed to write
+        if source_ids is None:
+            self._positions = None
+        else:
+            positions = {landmark_id: pos for pos, landmark_id in enumerate(source_ids)}
+            try:
+                self._positions = np.array([positions[landmark_id] for landmark_id in self.landmark_ids], dtype=np.intp)
+            except KeyError as e:
+                raise ValueError(f"Landmark {e} is not in source_ids")
+
+        self._record = np.zeros(1, dtype=record_dtype(len(self.landmark_ids), max_faces, dtype)) # Reused for every frame
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, codes[dtype], max_faces, len(self.landmark_ids)))
+        self.file.write(np.asarray(self.landmark_ids, dtype="<u2").tobytes())
+
+
+    # Appends one frame to the recording
+    def write(self, timestamp, frame_time, landmarks):
+        """
+        Writes the landmarks of one processed frame
+
+        :param float timestamp: time.monotonic() capture time of the frame
+        :param float frame_time: Time of the frame in seconds
+        :param numpy.ndarray landmarks: Landmark array of shape (faces, points, 2) in source_ids order (may be empty)
+
+        :return None
+        """
+        record = self._record[0]
+        faces = min(len(landmarks), self.max_faces)
+        record["timestamp"] = timestamp
+        record["frame_time"] = frame_time
+        record["faces"] = faces
+        points = record["points"]
+        if faces:
+            face_points = landmarks[:faces] if self._positions is None else landmarks[:faces, self._positions]
+            points[:faces] = face_points
+        points[faces:] = 0
+        self._record.tofile(self.file)
+        self.frames += 1
+
+
+    # Closes the recording
+    def close(self):
+        """
+        Flushes and closes the file
+
+        :return None
+        """
+        self.file.close()
+
+
+class LandmarkReplay(LandmarkBackend):
+    """
+    A class that memory-maps a landmark recording for replay
+
+    It also implements the landmark backend interface (see landmark_backends.py), so a SleepDetector can be built
+    for SleepDetector.replay_landmarks without loading MediaPipe.
+    """
+
+    name = "replay"
+
+    # Initializes LandmarkReplay
+    def __init__(self, path):
+        """
+        Reads the header and maps the frame records
+
+        :param str path: Path of a recording written by LandmarkRecorder
+
+        :return None
+        :raises ValueError: If the file is not a landmark recording
+        """
+        with open(path, "rb") as file:
+            magic, version, code, max_faces, num_landmarks = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or code not in COORDINATE_TYPES:
+                raise ValueError(f"{path} is not a landmark recording")
+            self.landmark_ids = np.frombuffer(file.read(2 * num_landmarks), dtype="<u2").astype(int).tolist()
+
+        self.path = path
+        self.max_faces = max_faces
+        self.dtype = np.dtype(COORDINATE_TYPES[code])
+        offset = HEADER.size + 2 * num_landmarks
+        dtype = record_dtype(num_landmarks, max_faces, self.dtype)
+        count = (_file_size(path) - offset) // dtype.itemsize # An unfinished last record is ignored
+        self.records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)) if count else np.zeros(0, dtype=dtype)
+
+        self.timestamps = self.records["timestamp"]
+        self.frame_times = self.records["frame_time"]
+        self.faces = self.records["faces"]
+        self.points = self.records["points"]
+
+        # Landmark backend interface
+        self.supported_ids = self.landmark_ids
+        self.num_faces = max_faces
+        self.latency_monitor = None
+        self.position = 0 # Next frame returned by create_face_mesh
+
+
+    # Returns the number of recorded frames
+    def __len__(self):
+        return len(self.records)
+
+
+    # Returns the next recorded frame in place of running the face mesh
+    def create_face_mesh(self, frame, draw=False, as_array=True, indices=None, all_faces=False):
+        """
+        Returns the landmarks of the next recorded frame, in the same format as FaceMeshGenerator.create_face_mesh
+
+        :param frame: Frame of video, returned as is
+        :param bool draw: Ignored, recordings hold no mesh to draw
+        :param bool as_array: Ignored, recorded landmarks are always returned as an array
+        :param list indices: Landmark IDs to return (default: every recorded landmark)
+        :param bool all_faces: Also return the recorded faces other than the driver
+
+        :return tuple frame, landmarks: The frame and a (faces, points, 2) landmark array, driver first
+        :raises IndexError: When the recording has ended
+        """
+        if self.position >= len(self.records):
+            raise IndexError("End of the landmark recording")
+        record = self.records[self.position]
+        self.position += 1
+        points = record["points"][:record["faces"] if all_faces else min(1, record["faces"])]
+        if indices is not None:
+            points = points[:, [self.landmark_ids.index(landmark_id) for landmark_id in indices]]
+        return frame, points
+
+
+# Returns the size of a file in bytes
+def _file_size(path):
+    with open(path, "rb") as file:
+        return file.seek(0, 2)
+
+
+# Records the landmarks of a video
+def record_video(video_path, output_path, dtype=np.int16, max_faces=1):
+    """
+    Runs a headless SleepDetector over a video and records the landmarks of every processed frame
+
+    :param str video_path: Path of the video, or a camera index
+    :param str output_path: Path of the recording
+    :param dtype: Coordinate type, np.int16 or np.float32
+    :param int max_faces: Number of faces recorded per frame
+
+    :return int: Number of recorded frames
+    :raises Exception: Whatever stopped the detector before the end of the video (the frames so far stay recorded)
+    """
+    from FaceMeshModule import FaceMeshGenerator
+    from sleep_detector import SleepDetector
+    from batch_analysis import OfflineSink
+
+    sink = OfflineSink()
+    detector = SleepDetector(video_path, ear_threshold=0.24, consec_frames=90, asleep=False, database=sink,
+                             microcontroller=sink, headless=True, generator=FaceMeshGenerator(num_faces=max_faces),
+                             other_faces=max_faces > 1)
+    recorder = LandmarkRecorder(output_path, detector.LANDMARK_IDS, max_faces=max_faces, dtype=dtype)
+    detector.landmark_recorder = recorder
+    try:
+        detector.process_video()
+    finally:
+        recorder.close()
+    if detector.error is not None:
+        raise detector.error
+    return recorder.frames
+
+
+# Replays a recording through the sleep detection
+def replay_recording(path, ear_threshold=0.24, consec_frames=90):
+    """
+    Runs EAR and check_asleep over a recording and reports the sleep events and replay speed
+
+    :param str path: Path of the recording
+    :param float ear_threshold: Threshold of which eyes are considered closed
+    :param int consec_frames: The amount of consecutive frames below the ear threshold to be considered asleep
+
+    :return dict: Frame count, replay speed and sleep events (onset and detection time in seconds)
+    """
+    from sleep_detector import SleepDetector
+    from batch_analysis import OfflineSink
+
+    # Collects the sleep events from the per-frame sleep status
+    events = []
+    def track_events(frame_index, frame_time, ear, asleep):
+        if asleep and (not events or events[-1]["end_s"] is not None):
+            events.append({"detected_s": round(float(frame_time), 3), "end_s": None})
+        elif not asleep and events and events[-1]["end_s"] is None:
+            events[-1]["end_s"] = round(float(frame_time), 3)
+
+    replay = LandmarkReplay(path)
+    sink = OfflineSink()
+    detector = SleepDetector(path, ear_threshold, consec_frames, asleep=False, database=sink, microcontroller=sink,
+                             headless=True, generator=replay, frame_callback=track_events)
+
+    start = time.perf_counter()
+    detector.replay_landmarks(replay)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "frames": len(replay),
+        "replay_s": round(elapsed, 4),
+        "frames_per_s": round(len(replay) / elapsed) if elapsed > 0 else None,
+        "sleep_events": events
+    }
+
+
+# Allows recording and replaying from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record face mesh landmarks of a video, or replay a recording")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Record the landmarks of a video")
+    record_parser.add_argument("video", help="Path of the video")
+    record_parser.add_argument("output", help="Path of the recording")
+    record_parser.add_argument("--dtype", choices=("int16", "float32"), default="int16", help="Coordinate type")
+    record_parser.add_argument("--faces", type=int, default=1, help="Faces recorded per frame")
+
+    replay_parser = commands.add_parser("replay", help="Run the sleep detection over a recording")
+    replay_parser.add_argument("recording", help="Path of the recording")
+    replay_parser.add_argument("--ear-threshold", type=float, default=0.24, help="Eye aspect ratio threshold")
+    replay_parser.add_argument("--consec-frames", type=int, default=90, help="Consecutive closed-eye frames to be asleep")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        frames = record_video(args.video, args.output, np.dtype(args.dtype), args.faces)
+        print(f"Recorded {frames} frames to {args.output}")
+    else:
+        result = replay_recording(args.recording, args.ear_threshold, args.consec_frames)
+        print(f"Replayed {result['frames']} frames in {result['replay_s']} s ({result['frames_per_s']} frames/s)")
+        for event in result["sleep_events"]:
+            print(f"Asleep at {event['detected_s']} s, awake at {event['end_s']} s")
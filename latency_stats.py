@@ -0,0 +1,179 @@
+import time
+import numpy as np
+
+
+class LatencyWindow:
+    """
+    A class that keeps the most recent latency samples of one stage in a fixed-size ring buffer
+
+    Recording a sample is a single array write, percentiles are only calculated when a summary is requested.
+    """
+
+    # Initializes LatencyWindow
+    def __init__(self, size=1024):
+        """
+        Preallocates the ring buffer
+
+        :param int size: Number of most recent samples kept
+
+        :return None
+        """
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.size = size
+        self.count = 0 # Total number of samples recorded
+
+
+    # Adds a latency sample
+    def record(self, seconds):
+        """
+        Stores a sample, overwriting the oldest one when the window is full
+
+        :param float seconds: Measured latency in seconds
+
+        :return None
+        """
+        self.samples[self.count % self.size] = seconds
+        self.count += 1
+
+
+    # Summarizes the samples in the window
+    def summary(self):
+        """
+        Calculates the p50/p95/p99 and maximum latency of the samples in the window
+
+        :return dict: Sample count and latencies in milliseconds (None if nothing was recorded)
+        """
+        n = min(self.count, self.size)
+        if n == 0:
+            return None
+        window = self.samples[:n]
+        p50, p95, p99 = np.percentile(window, (50, 95, 99)) * 1000.0
+        return {
+            "count": self.count,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(window.max() * 1000.0)
+        }
+
+
+class LatencyMonitor:
+    """
+    A class that collects per-stage latencies of the detection loop and hands summaries to exporter callbacks
+    """
+
+    # Stages recorded by SleepDetector, the landmark backends and MicroConnection, in pipeline order. Their windows
+    # exist from the start, so stages recorded from other threads don't change the dict while summary() reads it
+    STAGES = (
+        "decode", # Reading the frame from the capture (queue wait with threaded capture)
+        "color_convert", # cv.cvtColor BGR to RGB
+        "inference", # face_mesh.process
+        "landmarks", # Landmark conversion in create_face_mesh
+        "ear", # Eye aspect ratio calculation
+        "check_asleep", # Sleep state update, including the database upload on detection
+        "draw", # Resizing the preview and drawing the eye landmarks (renderer thread)
+        "display", # imshow and waitKey (DisplayRenderer.pump on the detection thread)
+        "frame", # Whole frame, from decode to handing it to the renderer
+        "capture_to_alert", # Frame capture to the alert being written to the serial port
+        "alert_write", # MicroConnection.sleep_warning being called to the '1' being written to the serial port
+        "alert_off_write", # Turning the alert off being queued to the '0' being written (MicroConnection dispatcher)
+        "time_to_first_frame" # Program start to the first processed frame (one sample per run)
+    )
+
+    # Initializes LatencyMonitor
+    def __init__(self, window_size=1024, export_interval=None):
+        """
+        Creates a latency window for every stage
+
+        :param int window_size: Number of most recent samples kept per stage
+        :param float export_interval: Seconds between automatic exports from tick() (default: only export on request)
+
+        :return None
+        """
+        self.window_size = window_size
+        self.windows = {stage: LatencyWindow(window_size) for stage in self.STAGES}
+        self.exporters = []
+        self.export_interval = export_interval
+        self._last_export = time.monotonic()
+
+
+    # Records a latency sample for a stage
+    def record(self, stage, seconds):
+        """
+        Adds a sample to the window of a stage, creating the window for stages not in STAGES
+
+        :param str stage: Name of the stage
+        :param float seconds: Measured latency in seconds
+
+        :return None
+        """
+        window = self.windows.get(stage)
+        if window is None:
+            window = self.windows[stage] = LatencyWindow(self.window_size)
+        window.record(seconds)
+
+
+    # Registers a callback that receives the summaries
+    def add_exporter(self, exporter):
+        """
+        Adds an exporter, called as exporter(summary) on every export
+
+        :param function exporter: Callback receiving the dictionary returned by summary()
+
+        :return None
+        """
+        self.exporters.append(exporter)
+
+
+    # Summarizes every stage
+    def summary(self):
+        """
+        Calculates the latency summary of every stage with samples
+
+        :return dict: Stage name to its LatencyWindow summary
+        """
+        summaries = {}
+        for stage, window in list(self.windows.items()): # A snapshot, other threads may still add stages outside STAGES
+            stage_summary = window.summary()
+            if stage_summary is not None:
+                summaries[stage] = stage_summary
+        return summaries
+
+
+    # Sends the current summary to every exporter
+    def export(self):
+        """
+        Calls every registered exporter with the current summary
+
+        :return dict: The exported summary
+        """
+        summaries = self.summary()
+        for exporter in self.exporters:
+            exporter(summaries)
+        self._last_export = time.monotonic()
+        return summaries
+
+
+    # Exports once export_interval has passed, called once per frame
+    def tick(self):
+        """
+        Exports the summary if automatic exports are enabled and the interval has passed
+
+        :return None
+        """
+        if self.export_interval is not None and self.exporters and time.monotonic() - self._last_export >= self.export_interval:
+            self.export()
+
+
+# Prints a latency summary as a table, usable as an exporter
+def print_summary(summaries):
+    """
+    Prints the p50/p95/p99 latency of every stage
+
+    :param dict summaries: Summary returned by LatencyMonitor.summary
+
+    :return None
+    """
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in summaries.items():
+        print(f"{stage:<18}{s['count']:>8}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
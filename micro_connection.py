@@ -1,34 +1,208 @@
 import serial
 import time
+import queue
+import threading
+from latency_stats import LatencyMonitor
 
 class MicroConnection:
     """
     A class that makes use of PySerial in order to give commands to the Adafruit microcontroller
+
+    All writes to the serial port happen on one long-lived dispatcher thread fed by a command queue, so callers
+    never block and overlapping alerts are merged into one instead of fighting over the port.
     """
-    
+
     # Initializes MicroConnection
-    def __init__(self):
+    def __init__(self, port='YOUR_COM_PORT', baudrate=115200, alert_duration=5.0, latency_monitor=None,
+                 alert_pattern=None, alert_intensity=9, ready_timeout=2.0, ping_interval=0.1):
         """
         Initializes the MicroConnection object
 
-        Establishes a serial connection to the Adafruit microcontroller using the specified COM port
+        Establishes a serial connection to the Adafruit microcontroller using the specified COM port and starts the dispatcher
+
+        :param str port: Serial port or pyserial URL (e.g. 'loop://' to test without the board)
+        :param int baudrate: Serial baud rate
+        :param float alert_duration: Seconds the LED, buzzer and servo stay on per warning
+        :param class latency_monitor: LatencyMonitor receiving the alert write latencies (default: a new one)
+        :param int alert_pattern: Alert pattern digit understood by code.py (default: send the plain '1' command)
+        :param int alert_intensity: Buzzer intensity from 1 to 9, used with alert_pattern
+        :param float ready_timeout: Longest wait for the board to answer the readiness check (0 to skip it)
+        :param float ping_interval: Seconds between readiness pings
 
         :return None
         """
         # Replace with your Metro's actual COM port (Default is normally 'COM5')
-        self.ser = serial.Serial('YOUR_COM_PORT', 115200, timeout=1) # Opens connection to serial port
-        time.sleep(2)  # Wait for the board to reset after opening serial port
+        self.ser = serial.serial_for_url(port, baudrate, timeout=1) # Opens connection to serial port
+        self.ready = self.wait_until_ready(ready_timeout, ping_interval) # Waits for the board instead of a fixed delay
+
+        self.alert_duration = alert_duration
+        # Command turning the alert on: the plain '1', or a '#A<pattern><intensity>' frame
+        self.alert_command = b'1' if alert_pattern is None else f"#A{alert_pattern}{alert_intensity}\n".encode()
+        self.latency_monitor = latency_monitor if latency_monitor else LatencyMonitor()
+        self.alerts_sent = 0 # Warnings that turned the alert on
+        self.alerts_merged = 0 # Warnings that arrived while an alert was already on
+        self.write_errors = 0 # Failed writes to the serial port
+
+        self._commands = queue.Queue()
+        self._alert_until = None # time.monotonic() the active alert ends at, None when off
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+
+    # Waits until the board answers on the serial port
+    def wait_until_ready(self, timeout=2.0, ping_interval=0.1):
+        """
+        Sends the '?' ping until code.py answers with 'R', returning as soon as the board is up
+
+        Firmware without the ping just never answers, so the wait ends after timeout like the old fixed delay. A
+        loopback port (e.g. 'loop://') reads back its own pings, which the board never sends, so the wait ends at once.
+
+        :param float timeout: Longest wait in seconds
+        :param float ping_interval: Seconds between pings
+
+        :return bool: True if the board answered, False after the timeout or on a loopback port
+        """
+        if timeout <= 0:
+            return False
+        deadline = time.monotonic() + timeout
+        read_timeout = self.ser.timeout
+        self.ser.timeout = ping_interval
+        try:
+            self.ser.reset_input_buffer()
+            while time.monotonic() < deadline:
+                self.ser.write(b'?')
+                answer = self.ser.read(self.ser.in_waiting or 1) # Waits up to ping_interval for the answer
+                if b'R' in answer:
+                    return True
+                if answer and not answer.strip(b'?'):
+                    print("Microcontroller port echoes the readiness ping (loopback), not waiting for the board")
+                    return False
+        except serial.SerialException as e:
+            print(f"Microcontroller readiness check failed: {e}")
+        finally:
+            self.ser.timeout = read_timeout
+        return False
 
 
     # Communicates to the microcontroller to warn the driver falling asleep using LED, buzzer, and servo
-    def sleep_warning(self):
+    def sleep_warning(self, duration=None, captured_at=None):
+        """
+        Queues a warning that writes info 1/0 (ON/OFF) to the Adafruit microcontroller's code.py file in order to control LED, buzzer, and servo
+
+        Acts as a warning for a person falling asleep while driving. Returns immediately; if an alert is already
+        on, it is kept on until the later of both end times instead of being restarted
+
+        :param float duration: Seconds the alert stays on (default: alert_duration)
+        :param float captured_at: time.monotonic() capture time of the frame that triggered the warning, the
+                                  capture_to_alert latency is recorded once the alert is written (default: not recorded)
+
+        :return None
+        """
+        self._commands.put(("alert", duration if duration is not None else self.alert_duration, time.monotonic(), captured_at))
+
+
+    # Turns the active warning off early
+    def cancel_warning(self):
+        """
+        Queues turning the LED, buzzer and servo off, if an alert is on
+
+        :return None
+        """
+        self._commands.put(("cancel", None, time.monotonic(), None))
+
+
+    # Keeps the active warning on for longer
+    def extend_warning(self, seconds):
+        """
+        Queues extending the active alert (does nothing if no alert is on)
+
+        :param float seconds: Seconds added to the end of the active alert
+
+        :return None
+        """
+        self._commands.put(("extend", seconds, time.monotonic(), None))
+
+
+    # Checks if an alert is currently on
+    def alert_active(self):
+        """
+        Checks whether the dispatcher currently has the alert on
+
+        :return bool: Whether the LED, buzzer and servo are currently on
+        """
+        return self._alert_until is not None
+
+
+    # Writes a command byte to the board
+    def _write(self, command, queued_at, captured_at=None):
+        """
+        Writes a byte to the serial port and records the latency from queuing the command to the written byte
+
+        :param bytes command: alert_command (ON) or b'0' (OFF)
+        :param float queued_at: time.monotonic() the command was queued
+        :param float captured_at: time.monotonic() capture time of the frame behind an alert, also records capture_to_alert
+
+        :return None
+        """
+        try:
+            self.ser.write(command)
+            self.ser.flush()
+        except Exception as e: # e.g. SerialException, or OSError/termios.error from flush once the board is unplugged
+            self.write_errors += 1 # Keeps the dispatcher alive, the next command tries the port again
+            print(f"Failed to write to the microcontroller: {e}")
+            return
+        written = time.monotonic()
+        self.latency_monitor.record("alert_off_write" if command == b'0' else "alert_write", written - queued_at)
+        if captured_at is not None:
+            self.latency_monitor.record("capture_to_alert", written - captured_at) # End to end, from the camera to the board
+
+
+    # Runs the commands queued for the board
+    def _dispatch(self):
+        """
+        Dispatcher thread: applies queued commands and turns the alert off once it expires
+
+        :return None
+        """
+        while True:
+            timeout = None if self._alert_until is None else max(0.0, self._alert_until - time.monotonic())
+            try:
+                action, value, queued_at, captured_at = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                # The active alert expired
+                self._alert_until = None
+                self._write(b'0', time.monotonic())  # Send '0' to turn LED, buzzer, and servo OFF
+                continue
+
+            now = time.monotonic()
+            if action == "alert":
+                if self._alert_until is None:
+                    self._write(self.alert_command, queued_at, captured_at)  # Send '1' to turn LED, buzzer, and servo ON
+                    self._alert_until = now + value
+                    self.alerts_sent += 1
+                else:
+                    self._alert_until = max(self._alert_until, now + value) # Merges with the alert already on
+                    self.alerts_merged += 1
+            elif action == "extend" and self._alert_until is not None:
+                self._alert_until += value
+            elif action in ("cancel", "stop"):
+                if self._alert_until is not None:
+                    self._alert_until = None
+                    self._write(b'0', queued_at)  # Send '0' to turn LED, buzzer, and servo OFF
+                if action == "stop":
+                    return
+
+
+    # Stops the dispatcher and closes the serial port
+    def close(self, timeout=2.0):
         """
-        Writes info 1/0 (ON/OFF) to the Adafruit microcontroller's code.py file in order to control LED, buzzer, and servo
+        Turns an active alert off, stops the dispatcher thread and closes the serial connection
 
-        Acts as a warning for a person falling asleep while driving
+        :param float timeout: Seconds to wait for the dispatcher to finish
 
         :return None
         """
-        self.ser.write(b'1')  # Send '1' to turn LED, buzzer, and servo ON
-        time.sleep(5) # Buzzer/light stays on for 5 seconds
-        self.ser.write(b'0')  # Send '0' to turn LED, buzzer, and servo OFF
\ No newline at end of file
+        if self._dispatcher.is_alive():
+            self._commands.put(("stop", None, time.monotonic(), None))
+            self._dispatcher.join(timeout)
+        self.ser.close()
@@ -0,0 +1,200 @@
+import argparse
+import csv
+import json
+import os
+import numpy as np
+
+
+NOMINAL_FPS = 30.0 # Same rate SleepDetector converts consec_frames to seconds with
+
+
+# Loads the EAR time series of a recorded drive
+def load_ear_series(path):
+    """
+    Read the frame times and EAR of a batch_analysis timeline CSV or a landmark recording (.dglm)
+
+    :param str path: Path of a <name>_timeline.csv or a recording written by LandmarkRecorder
+
+    :return tuple times, ears: float64 frame times in seconds and float32 EAR (NaN without a face)
+    """
+    if path.endswith(".dglm"):
+        from landmark_recording import LandmarkReplay
+        from sleep_detector import SleepDetector
+        from batch_analysis import OfflineSink
+
+        replay = LandmarkReplay(path)
+        sink = OfflineSink()
+        detector = SleepDetector(path, 0.24, 90, asleep=False, database=sink, microcontroller=sink, headless=True, generator=replay)
+        return np.array(replay.frame_times, dtype=np.float64), detector.recording_ears(replay)
+
+    with open(path, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    times = np.array([float(row["time_s"]) for row in rows], dtype=np.float64)
+    ears = np.array([float(row["ear"]) if row["ear"] else np.nan for row in rows], dtype=np.float32)
+    return times, ears
+
+
+# Evaluates every threshold/window combination on one drive
+def sweep_series(times, ears, labels, thresholds, windows):
+    """
+    Find the sleep detections of every (threshold, window) combination at once and score them against the labels
+
+    Follows SleepDetector.check_asleep: frames without a face are skipped, a run of frames below the threshold
+    is detected once it has lasted the window, and only the first detection of a run counts. The closed-eye runs
+    of all thresholds are found with one run-length pass, and the detection frame of every run and window with
+    one searchsorted, so no Python code runs per frame or per combination.
+
+    :param numpy.ndarray times: Frame times in seconds, increasing
+    :param numpy.ndarray ears: EAR of every frame (NaN without a face)
+    :param list labels: Labeled sleep intervals as (start_s, end_s) pairs
+    :param numpy.ndarray thresholds: EAR thresholds to evaluate
+    :param numpy.ndarray windows: Closed-eye durations in seconds to evaluate
+
+    :return dict: (thresholds, windows) arrays of detected labels, false alarms, summed and maximum detection delays
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    windows = np.asarray(windows, dtype=np.float64)
+    K, M = len(thresholds), len(windows)
+    labels = np.array(sorted(labels), dtype=np.float64).reshape(-1, 2)
+    label_starts, label_ends = labels[:, 0], labels[:, 1]
+
+    valid = ~np.isnan(ears)
+    t = times[valid]
+    closed = np.zeros((K, len(t) + 2), dtype=np.int8)
+    closed[:, 1:-1] = ears[valid][None, :] < thresholds[:, None]
+
+    # Run-length encoding of the closed-eye frames of every threshold, starts and ends come out in the same order
+    edges = np.diff(closed, axis=1)
+    run_threshold, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1] - 1 # Last closed frame of the run
+
+    # First frame of each run that is at least a window after its start, a detection if the run is still going
+    start_time = t[run_start][:, None]
+    detection = np.searchsorted(t, start_time + windows[None, :])
+    # Rounding of start + window can be off by a frame, checks elapsed >= window exactly like check_asleep
+    last = len(t) - 1
+    earlier = np.maximum(detection - 1, 0)
+    detection -= (detection > 0) & (t[earlier] - start_time >= windows[None, :])
+    detection += (detection <= last) & (t[np.minimum(detection, last)] - start_time < windows[None, :])
+    run, window = np.nonzero(detection <= run_end[:, None])
+    combination = run_threshold[run] * M + window
+    detected_at = t[detection[run, window]]
+
+    # Detections inside a labeled interval are hits, everything else is a false alarm
+    label = np.searchsorted(label_starts, detected_at, side="right") - 1
+    hit = label >= 0
+    hit[hit] = detected_at[hit] <= label_ends[label[hit]]
+    false_alarms = np.bincount(combination[~hit], minlength=K * M)
+
+    # Delay of the first detection of every labeled interval
+    delays = np.full((K * M, len(labels)), np.inf)
+    np.minimum.at(delays, (combination[hit], label[hit]), detected_at[hit] - label_starts[label[hit]])
+    found = np.isfinite(delays)
+
+    return {
+        "detected": found.sum(axis=1).reshape(K, M),
+        "false_alarms": false_alarms.reshape(K, M),
+        "delay_sum": np.where(found, delays, 0.0).sum(axis=1).reshape(K, M),
+        "max_delay": np.where(found, delays, 0.0).max(axis=1, initial=0.0).reshape(K, M),
+        "labels": len(labels),
+        "duration_s": float(t[-1] - t[0]) if len(t) else 0.0
+    }
+
+
+# Evaluates the grid on every drive and ranks the combinations
+def sweep(drives, thresholds, windows):
+    """
+    Sweep every drive and rank the combinations by missed events, false alarms and mean detection delay
+
+    :param list drives: (path, labels) pairs, labels being the (start_s, end_s) sleep intervals of the drive
+    :param numpy.ndarray thresholds: EAR thresholds to evaluate
+    :param numpy.ndarray windows: Closed-eye durations in seconds to evaluate
+
+    :return list: One dictionary per combination, best first
+    :raises ValueError: If there are no drives to sweep
+    """
+    if not drives:
+        raise ValueError("No labeled drives to sweep")
+
+    totals = None
+    labels = 0
+    hours = 0.0
+    for path, drive_labels in drives:
+        times, ears = load_ear_series(path)
+        result = sweep_series(times, ears, drive_labels, thresholds, windows)
+        labels += result["labels"]
+        hours += result["duration_s"] / 3600
+        if totals is None:
+            totals = {key: result[key].copy() for key in ("detected", "false_alarms", "delay_sum", "max_delay")}
+        else:
+            for key in ("detected", "false_alarms", "delay_sum"):
+                totals[key] += result[key]
+            np.maximum(totals["max_delay"], result["max_delay"], out=totals["max_delay"])
+
+    rows = []
+    for i, threshold in enumerate(thresholds):
+        for j, window in enumerate(windows):
+            detected = int(totals["detected"][i, j])
+            false_alarms = int(totals["false_alarms"][i, j])
+            rows.append({
+                "ear_threshold": round(float(threshold), 4),
+                "sleep_seconds": round(float(window), 3),
+                "consec_frames": int(round(window * NOMINAL_FPS)),
+                "detected": detected,
+                "missed": labels - detected,
+                "false_alarms": false_alarms,
+                "false_alarms_per_hour": round(false_alarms / hours, 3) if hours > 0 else None,
+                "mean_delay_s": round(float(totals["delay_sum"][i, j]) / detected, 3) if detected else None,
+                "max_delay_s": round(float(totals["max_delay"][i, j]), 3) if detected else None
+            })
+    rows.sort(key=lambda row: (row["missed"], row["false_alarms"], row["mean_delay_s"] if row["detected"] else np.inf))
+    return rows
+
+
+# Reads the labeled drives
+def load_labels(labels_path):
+    """
+    Read a JSON file mapping drive paths (relative to the file) to their labeled sleep intervals
+
+    Example: {"analysis/drive1_timeline.csv": [[120.0, 131.5]], "drive2.dglm": []}
+
+    :param str labels_path: Path of the labels file
+
+    :return list: (path, labels) pairs
+    """
+    with open(labels_path) as labels_file:
+        labeled = json.load(labels_file)
+    base = os.path.dirname(os.path.abspath(labels_path))
+    return [(os.path.join(base, path), intervals) for path, intervals in labeled.items()]
+
+
+# Parses a start:stop:step range
+def _grid(text):
+    start, stop, step = (float(value) for value in text.split(":"))
+    return np.arange(start, stop + step / 2, step)
+
+
+# Allows sweeps to be run from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank EAR threshold/window combinations on labeled recorded drives")
+    parser.add_argument("labels", help="JSON file mapping timelines/recordings to their sleep intervals")
+    parser.add_argument("--thresholds", default="0.15:0.35:0.01", help="EAR thresholds as start:stop:step")
+    parser.add_argument("--windows", default="0.5:5:0.25", help="Closed-eye seconds as start:stop:step")
+    parser.add_argument("--top", type=int, default=10, help="Number of combinations printed")
+    parser.add_argument("--output", default=None, help="CSV file receiving every combination")
+    args = parser.parse_args()
+
+    ranked = sweep(load_labels(args.labels), _grid(args.thresholds), _grid(args.windows))
+
+    if args.output:
+        with open(args.output, "w", newline="") as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=list(ranked[0]))
+            writer.writeheader()
+            writer.writerows(ranked)
+
+    print(f"{'threshold':>10}{'seconds':>9}{'frames':>8}{'missed':>8}{'false':>7}{'mean s':>8}{'max s':>7}")
+    for row in ranked[:args.top]:
+        mean = "-" if row["mean_delay_s"] is None else f"{row['mean_delay_s']:.2f}"
+        maximum = "-" if row["max_delay_s"] is None else f"{row['max_delay_s']:.2f}"
+        print(f"{row['ear_threshold']:>10.3f}{row['sleep_seconds']:>9.2f}{row['consec_frames']:>8}"
+              f"{row['missed']:>8}{row['false_alarms']:>7}{mean:>8}{maximum:>7}")
@@ -1,10 +1,19 @@
+import uuid
 import psycopg2
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
 
+# Fills in the optional fields of a drowsiness aggregate before it is inserted
+def metrics_row(row):
+    """
+    :param dict row: Dictionary returned by DrowsinessMetrics.flush, optionally with a "stream" name
+
+    :return dict: The row with the default stream '' and, for rows of older versions without one, a new flush ID
+    """
+    return {"stream": "", **row, "flush_id": row.get("flush_id") or uuid.uuid4().hex}
+
+
 class SleepDatabase:
     """
     A class that connects to a local PostgreSQL database. Allowing for input of timestamps and generation of trend data visuals
@@ -17,6 +26,16 @@ class SleepDatabase:
 
         Establishes a connection to the PostgreSQL database and creates a table if not already available
 
+        :return None
+        """
+        self.connect()
+
+
+    # Opens the connection to the PostgreSQL database
+    def connect(self):
+        """
+        Connects to the PostgreSQL database, opens a cursor and makes sure the table exists
+
         :return None
         """
         # The following connection variables are dependent on your local machine and can be found in pg Admin for Postgresql - PLEASE CHANGE ACCORDINGLY
@@ -25,103 +44,267 @@ class SleepDatabase:
             dbname="DriveGuard", 
             user="your_username", 
             password="your_password", 
-            port=5432
+            port=5432,
+            connect_timeout=5 # Seconds to wait for an unreachable server
             )
         
         self.cursor = self.connection.cursor() # Connect to database cursor for executable actions
         self.create_table()
 
 
+    # Replaces a broken connection with a new one
+    def reconnect(self):
+        """
+        Closes the current connection, ignoring errors from an already broken one, and connects again
+
+        :return None
+        """
+        try:
+            self.close_connection()
+        except psycopg2.Error:
+            pass # The old connection is unusable either way
+        self.connect()
+
+
     # Creates a table in the PostgreSQL database if there is none existing
     def create_table(self):
         """
         Executes creation of a "driver_asleep" table in the PostgreSQL database
 
-        Table consists of 1 attribute: Timestamp
+        Table consists of 2 attributes: Driver ID and Timestamp. Tables of older versions, without the driver ID,
+        get the column added with their events assigned to the default driver ''.
+
+        Also creates the "driver_hourly" rollup table (sleep events counted per driver and hour), which the
+        analytics read instead of the raw events. A newly created rollup is backfilled from the existing events,
+        which also rebuilds a rollup of an older version without the driver ID.
+
+        The "driver_metrics" table holds the per-minute drowsiness aggregates of each camera stream, one row per
+        flushed part of a minute, and the "driver_metrics_minutes" view merges the parts into one row per minute.
+        Tables of older versions get the flush ID column, with their rows keeping the ID ''.
 
         :return None
         """
         self.cursor.execute("""CREATE TABLE IF NOT EXISTS driver (
-                    driver_asleep TIMESTAMP PRIMARY KEY
+                    driver_id TEXT NOT NULL DEFAULT '',
+                    driver_asleep TIMESTAMP NOT NULL,
+                    PRIMARY KEY (driver_id, driver_asleep)
+                    );
+                    """)
+        if not self._has_column("driver", "driver_id"):
+            self.cursor.execute("""ALTER TABLE driver
+                    ADD COLUMN driver_id TEXT NOT NULL DEFAULT '',
+                    DROP CONSTRAINT driver_pkey,
+                    ADD PRIMARY KEY (driver_id, driver_asleep);
+                    """)
+
+        # The rollup only holds counts of the raw events, an outdated one is dropped and backfilled
+        rollup_missing = not self._has_column("driver_hourly", "driver_id")
+        if rollup_missing:
+            self.cursor.execute("DROP TABLE IF EXISTS driver_hourly;")
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS driver_hourly (
+                    driver_id TEXT NOT NULL DEFAULT '',
+                    sleep_hour TIMESTAMP NOT NULL,
+                    frequency INTEGER NOT NULL,
+                    PRIMARY KEY (driver_id, sleep_hour)
                     );
                     """)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS driver_metrics (
+                    minute TIMESTAMP NOT NULL,
+                    stream TEXT NOT NULL DEFAULT '',
+                    face_frames INTEGER NOT NULL,
+                    mean_ear REAL,
+                    perclos REAL,
+                    blinks INTEGER NOT NULL,
+                    mean_blink_duration REAL,
+                    flush_id TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (minute, stream, flush_id)
+                    );
+                    """)
+        if not self._has_column("driver_metrics", "flush_id"):
+            self.cursor.execute("""ALTER TABLE driver_metrics
+                    ADD COLUMN flush_id TEXT NOT NULL DEFAULT '',
+                    DROP CONSTRAINT driver_metrics_pkey,
+                    ADD PRIMARY KEY (minute, stream, flush_id);
+                    """)
+
+        # Parts of a minute are merged when read: counts are added, means are weighted by those counts
+        self.cursor.execute("""CREATE OR REPLACE VIEW driver_metrics_minutes AS
+                    SELECT minute, stream,
+                        SUM(face_frames) AS face_frames,
+                        SUM(mean_ear * face_frames) / NULLIF(SUM(face_frames), 0) AS mean_ear,
+                        SUM(perclos * face_frames) / NULLIF(SUM(face_frames), 0) AS perclos,
+                        SUM(blinks) AS blinks,
+                        SUM(mean_blink_duration * blinks) / NULLIF(SUM(blinks), 0) AS mean_blink_duration
+                    FROM driver_metrics
+                    GROUP BY minute, stream;
+                    """)
+        if rollup_missing:
+            self.backfill_hourly_rollup() # Commits the new tables too
+        else:
+            self.connection.commit()
+
+
+    # Checks if a table has a column
+    def _has_column(self, table, column):
+        """
+        :param str table: Name of the table
+        :param str column: Name of the column, e.g. 'driver_id'
+
+        :return bool: False if the table is missing or from a version without the column
+        """
+        self.cursor.execute("""SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+                    );
+                    """, (table, column))
+        return self.cursor.fetchone()[0]
+
+
+    # Rebuilds the hourly rollup from the raw sleep events
+    def backfill_hourly_rollup(self):
+        """
+        Recounts the sleep events of every hour into the "driver_hourly" rollup table
+
+        Only needed for events inserted before the rollup existed or by other clients, since
+        insert_sleep_timestamps keeps the rollup up to date
+
+        :return int: Number of driver hours in the rollup
+        """
+        self.cursor.execute("TRUNCATE driver_hourly;")
+        self.cursor.execute("""INSERT INTO driver_hourly (driver_id, sleep_hour, frequency)
+                    SELECT driver_id, date_trunc('hour', driver_asleep), COUNT(*)
+                    FROM driver
+                    GROUP BY 1, 2;
+                    """)
+        hours = self.cursor.rowcount
+        self.connection.commit() # Pushes changes to database
+        return hours
 
 
     # Takes a timestamp of when the person fell asleep and uploads it onto the database
-    def take_sleep_timestamp(self):
+    def take_sleep_timestamp(self, driver_id=""):
         """
         Takes a timestamp of the person falling asleep and insterts into the PostgreSQL database
 
         Uses datetime to store the timestamp and pushes the changes
 
+        :param str driver_id: Driver or vehicle the event belongs to (default: the single driver '')
+
         :return None
         """
         timestamp = datetime.now() # Stores current timestamp
+        self.insert_sleep_timestamps([timestamp], driver_id)
+
 
-        self.cursor.execute("""INSERT INTO driver (driver_asleep) VALUES
-                (%s)
-                """, (timestamp,))
+    # Uploads several sleep timestamps in one transaction
+    def insert_sleep_timestamps(self, timestamps, driver_id=""):
+        """
+        Inserts a batch of sleep timestamps into the PostgreSQL database with a single statement and commit
+
+        Timestamps already in the table are skipped, so replaying a batch is harmless. The hourly rollup is
+        incremented in the same statement, by the events that were actually inserted.
+
+        :param list timestamps: datetime objects of the sleep events
+        :param str driver_id: Driver or vehicle the events belong to (default: the single driver '')
+
+        :return None
+        """
+        self.cursor.execute("""WITH inserted AS (
+                    INSERT INTO driver (driver_id, driver_asleep)
+                    SELECT %s, unnest(%s::timestamp[])
+                    ON CONFLICT DO NOTHING
+                    RETURNING driver_id, driver_asleep
+                )
+                INSERT INTO driver_hourly (driver_id, sleep_hour, frequency)
+                SELECT driver_id, date_trunc('hour', driver_asleep), COUNT(*)
+                FROM inserted
+                GROUP BY 1, 2
+                ON CONFLICT (driver_id, sleep_hour) DO UPDATE SET frequency = driver_hourly.frequency + EXCLUDED.frequency;
+                """, (driver_id, list(timestamps)))
         self.connection.commit() # Pushes changes to database
 
 
+    # Uploads per-minute drowsiness aggregates in one transaction
+    def insert_drowsiness_metrics(self, rows):
+        """
+        Inserts a batch of per-minute drowsiness aggregates with a single commit
+
+        Every flushed part of a minute, e.g. the first part flushed at a stop or restart, is its own row, merged
+        by the "driver_metrics_minutes" view. A part already in the table (same flush ID), e.g. replayed from the
+        spool after a partly failed upload, is skipped, so replaying a batch is harmless.
+
+        :param list rows: Dictionaries returned by DrowsinessMetrics.flush, optionally with a "stream" name
+
+        :return None
+        """
+        self.cursor.executemany("""INSERT INTO driver_metrics (minute, stream, face_frames, mean_ear, perclos, blinks, mean_blink_duration, flush_id)
+                    VALUES (%(minute)s, %(stream)s, %(face_frames)s, %(mean_ear)s, %(perclos)s, %(blinks)s, %(mean_blink_duration)s, %(flush_id)s)
+                    ON CONFLICT (minute, stream, flush_id) DO NOTHING;
+                    """, [metrics_row(row) for row in rows])
+        self.connection.commit() # Pushes changes to database
+
+
+    # Uploads one per-minute drowsiness aggregate
+    def take_drowsiness_metrics(self, row):
+        """
+        Inserts the drowsiness aggregate of one minute
+
+        :param dict row: Dictionary returned by DrowsinessMetrics.flush
+
+        :return None
+        """
+        self.insert_drowsiness_metrics([row])
+
+
     # Returns the most common hour that a person falls asleep and displays it in a window
-    def most_common_sleep_hour(self):
+    def most_common_sleep_hour(self, driver_id=None):
         """
-        Parses through the database to calculate the most frequent sleep hour
+        Parses through the hourly rollup to calculate the most frequent sleep hour
 
         Generates a matplot visualization showing both hour and the frequency
 
+        :param str driver_id: Driver or vehicle to analyze (default: all of them)
+
         :return None
         """
-        self.cursor.execute("""SELECT EXTRACT(HOUR FROM driver_asleep) AS sleep_hour, COUNT(*) AS frequency
-                    FROM driver
-                    GROUP BY sleep_hour
+        import matplotlib.pyplot as plt # Imported on use, so detection starts without loading matplotlib
+        from sleep_reports import draw_common_hour
+
+        self.cursor.execute("""SELECT EXTRACT(HOUR FROM sleep_hour) AS hour_of_day, SUM(frequency) AS frequency
+                    FROM driver_hourly
+                    WHERE %(driver_id)s::text IS NULL OR driver_id = %(driver_id)s
+                    GROUP BY hour_of_day
                     ORDER BY frequency DESC
                     LIMIT 1;
-                    """)
+                    """, {"driver_id": driver_id})
         result = self.cursor.fetchone() # Assigns a tuple with the most common sleep hour and the frequency of the hour
-        
-        if result: # Checks if the query was successful
-            # Unpacking the tuple for the hour and the frequency
-            sleep_hour = result[0]
-            frequency = result[1]
-            
-            # Create matplotlib window to display the result
-            plt.figure(figsize=(8, 6))
-            plt.text(0.5, 0.6, f"Most Common Sleep Hour: {int(sleep_hour):02d}:00", 
-                    fontsize=24, ha='center', va='center', weight='bold')
-            plt.text(0.5, 0.4, f"Frequency: {frequency} occurrences", 
-                    fontsize=16, ha='center', va='center')
-            plt.xlim(0, 1)
-            plt.ylim(0, 1)
-            plt.axis('off')
-            plt.title("Driver Sleep Analysis", fontsize=18, weight='bold', pad=20)
-            plt.show()
-        else:
-            # Create matplotlib window in case of no data
-            plt.figure(figsize=(8, 6))
-            plt.text(0.5, 0.5, "No sleep records found", 
-                    fontsize=20, ha='center', va='center', color='red')
-            plt.xlim(0, 1)
-            plt.ylim(0, 1)
-            plt.axis('off')
-            plt.title("Driver Sleep Analysis", fontsize=18, weight='bold', pad=20)
-            plt.show() 
+
+        # Create matplotlib window to display the result (or that there is no data)
+        draw_common_hour(plt.figure(figsize=(8, 6)), *(result if result else (None, 0)))
+        plt.show()
 
 
     # Creates a plot of sleep trends
-    def plot_sleep_trend(self):
+    def plot_sleep_trend(self, driver_id=None):
         """
         Creates and displays a bar chart with a trendline to show driver sleep trends throughout a day
 
         Based on military time
 
+        :param str driver_id: Driver or vehicle to plot (default: all of them)
+
         :return None
         """
-        # Fetch all timestamps
-        self.cursor.execute("""
-            SELECT driver_asleep FROM driver;
-        """)
+        # Imported on use, so detection starts without loading matplotlib
+        import matplotlib.pyplot as plt
+        from sleep_reports import draw_sleep_trend
+
+        # Fetch the per-hour counts from the rollup
+        self.cursor.execute("""SELECT sleep_hour, SUM(frequency) FROM driver_hourly
+                    WHERE %(driver_id)s::text IS NULL OR driver_id = %(driver_id)s
+                    GROUP BY sleep_hour
+                    ORDER BY sleep_hour;
+                    """, {"driver_id": driver_id})
         rows = self.cursor.fetchall()
 
         # In case of no data to be displayed on a chart
@@ -129,44 +312,9 @@ class SleepDatabase:
             print("No sleep data to display.")
             return
 
-        # Prepare DataFrame and round timestamps to nearest hour
-        df = pd.DataFrame(rows, columns=['timestamp'])
-        df['hour'] = df['timestamp'].dt.floor('H')  # 'H' = hour
-
-        # Count frequency per hour
-        sleep_counts = df['hour'].value_counts().sort_index()
-
-        # X = actual datetime labels for bars
-        x_labels = sleep_counts.index
-        y = sleep_counts.values
-
-        # Convert datetime to numerical (in hours) for trendline fitting
-        hours_since_start = (x_labels - x_labels[0]).total_seconds() / 3600
-
-        # Plot bar chart
-        plt.figure(figsize=(14, 6))
-        plt.bar(x_labels, y, width=0.03, color='skyblue', edgecolor='black', label="Sleep Count (per hour)")
-
-        # Plot trendline if enough data
-        if len(x_labels) >= 3:
-            z = np.polyfit(hours_since_start, y, 2)
-            p = np.poly1d(z)
-            plt.plot(x_labels, p(hours_since_start), "r--", label="Trendline")
-
-        # Formatting
-        plt.title("Driver Sleep Frequency by Hour")
-        plt.xlabel("Time")
-        plt.ylabel("Sleep Occurrences")
-        
-        # Format x-axis to show hours properly
-        from matplotlib.dates import DateFormatter, HourLocator
-        plt.gca().xaxis.set_major_locator(HourLocator(interval=1))  # Show every hour
-        plt.gca().xaxis.set_major_formatter(DateFormatter('%H:%M'))  # Format as HH:MM
-        
-        plt.xticks(rotation=45)
-        plt.grid(True)
-        plt.legend()
-        plt.tight_layout()
+        hours = np.array([row[0] for row in rows], dtype="datetime64[h]")
+        counts = np.array([row[1] for row in rows])
+        draw_sleep_trend(plt.figure(figsize=(14, 6)), hours, counts)
         plt.show()
 
 
@@ -178,4 +326,17 @@ class SleepDatabase:
         :return None
         """
         self.cursor.close()
-        self.connection.close()
\ No newline at end of file
+        self.connection.close()
+
+
+# Allows the hourly rollup to be rebuilt from the command line
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="DriveGuard sleep database maintenance")
+    parser.add_argument("command", choices=["backfill"], help="backfill: rebuild the hourly rollup from the raw sleep events")
+    args = parser.parse_args()
+
+    sleep_database = SleepDatabase()
+    if args.command == "backfill":
+        print(f"Backfilled {sleep_database.backfill_hourly_rollup()} hours of sleep events")
+    sleep_database.close_connection()
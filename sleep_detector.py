@@ -1,9 +1,16 @@
 import numpy as np
 import cv2 as cv
-from FaceMeshModule import FaceMeshGenerator
-from sleep_database import SleepDatabase
+from landmark_backends import create_backend
+from eye_aspect_ratio import EyeAspectRatioKernel
+from sleep_event_writer import SleepEventWriter
 from micro_connection import MicroConnection
-import threading
+from frame_capture import FrameCapture
+from display_renderer import DisplayRenderer
+from inference_pipeline import InferencePipeline
+from latency_stats import LatencyMonitor
+from inference_scheduler import InferenceScheduler
+from drowsiness_metrics import DrowsinessMetrics
+import time
 
 
 class SleepDetector:
@@ -14,28 +21,75 @@ class SleepDetector:
     of both eyes.
     """
 
+    NOMINAL_FPS = 30.0 # Frame rate consec_frames is converted to seconds with
+
     # Initialize SleepDetector
-    def __init__(self, video_path, ear_threshold, consec_frames, asleep, database=None):
+    def __init__(self, video_path, ear_threshold, consec_frames, asleep, database=None,
+                 threaded_capture=False, capture_queue_size=1, max_frame_age=None, headless=False,
+                 generator=None, microcontroller=None, frame_callback=None, latency_monitor=None,
+                 sleep_seconds=None, adaptive_rate=False, low_rate_interval=0.2, capture=None, started_at=None,
+                 landmark_recorder=None, display_fps=30.0, display_size=(1280, 720), other_faces=False,
+                 inference_processes=0, generator_options=None, drowsiness_metrics=None, perclos_threshold=None,
+                 blink_duration_threshold=None, smooth_ear=False, log_metrics=False, landmark_backend="mediapipe",
+                 frame_budget=None):
         """
         Initialize the SleepDetector with its variable attributes
         
         :param int video_path: The default webcam/camera of the computer
         :param float ear_threshold: Threshold of which eyes are considered closed
-        :param int consec_frames: The amount of consecutive frames below the ear threshold to be considered asleep
+        :param int consec_frames: The amount of consecutive frames below the ear threshold to be considered asleep (at NOMINAL_FPS)
         :param bool asleep: Whether or not the person is asleep
-        :param class database: Connects to an instance of the SleepDatabase class
+        :param class database: Connects to an instance of the SleepDatabase or SleepEventWriter class (default: a new SleepEventWriter)
+        :param bool threaded_capture: Read frames on a separate capture thread (see FrameCapture)
+        :param int capture_queue_size: Maximum number of captured frames waiting to be processed
+        :param float max_frame_age: Skip frames older than this many seconds instead of processing them (default: never skip)
+        :param bool headless: Skip resizing, drawing and display, and process video files as fast as possible
+        :param class generator: Reuses a landmark backend (FaceMeshGenerator, EyeLandmarkBackend, LandmarkReplay...) instead of creating one
+        :param class microcontroller: Reuses an instance of the MicroConnection class instead of connecting to the board
+        :param function frame_callback: Called as frame_callback(frame_index, frame_time, ear, asleep) after each processed frame (ear is None without a face)
+        :param class latency_monitor: LatencyMonitor receiving the per-stage latencies (default: a new one)
+        :param float sleep_seconds: Seconds the eyes must stay closed to be considered asleep (default: consec_frames / NOMINAL_FPS)
+        :param bool adaptive_rate: Process only a few frames per second while the eyes are clearly open (see InferenceScheduler)
+        :param float low_rate_interval: Seconds between processed frames at the adaptive low rate
+        :param capture: Already opened cv.VideoCapture or FrameCapture used by the first process_video run instead of opening video_path
+        :param float started_at: time.monotonic() the program started, the time to the first processed frame is measured from it
+        :param class landmark_recorder: LandmarkRecorder receiving the landmarks of every processed frame (see landmark_recording.py)
+        :param float display_fps: Maximum frame rate of the preview window, rendered on its own thread (see DisplayRenderer)
+        :param tuple display_size: (width, height) of the preview window
+        :param bool other_faces: Also calculate the EAR of the faces other than the driver, into face_ears (needs a generator with num_faces > 1)
+        :param int inference_processes: Run capture and the face mesh in separate processes around shared memory, with this many inference processes (see InferencePipeline, default: single process)
+        :param dict generator_options: Keyword arguments of the landmark backend (of each inference process with inference_processes)
+        :param class drowsiness_metrics: DrowsinessMetrics estimating the smoothed EAR, PERCLOS and blinks (default: a new one if any option below is used)
+        :param float perclos_threshold: Warn once the PERCLOS over the metrics window reaches this fraction (default: no PERCLOS alert)
+        :param float blink_duration_threshold: Warn once the mean blink duration over the metrics window reaches this many seconds (default: no blink alert)
+        :param bool smooth_ear: Detect sleep on the smoothed EAR instead of the raw EAR of each frame
+        :param bool log_metrics: Upload the drowsiness metrics to the database as per-minute aggregates
+        :param str landmark_backend: Landmark backend created when no generator is given, "mediapipe" or "opencv_eyes" (see landmark_backends.py)
+        :param float frame_budget: Switch to the opencv_eyes backend while landmarks take longer than this many seconds per frame (see AdaptiveBackend, default: never switch)
 
         :return None
         """
-        # Initialize face mesh detector
-        self.generator = FaceMeshGenerator() 
+        # Initialize provided landmark backend or create the configured one (inference processes create their own)
+        self.inference_processes = inference_processes
+        self.generator_options = generator_options if generator_options else {}
+        self.landmark_backend = landmark_backend
+        self.frame_budget = frame_budget
+        if generator:
+            self.generator = generator
+        else:
+            self.generator = create_backend(landmark_backend, frame_budget, **self.generator_options) if not inference_processes else None
         self.video_path = video_path
 
-        # Initialize provided database or create new one
-        self.database = database if database else SleepDatabase()
+        # Initialize provided database or create a new one behind a write-behind queue, so uploads never block detection
+        self.database = database if database else SleepEventWriter()
+
+        # Per-stage latency instrumentation, shared with the face mesh generator and the microcontroller
+        self.latency_monitor = latency_monitor if latency_monitor else LatencyMonitor()
+        if self.generator is not None:
+            self.generator.latency_monitor = self.latency_monitor
 
-        # Initialize connection to the Adafruit microcontroller
-        self.microcontroller = MicroConnection()
+        # Initialize provided connection to the Adafruit microcontroller or create new one
+        self.microcontroller = microcontroller if microcontroller else MicroConnection(latency_monitor=self.latency_monitor)
         
         # Define facial landmarks for eye detection
         # Each list contains indices corresponding to points around the eyes
@@ -46,42 +100,178 @@ class SleepDetector:
         # These specific points are used to calculate the eye aspect ratio
         self.RIGHT_EYE_EAR = [33, 159, 158, 133, 153, 145]
         self.LEFT_EYE_EAR = [362, 380, 374, 263, 386, 385]
+
+        # Landmark subset requested from the face mesh, and the positions of the eye outlines within it
+        self.LANDMARK_IDS = sorted(set(self.RIGHT_EYE + self.LEFT_EYE + self.RIGHT_EYE_EAR + self.LEFT_EYE_EAR))
+        self.RIGHT_EYE_POS = [self.LANDMARK_IDS.index(i) for i in self.RIGHT_EYE]
+        self.LEFT_EYE_POS = [self.LANDMARK_IDS.index(i) for i in self.LEFT_EYE]
+        self.EYE_POS = np.array(self.RIGHT_EYE_POS + self.LEFT_EYE_POS) # Both eye outlines, drawn by the renderer
+
+        # Batched EAR calculation for both eyes, with index arrays and buffers built once
+        self.ear_kernel = EyeAspectRatioKernel(
+            [self.RIGHT_EYE_EAR, self.LEFT_EYE_EAR],
+            landmark_ids=self.LANDMARK_IDS,
+            max_faces=self.generator.num_faces if self.generator is not None else self.generator_options.get("num_faces", 1)
+        )
         
         # Sleep detection parameters
         self.ear_threshold = ear_threshold  # Eye aspect ratio threshold for blink detection
         self.consec_frames = consec_frames  # Minimum consecutive frames for a valid blink
+        self.sleep_seconds = sleep_seconds if sleep_seconds is not None else consec_frames / self.NOMINAL_FPS # Eyes closed time to be considered asleep
         self.frame_counter = 0    # Counter for consecutive frames below threshold
+        self.closed_since = None  # Frame time the eyes were first seen closed
         self.asleep = asleep
+
+        # Runs the face mesh at a low rate while the eyes are clearly open
+        self.scheduler = InferenceScheduler(ear_threshold, low_rate_interval=low_rate_interval) if adaptive_rate else None
+        self.skipped_frames = 0 # Frames the adaptive scheduler didn't process
+
+        # Capture parameters and frame delay measurements (in seconds)
+        self.threaded_capture = threaded_capture
+        self.capture_queue_size = capture_queue_size
+        self.max_frame_age = max_frame_age
+        self.frame_delay = None # Delay between capturing and processing the latest frame
+        self.detection_delay = None # Delay between capturing the frame that triggered the last sleep detection and the detection
+        self.stale_frames = 0 # Frames skipped for being older than max_frame_age
+        self.dropped_frames = 0 # Camera frames the inference pipeline dropped because every shared frame was busy
+        self.capture = capture
+
+        # Startup measurement (in seconds)
+        self.started_at = started_at
+        self.time_to_first_frame = None # Delay between started_at and the first processed frame
+
+        # Display parameters and run state
+        self.headless = headless
+        self.display_fps = display_fps
+        self.display_size = display_size
+        self.renderer = None # DisplayRenderer of the running process_video
+        self.running = False # Set to False by stop() to end process_video
+        self.frames_processed = 0 # Frames sent through the face mesh during the last process_video run
+        self.frames_read = 0 # Frames read from the source during the last process_video run
+        self.error = None # Exception that ended the last process_video run early, None if it ran to the end
+        self.frame_callback = frame_callback
+        self.landmark_recorder = landmark_recorder
+        self.other_faces = other_faces
+
+        # Drowsiness indicators, alerting before the eyes stay closed for sleep_seconds
+        if drowsiness_metrics is None and (perclos_threshold is not None or blink_duration_threshold is not None or smooth_ear or log_metrics):
+            drowsiness_metrics = DrowsinessMetrics(ear_threshold)
+        self.metrics = drowsiness_metrics
+        self.perclos_threshold = perclos_threshold
+        self.blink_duration_threshold = blink_duration_threshold
+        self.smooth_ear = smooth_ear
+        self.log_metrics = log_metrics
+        self.drowsy = False # Whether a metrics alert is active
+        self.drowsiness_warnings = 0 # Warnings sent by the metrics alerts
+        self.face_ears = np.empty(0, dtype=np.float32) # Mean EAR of the other faces in the last processed frame, with other_faces
         
         # Define colors for visualization (in BGR format)
         self.GREEN_COLOR = (86, 241, 13)  # Used when eyes are open
         self.RED_COLOR = (30, 46, 209)    # Used when eyes are closed
 
 
+    # Updates the drowsiness metrics and their alerts with a frame
+    def update_metrics(self, ear, timestamp=None, frame_time=None):
+        """
+        Feeds the EAR into the drowsiness metrics, logs finished per-minute aggregates and sends a warning when
+        the PERCLOS or mean blink duration over a full metrics window reaches its threshold
+
+        :param float ear: Mean EAR of the driver (None without a driver)
+        :param float timestamp: time.monotonic() capture time of the frame
+        :param float frame_time: Time of the frame in seconds
+
+        :return float: EAR the sleep detection should use, smoothed if smooth_ear is set
+        """
+        metrics = self.metrics
+        aggregate = metrics.update(frame_time, ear)
+        if aggregate is not None and self.log_metrics:
+            self.database.take_drowsiness_metrics(aggregate)
+        if ear is None or ear != ear: # No driver, or a degenerate eye outline
+            return ear
+
+        drowsy = False
+        if metrics.ready(frame_time):
+            if self.perclos_threshold is not None:
+                drowsy = metrics.perclos() >= self.perclos_threshold
+            if self.blink_duration_threshold is not None and metrics.blinks.count:
+                drowsy = drowsy or metrics.blink_duration() >= self.blink_duration_threshold
+        if drowsy and not self.drowsy:
+            self.drowsiness_warnings += 1
+            self.send_warning(timestamp) # Once per crossing, like the sleep warning
+        self.drowsy = drowsy
+
+        return metrics.smoothed_ear if self.smooth_ear else ear
+
+
+    # Logs the aggregate of the current minute
+    def flush_metrics(self):
+        """
+        Uploads the partial per-minute aggregate at the end of a run
+
+        :return None
+        """
+        if self.metrics is not None:
+            aggregate = self.metrics.flush()
+            if aggregate is not None and self.log_metrics:
+                self.database.take_drowsiness_metrics(aggregate)
+
+
     # Checks if the person is asleep, upload timestamp and create warning if true
-    def check_asleep(self, ear):
+    def check_asleep(self, ear, timestamp=None, frame_time=None):
         """
-        Determines if the person is asleep for at least 90 frames and takes a timestamp/creates a warning if true
+        Determines if the eyes stayed closed for at least sleep_seconds and takes a timestamp/creates a warning if true
+
+        The state machine works on frame times rather than frame counts, so it is unaffected by skipped frames or
+        the camera's frame rate.
+        With adaptive_rate, a closure first seen after frames the scheduler skipped is counted from the last
+        processed frame, so in the worst case the alert fires low_rate_interval early, never late.
 
         :param float ear: The current eye aspect ratio
+        :param float timestamp: time.monotonic() capture time of the frame, used to measure the detection delay
+        :param float frame_time: Time of the frame in seconds (default: timestamp, or the current time)
 
         :return None
         """
+        if frame_time is None:
+            frame_time = timestamp if timestamp is not None else time.monotonic()
+
         # When ear is past the threshold (eyes closed)
         if ear < self.ear_threshold:
             self.frame_counter += 1
-            if self.frame_counter >= self.consec_frames and not self.asleep: # Checks to see if frames for eyes closed is consecutive to count as asleep
+            if self.closed_since is None:
+                # A closure seen after frames skipped by the scheduler may have started at the last processed frame
+                self.closed_since = self.scheduler.closure_start(frame_time) if self.scheduler is not None else frame_time
+            if frame_time - self.closed_since >= self.sleep_seconds and not self.asleep: # Checks to see if eyes stayed closed long enough to count as asleep
                 self.database.take_sleep_timestamp() # Uploads sleep timestamp
                 self.asleep = True # Changes sleep status
-                threading.Thread(target=self.microcontroller.sleep_warning, daemon=True).start() # Runs the led/buzzer on another thread, so camera capture continues
+                if timestamp is not None:
+                    self.detection_delay = time.monotonic() - timestamp # Time from frame capture to detection
+                self.send_warning(timestamp) # Queues the led/buzzer warning on the MicroConnection dispatcher, so camera capture continues
         # When ear is above threshold (eyes open)
         else:
             self.asleep = False # Change sleep status
             self.frame_counter = 0 # Reset frames for eyes closed to 0
+            self.closed_since = None
+
+
+    # Triggers the hardware warning and records how long it took since the frame was captured
+    def send_warning(self, timestamp=None):
+        """
+        Calls the microcontroller sleep warning with the capture time of the frame
+
+        MicroConnection.sleep_warning only queues the alert, its dispatcher records the capture-to-alert latency
+        once the alert is written to the serial port
+
+        :param float timestamp: time.monotonic() capture time of the frame that triggered the warning
+
+        :return None
+        """
+        self.microcontroller.sleep_warning(captured_at=timestamp)
 
 
     # Calculates the EAR
-    def eye_aspect_ratio(self, eye_landmarks, landmarks):
+    @staticmethod
+    def eye_aspect_ratio(eye_landmarks, landmarks):
         """
         Calculate the eye aspect ratio (EAR) for given eye landmarks.
         
@@ -100,6 +290,19 @@ class SleepDetector:
         return (A + B) / (2.0 * C)
 
 
+    # Calculates the EAR of both eyes for the detected faces in one batched operation
+    def eye_aspect_ratios(self, landmarks, all_faces=False):
+        """
+        Calculate the eye aspect ratio of both eyes using the batched EAR kernel
+
+        :param numpy.ndarray landmarks: Landmark array of shape (faces, points, 2) in LANDMARK_IDS order
+        :param bool all_faces: Calculate every detected face instead of only the first one
+
+        :return numpy.ndarray: Array of shape (faces, 2) holding the right and left eye EAR of each face
+        """
+        return self.ear_kernel.compute(landmarks, all_faces=all_faces)
+
+
     # Sets mesh landmark visualization colors based on eye state
     def set_colors(self, ear):
         """
@@ -118,7 +321,7 @@ class SleepDetector:
         Draw landmarks around the eyes on the frame.
         
         :param nump.ndarray frame: Video frame to draw on
-        :param list landmarks: List of facial landmarks
+        :param landmarks: Facial landmarks (dictionary or array of (x, y) points)
         :param list eye_landmarks: Indices of landmarks for one eye
         :param tuple color: BGR color values for drawing
 
@@ -126,7 +329,184 @@ class SleepDetector:
         """
         # Loops through each index for eye landmarks
         for loc in eye_landmarks:
-            cv.circle(frame, (landmarks[loc]), 4, color, cv.FILLED) # Draws circle on each eye landmark
+            x, y = landmarks[loc]
+            cv.circle(frame, (int(x), int(y)), 4, color, cv.FILLED) # Draws circle on each eye landmark
+
+
+    # Opens the video source, on a capture thread if enabled
+    def open_capture(self):
+        """
+        Open the video source as a cv.VideoCapture or, with threaded_capture, as a FrameCapture
+
+        Cameras drop stale frames so the newest one is always processed, video files keep every frame.
+
+        :return: cv.VideoCapture or FrameCapture object
+        """
+        if self.threaded_capture:
+            return FrameCapture(
+                self.video_path,
+                queue_size=self.capture_queue_size,
+                drop_stale=isinstance(self.video_path, int) # Camera indices are live sources
+            )
+        return cv.VideoCapture(self.video_path)
+
+
+    # Reads a frame along with its capture timestamp
+    def read_frame(self, cap):
+        """
+        Read the next frame and the time it was captured
+
+        :param cap: cv.VideoCapture or FrameCapture object
+
+        :return tuple ret, frame, timestamp: Whether a frame was read, the frame and its time.monotonic() capture time
+        """
+        if isinstance(cap, FrameCapture):
+            return cap.read_with_timestamp()
+        ret, frame = cap.read()
+        return ret, frame, time.monotonic()
+
+
+    # Runs detection on a single frame
+    def process_frame(self, frame, timestamp=None, frame_time=None):
+        """
+        Detect the face landmarks of a frame, calculate its EAR and update the sleep status
+
+        :param numpy.ndarray frame: Video frame to process
+        :param float timestamp: time.monotonic() capture time of the frame
+        :param float frame_time: Time of the frame in seconds, used by the sleep state machine (default: timestamp)
+
+        :return tuple frame, face_landmarks, ear: Processed frame, landmark array (driver first) and mean EAR of the driver (None without a driver)
+        """
+        if frame_time is None:
+            frame_time = timestamp if timestamp is not None else time.monotonic()
+
+        # Landmarks of the driver (picked by the generator's driver policy), followed by the other faces if requested
+        frame, face_landmarks = self.generator.create_face_mesh(
+            frame, draw=False, as_array=True, indices=self.LANDMARK_IDS, all_faces=self.other_faces
+        )
+        ear = self.process_landmarks(face_landmarks, timestamp, frame_time)
+        return frame, face_landmarks, ear
+
+
+    # Runs detection on the landmarks of a single frame
+    def process_landmarks(self, face_landmarks, timestamp=None, frame_time=None):
+        """
+        Calculate the EAR of a frame's landmarks and update the sleep status
+
+        :param numpy.ndarray face_landmarks: Landmark array of shape (faces, points, 2) in LANDMARK_IDS order, driver first
+        :param float timestamp: time.monotonic() capture time of the frame
+        :param float frame_time: Time of the frame in seconds, used by the sleep state machine (default: timestamp)
+
+        :return float: Mean EAR of the driver (None without a driver)
+        """
+        monitor = self.latency_monitor
+        if frame_time is None:
+            frame_time = timestamp if timestamp is not None else time.monotonic()
+
+        self.frames_processed += 1
+        if self.time_to_first_frame is None and self.started_at is not None:
+            self.time_to_first_frame = time.monotonic() - self.started_at
+            monitor.record("time_to_first_frame", self.time_to_first_frame)
+            print(f"First frame processed {self.time_to_first_frame:.2f} s after startup")
+        if self.landmark_recorder is not None:
+            self.landmark_recorder.write(timestamp if timestamp is not None else frame_time, frame_time, face_landmarks)
+
+        ear = None
+        self.face_ears = self.face_ears[:0]
+        if len(face_landmarks) > 0:
+            # Calculate eye aspect ratio of both eyes (of every face with other_faces) at once
+            ear_start = time.perf_counter()
+            ears = self.eye_aspect_ratios(face_landmarks, all_faces=self.other_faces)
+            ear = float(ears[0].mean())
+            if self.other_faces:
+                self.face_ears = ears[1:].mean(axis=1)
+            ear_done = time.perf_counter()
+
+            # Update blink detection
+            self.check_asleep(self.update_metrics(ear, timestamp, frame_time) if self.metrics is not None else ear, timestamp, frame_time)
+            monitor.record("ear", ear_done - ear_start)
+            monitor.record("check_asleep", time.perf_counter() - ear_done)
+        elif self.metrics is not None:
+            self.update_metrics(None, timestamp, frame_time)
+
+        if self.scheduler is not None:
+            self.scheduler.update(frame_time, ear)
+
+        if self.frame_callback is not None:
+            self.frame_callback(max(0, self.frames_read - 1), frame_time, ear, self.asleep)
+
+        return ear
+
+
+    # Calculates the EAR of every frame of a landmark recording
+    def recording_ears(self, replay, chunk_size=65536):
+        """
+        Calculate the mean EAR of the first face of every recorded frame, a whole chunk of frames at a time
+
+        :param class replay: LandmarkReplay of a recording holding the EAR landmarks
+        :param int chunk_size: Frames per batched EAR calculation
+
+        :return numpy.ndarray: float32 mean EAR of every frame (NaN without a face)
+        :raises ValueError: If the recording lacks a landmark used by the EAR
+        """
+        count = len(replay)
+        ears = np.full(count, np.nan, dtype=np.float32)
+        kernel = EyeAspectRatioKernel(
+            [self.RIGHT_EYE_EAR, self.LEFT_EYE_EAR],
+            landmark_ids=replay.landmark_ids,
+            max_faces=max(1, min(chunk_size, count))
+        )
+        with np.errstate(divide="ignore", invalid="ignore"): # Frames without a face hold zeros
+            for start in range(0, count, chunk_size):
+                points = replay.points[start:start + chunk_size, 0] # First face of every frame in the chunk
+                np.mean(kernel.compute(points, all_faces=True), axis=1, out=ears[start:start + len(points)])
+        ears[replay.faces == 0] = np.nan
+        return ears
+
+
+    # Runs the sleep detection over a landmark recording instead of a video
+    def replay_landmarks(self, replay, chunk_size=65536):
+        """
+        Feed the EAR of every recorded frame through check_asleep, without running the face mesh
+
+        The EAR is calculated in batches by recording_ears, only the sleep state machine runs per frame, so
+        recordings replay at hundreds of thousands of frames per second. frame_callback is called for every
+        frame like in process_video.
+
+        :param class replay: LandmarkReplay of a recording holding the EAR landmarks
+        :param int chunk_size: Frames per batched EAR calculation
+
+        :return numpy.ndarray: float32 mean EAR of every frame (NaN without a face)
+        :raises ValueError: If the recording lacks a landmark used by the EAR
+        """
+        ears = self.recording_ears(replay, chunk_size)
+
+        self.frames_read = self.frames_processed = 0
+        check_asleep = self.check_asleep
+        callback = self.frame_callback
+        metrics = self.metrics
+        for i, (ear, frame_time) in enumerate(zip(ears.tolist(), replay.frame_times.tolist())):
+            if ear != ear: # NaN, no face in this frame
+                ear = None
+                if metrics is not None:
+                    self.update_metrics(None, None, frame_time)
+            else:
+                check_asleep(self.update_metrics(ear, None, frame_time) if metrics is not None else ear, None, frame_time)
+            if callback is not None:
+                callback(i, frame_time, ear, self.asleep)
+        self.frames_read = self.frames_processed = len(ears)
+        self.flush_metrics()
+        return ears
+
+
+    # Requests process_video to end after the current frame
+    def stop(self):
+        """
+        Stop processing the video, used to end headless runs which have no window to close
+
+        :return None
+        """
+        self.running = False
 
 
     # Processes the video and detects asleep
@@ -138,65 +518,184 @@ class SleepDetector:
         1. Opens the video
         2. Processes each frame to detect faces and calculate EAR
         3. Determines sleep status based on EAR values
-        4. Displays the processed video
+        4. Hands the processed video to the DisplayRenderer (skipped when headless)
         5. Uploads to sleep database and creates sleep warning if asleep
+
+        In headless mode nothing is drawn or displayed and no time is spent waiting for keys, so video files
+        are processed as fast as the CPU allows. The run ends when the video ends or stop() is called.
+
+        Camera frames are timed by their capture time, video files by their position in the video, so sleep
+        detection on recordings doesn't depend on how fast they are processed.
         
-        :raises IOError: If video file cannot be opened
-        :raises Exception: For other processing errors
+        With inference_processes, the run is handed to process_video_pipeline instead.
+
+        Errors end the run without raising, so the interactive loop always cleans up. They are printed and kept
+        in self.error (None after a complete run), so batch callers can tell a failed video from a finished one:
+        an IOError if the video file cannot be opened, or any other exception raised while processing.
         """
+        if self.inference_processes:
+            return self.process_video_pipeline()
+
+        cap = None
+        self.error = None
         try:
-            # Open video capture
-            cap = cv.VideoCapture(self.video_path)
+            # Open video capture, or take over the one opened during startup
+            cap, self.capture = self.capture, None
+            if cap is None:
+                cap = self.open_capture()
             if not cap.isOpened():
                 print(f"Failed to open video: {self.video_path}")
                 raise IOError("Error: couldn't open the video!")
 
             # Get video properties
-            w, h, fps = (int(cap.get(x)) for x in (
-                cv.CAP_PROP_FRAME_WIDTH,
-                cv.CAP_PROP_FRAME_HEIGHT,
-                cv.CAP_PROP_FPS
-            ))
+            fps = cap.get(cv.CAP_PROP_FPS)
+            live = isinstance(self.video_path, int) # Camera indices are live sources, everything else is a recording
+            video_fps = fps if fps > 0 else self.NOMINAL_FPS
+            # Recordings with a preview play at their own frame rate, threaded ones too (FrameCapture reads files as
+            # fast as its queue empties, it doesn't pace them)
+            pace = not (self.headless or live or fps <= 0)
+
+            self.running = True
+            self.frames_processed = 0
+            self.frames_read = 0
+            if not self.headless:
+                self.renderer = DisplayRenderer("DriveGuard", self.display_size, self.display_fps, self.latency_monitor)
 
             # Main processing loop as long as video is opened
-            while cap.isOpened():
-                ret, frame = cap.read()
+            monitor = self.latency_monitor
+            playback_start = time.monotonic()
+            while self.running and cap.isOpened():
+                frame_start = time.perf_counter()
+                ret, frame, timestamp = self.read_frame(cap)
                 if not ret: # Break the loop if no frame is read/video ends
                     break
+                monitor.record("decode", time.perf_counter() - frame_start)
+                self.frames_read += 1
+                frame_time = timestamp if live else (self.frames_read - 1) / video_fps
+
+                # Skip frames that waited too long to still be worth processing
+                self.frame_delay = time.monotonic() - timestamp
+                if self.max_frame_age is not None and self.frame_delay > self.max_frame_age:
+                    self.stale_frames += 1
+                    continue
+
+                # Detect facial landmarks, calculate the EAR and update the sleep status (unless the scheduler skips the frame)
+                ear = None
+                if self.scheduler is None or self.scheduler.should_process(frame_time):
+                    frame, face_landmarks, ear = self.process_frame(frame, timestamp, frame_time)
+                else:
+                    self.skipped_frames += 1
+
+                quit_pressed = False
+                if self.renderer is not None:
+                    # Hands the frame to the renderer thread, which draws it at display_fps, this thread shows it
+                    if self.renderer.due():
+                        if ear is not None:
+                            self.renderer.submit(frame, face_landmarks[0, self.EYE_POS], self.set_colors(ear))
+                        else:
+                            self.renderer.submit(frame)
+
+                    # Stop if 'p' is pressed or window is closed
+                    quit_pressed = self.renderer.pump()
+
+                monitor.record("frame", time.perf_counter() - frame_start)
+                monitor.tick()
+                if quit_pressed:
+                    break
 
-                # Detect facial landmarks
-                frame, face_landmarks = self.generator.create_face_mesh(frame, draw=False)
-
-                if len(face_landmarks) > 0:
-                    # Calculate eye aspect ratio
-                    right_ear = self.eye_aspect_ratio(self.RIGHT_EYE_EAR, face_landmarks)
-                    left_ear = self.eye_aspect_ratio(self.LEFT_EYE_EAR, face_landmarks)
-                    ear = (right_ear + left_ear) / 2.0
+                if pace:
+                    wait = playback_start + frame_time + 1.0 / video_fps - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
 
-                    # Update blink detection
-                    self.check_asleep(ear)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            self.error = e
 
-                    # Determine visualization color based on EAR
-                    color = self.set_colors(ear)
+        finally:
+            # Cleanup/clear everything once video is closed
+            self.running = False
+            self.flush_metrics()
+            if cap is not None:
+                cap.release()
+            if self.renderer is not None:
+                self.renderer.close() # Closes the preview window
+                self.renderer = None
 
-                    # Draw visualizations
-                    self.draw_eye_landmarks(frame, face_landmarks, self.RIGHT_EYE, color)
-                    self.draw_eye_landmarks(frame, face_landmarks, self.LEFT_EYE, color)
 
-                    # Display the frame
-                    resized_frame = cv.resize(frame, (1280, 720))
-                    cv.imshow("DriveGuard", resized_frame)
+    # Processes the video with capture and inference in separate processes
+    def process_video_pipeline(self):
+        """
+        Same as process_video, but the frames are captured and run through the face mesh by an InferencePipeline
 
-                # Break loop if 'p' is pressed or window is closed
-                if cv.waitKey(int(1000/fps)) & 0xFF == ord('p') or cv.getWindowProperty("DriveGuard", cv.WND_PROP_VISIBLE) < 1:
+        Capture and inference_processes inference processes share the frames through shared memory, so they run on
+        their own cores and only landmark arrays come back to this process for the EAR, sleep status and display.
+        The adaptive scheduler doesn't apply, every frame is inferred. Errors are kept in self.error like in
+        process_video: an IOError if the video file cannot be opened, or any other exception, e.g. a failed
+        pipeline process.
+        """
+        pipeline = InferencePipeline(
+            self.video_path,
+            workers=self.inference_processes,
+            generator_options=self.generator_options,
+            landmark_backend=self.landmark_backend,
+            frame_budget=self.frame_budget,
+            indices=self.LANDMARK_IDS,
+            all_faces=self.other_faces
+        )
+        self.error = None
+        try:
+            pipeline.start()
+            live = pipeline.live
+            video_fps = pipeline.fps if pipeline.fps else self.NOMINAL_FPS
+
+            self.running = True
+            self.frames_processed = 0
+            self.frames_read = 0
+            if not self.headless:
+                self.renderer = DisplayRenderer("DriveGuard", self.display_size, self.display_fps, self.latency_monitor)
+
+            monitor = self.latency_monitor
+            for frame_index, timestamp, face_landmarks, frame in pipeline.results():
+                frame_start = time.perf_counter()
+                self.frames_read += 1
+                frame_time = timestamp if live else frame_index / video_fps
+
+                # Skip frames that waited too long to still be worth processing
+                self.frame_delay = time.monotonic() - timestamp
+                if self.max_frame_age is not None and self.frame_delay > self.max_frame_age:
+                    self.stale_frames += 1
+                    continue
+
+                ear = self.process_landmarks(face_landmarks, timestamp, frame_time)
+
+                quit_pressed = False
+                if self.renderer is not None:
+                    # The ring slot is reused once the next result is taken, so the renderer gets a copy of the frames it draws
+                    if self.renderer.due():
+                        if ear is not None:
+                            self.renderer.submit(frame.copy(), face_landmarks[0, self.EYE_POS], self.set_colors(ear))
+                        else:
+                            self.renderer.submit(frame.copy())
+                    quit_pressed = self.renderer.pump()
+
+                monitor.record("frame", time.perf_counter() - frame_start)
+                monitor.tick()
+                if not self.running or quit_pressed:
                     break
-
-            # Cleanup/clear everything once video is closed
-            cap.release()
-            cv.destroyAllWindows()
+            self.dropped_frames = pipeline.dropped_frames
 
         except Exception as e:
             print(f"An error occurred: {e}")
+            self.error = e
+
+        finally:
+            self.running = False
+            self.flush_metrics()
+            pipeline.close()
+            if self.renderer is not None:
+                self.renderer.close() # Closes the preview window
+                self.renderer = None
 
 
 # Allows for testing/usage if python file is run by itself, not imported as a method
@@ -0,0 +1,294 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from sleep_database import SleepDatabase
+
+
+class SleepEventWriter:
+    """
+    A class that uploads sleep timestamps to the SleepDatabase on a background thread
+
+    It can be passed to SleepDetector in place of the SleepDatabase: take_sleep_timestamp only records the time
+    and returns, the writer thread batches the inserts and does all the file I/O. While the database is unreachable the events are appended
+    to a local spool file and retried with exponential backoff, and the spool is replayed once the database is back.
+    """
+
+    # Initializes SleepEventWriter
+    def __init__(self, database=None, spool_path="sleep_events.spool", batch_size=50, max_pending=1000,
+                 max_overflow=10000, retry_delay=0.5, max_retry_delay=30.0):
+        """
+        Starts the writer thread
+
+        :param class database: Instance of the SleepDatabase class (default: connect on the writer thread)
+        :param str spool_path: Append-only file holding events that couldn't be uploaded yet
+        :param int batch_size: Maximum number of events inserted per transaction
+        :param int max_pending: Maximum number of events kept in memory for upload, further events are spooled
+        :param int max_overflow: Maximum number of events waiting for the writer thread to spool them, further
+            events are dropped (counted in dropped)
+        :param float retry_delay: Seconds to wait after the first failed upload
+        :param float max_retry_delay: Longest wait between upload attempts
+
+        :return None
+        """
+        self.database = database
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_overflow = max_overflow
+        self.initial_retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.inserted = 0 # Events uploaded to the database (replayed ones included)
+        self.spooled = 0 # Events written to the spool file
+        self.failures = 0 # Failed upload attempts
+        self.dropped = 0 # Events lost because the writer thread was stuck with a full overflow buffer
+        self.last_error = None
+
+        self._pending = deque() # Events waiting for the writer thread
+        self._overflow = deque() # Events past max_pending, spooled by the writer thread
+        self._condition = threading.Condition()
+        self._spool_lock = threading.Lock()
+        self._spool_pending = os.path.exists(spool_path) and os.path.getsize(spool_path) > 0 # Leftovers of a previous run
+        self._retry_delay = retry_delay
+        self._next_attempt = 0.0 # time.monotonic() before which no upload is tried
+        self._reconnect = False
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close) # Keeps queued events in the spool if the program exits without closing
+
+
+    # Records a sleep event without waiting for the database
+    def take_sleep_timestamp(self, driver_id=""):
+        """
+        Takes a timestamp of the person falling asleep and queues it for upload
+
+        Same interface as SleepDatabase.take_sleep_timestamp, but never blocks on database I/O
+
+        :param str driver_id: Driver or vehicle the event belongs to (default: the single driver '')
+
+        :return None
+        """
+        self._enqueue((datetime.now(), driver_id)) # Stores current timestamp
+
+
+    # Records a per-minute drowsiness aggregate without waiting for the database
+    def take_drowsiness_metrics(self, row):
+        """
+        Queues a DrowsinessMetrics aggregate for upload, through the same queue, batches and spool as the sleep events
+
+        Same interface as SleepDatabase.take_drowsiness_metrics, but never blocks on database I/O
+
+        :param dict row: Dictionary returned by DrowsinessMetrics.flush
+
+        :return None
+        """
+        self._enqueue(row)
+
+
+    # Hands an event over to the writer thread
+    def _enqueue(self, event):
+        """
+        Queues the event for upload, or for the spool once max_pending is reached, without touching the disk
+
+        Only spools directly once the writer is closed, as no thread is left to do it
+
+        :param event: (datetime, driver_id) sleep event or drowsiness aggregate dictionary
+
+        :return None
+        """
+        with self._condition:
+            if not self._stopped:
+                if len(self._pending) < self.max_pending:
+                    self._pending.append(event)
+                elif len(self._overflow) < self.max_overflow:
+                    self._overflow.append(event) # Memory bound reached, the writer thread keeps it on disk instead
+                else:
+                    self.dropped += 1
+                    return
+                self._condition.notify()
+                return
+
+        self._spool([event])
+
+
+    # Uploads queued events until the writer is closed
+    def _run(self):
+        """
+        Writer thread: takes batches from the queue and uploads them, spooling them while the database is down
+
+        :return None
+        """
+        while True:
+            with self._condition:
+                # Wakes up for new events, or when it is time to retry the spool
+                timeout = max(0.0, self._next_attempt - time.monotonic()) if self._spool_pending else None
+                self._condition.wait_for(lambda: self._pending or self._overflow or self._stopped, timeout)
+                if self._stopped:
+                    return
+                overflow = list(self._overflow)
+                self._overflow.clear()
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+            self._spool(overflow)
+
+            if time.monotonic() < self._next_attempt:
+                self._spool(batch) # Still backing off, the spool gets replayed with the next attempt
+            elif self._upload(batch):
+                self._retry_delay = self.initial_retry_delay
+                self._next_attempt = 0.0
+            else:
+                self._spool(batch)
+                self._next_attempt = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, self.max_retry_delay)
+
+
+    # Uploads the spool and a batch of events
+    def _upload(self, batch):
+        """
+        Connects if needed, replays the spool file and inserts the batch
+
+        :param list batch: (datetime, driver_id) sleep events and dictionaries of drowsiness aggregates to insert
+
+        :return bool: True if everything was uploaded
+        """
+        try:
+            if self.database is None:
+                self.database = SleepDatabase()
+            elif self._reconnect:
+                self.database.reconnect()
+            self._reconnect = False
+
+            if self._spool_pending:
+                self._replay_spool()
+            self._insert(batch)
+            self.inserted += len(batch)
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            self._reconnect = self.database is not None
+            return False
+
+
+    # Inserts a mixed batch of sleep events and drowsiness aggregates
+    def _insert(self, batch):
+        """
+        :param list batch: (datetime, driver_id) sleep events and dictionaries of drowsiness aggregates
+
+        :return None
+        """
+        drivers = {} # Timestamps of every driver in the batch
+        rows = []
+        for event in batch:
+            if isinstance(event, dict):
+                rows.append(event)
+            else:
+                drivers.setdefault(event[1], []).append(event[0])
+        for driver_id, timestamps in drivers.items():
+            self.database.insert_sleep_timestamps(timestamps, driver_id)
+        if rows:
+            self.database.insert_drowsiness_metrics(rows)
+
+
+    # Appends events to the spool file
+    def _spool(self, timestamps):
+        """
+        Appends events to the spool file, one line per event: an ISO 8601 timestamp (followed by a tab and the
+        driver ID, if not the default driver) or a JSON drowsiness aggregate
+
+        :param list timestamps: (datetime, driver_id) sleep events and drowsiness aggregate dictionaries to keep
+
+        :return None
+        """
+        if not timestamps:
+            return
+        with self._spool_lock:
+            with open(self.spool_path, "a") as spool:
+                spool.writelines(f"{self._encode(timestamp)}\n" for timestamp in timestamps)
+            self._spool_pending = True
+            self.spooled += len(timestamps)
+
+
+    # Uploads the events of the spool file and empties it
+    def _replay_spool(self):
+        """
+        Inserts every spooled event in batches and truncates the spool once all of them are committed
+
+        :return None
+        """
+        with self._spool_lock:
+            with open(self.spool_path) as spool:
+                timestamps = [self._decode(line.rstrip("\n")) for line in spool if line.strip()]
+            for i in range(0, len(timestamps), self.batch_size):
+                self._insert(timestamps[i:i + self.batch_size])
+            open(self.spool_path, "w").close() # Truncates the spool, replays of already inserted events are skipped by the database (by timestamp, or flush ID for aggregates)
+            self._spool_pending = False
+            self.inserted += len(timestamps)
+
+
+    # Converts a queued event to its spool line
+    @staticmethod
+    def _encode(event):
+        if isinstance(event, dict):
+            return json.dumps({**event, "minute": event["minute"].isoformat()})
+        timestamp, driver_id = event
+        return f"{timestamp.isoformat()}\t{driver_id}" if driver_id else timestamp.isoformat()
+
+
+    # Converts a spool line back to its event
+    @staticmethod
+    def _decode(line):
+        if line.startswith("{"):
+            row = json.loads(line)
+            row["minute"] = datetime.fromisoformat(row["minute"])
+            return row
+        timestamp, _, driver_id = line.partition("\t")
+        return datetime.fromisoformat(timestamp), driver_id
+
+
+    # Returns the number of events not uploaded yet
+    def backlog(self):
+        """
+        Counts the events queued in memory for the writer thread
+
+        :return int: Events waiting in memory, for upload or for the spool (events in the spool are not counted)
+        """
+        with self._condition:
+            return len(self._pending) + len(self._overflow)
+
+
+    # Stops the writer thread and makes sure no event is lost
+    def close(self, timeout=5.0):
+        """
+        Stops the writer thread, uploads the remaining events if the database is reachable and spools them otherwise
+
+        Does not close the database connection
+
+        :param float timeout: Seconds to wait for the writer thread to finish its current upload
+
+        :return None
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+        with self._condition:
+            remaining = list(self._pending)
+            overflow = list(self._overflow)
+            self._pending.clear()
+            self._overflow.clear()
+        self._spool(overflow)
+
+        # Only uploads if the writer thread isn't stuck on the database itself
+        if remaining and not self._thread.is_alive() and time.monotonic() >= self._next_attempt and self._upload(remaining):
+            return
+        self._spool(remaining)
@@ -0,0 +1,256 @@
+import argparse
+import csv
+import hashlib
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+
+
+# Draws the sleep events per hour with a trendline
+def draw_sleep_trend(figure, hours, counts, title="Driver Sleep Frequency by Hour"):
+    """
+    Draws a bar chart of the sleep events of every hour and a quadratic trendline onto a figure
+
+    Based on military time
+
+    :param matplotlib.figure.Figure figure: Figure to draw on
+    :param numpy.ndarray hours: datetime64 hours with sleep events, increasing
+    :param numpy.ndarray counts: Sleep events of each hour
+    :param str title: Title of the chart
+
+    :return None
+    """
+    from matplotlib.dates import AutoDateLocator, DateFormatter, HourLocator
+
+    axes = figure.add_subplot()
+    x_labels = hours.astype("datetime64[s]").astype(datetime) # Bar positions as datetimes
+    axes.bar(x_labels, counts, width=0.03, color='skyblue', edgecolor='black', label="Sleep Count (per hour)")
+
+    # Plot trendline if enough data, fitted on the hours since the first one
+    if len(hours) >= 3:
+        hours_since_start = (hours - hours[0]).astype(np.float64)
+        p = np.poly1d(np.polyfit(hours_since_start, counts, 2))
+        axes.plot(x_labels, p(hours_since_start), "r--", label="Trendline")
+
+    # Formatting, with a tick every hour when the data fits in a day
+    axes.set_title(title)
+    axes.set_xlabel("Time")
+    axes.set_ylabel("Sleep Occurrences")
+    if hours[-1] - hours[0] <= np.timedelta64(24, "h"):
+        axes.xaxis.set_major_locator(HourLocator(interval=1))
+        axes.xaxis.set_major_formatter(DateFormatter('%H:%M'))
+    else:
+        axes.xaxis.set_major_locator(AutoDateLocator())
+        axes.xaxis.set_major_formatter(DateFormatter('%m-%d %H:%M'))
+    axes.tick_params(axis="x", labelrotation=45)
+    axes.grid(True)
+    axes.legend()
+    figure.tight_layout()
+
+
+# Draws the most common sleep hour
+def draw_common_hour(figure, sleep_hour, frequency):
+    """
+    Writes the most frequent sleep hour and its frequency onto a figure
+
+    :param matplotlib.figure.Figure figure: Figure to draw on
+    :param int sleep_hour: Hour of the day (None if there are no sleep events)
+    :param int frequency: Sleep events in that hour of the day
+
+    :return None
+    """
+    axes = figure.add_subplot()
+    if sleep_hour is not None:
+        axes.text(0.5, 0.6, f"Most Common Sleep Hour: {int(sleep_hour):02d}:00",
+                  fontsize=24, ha='center', va='center', weight='bold')
+        axes.text(0.5, 0.4, f"Frequency: {frequency} occurrences",
+                  fontsize=16, ha='center', va='center')
+    else:
+        axes.text(0.5, 0.5, "No sleep records found",
+                  fontsize=20, ha='center', va='center', color='red')
+    axes.set_xlim(0, 1)
+    axes.set_ylim(0, 1)
+    axes.axis('off')
+    axes.set_title("Driver Sleep Analysis", fontsize=18, weight='bold', pad=20)
+
+
+# Selects the non-interactive backend in a report worker
+def _init_worker():
+    """
+    Process pool initializer: renders with the Agg backend, so no display is needed
+
+    :return None
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Turns a driver ID into a file name
+def _file_name(driver_id):
+    """
+    Readable part of the ID plus a short hash of the raw ID, so IDs that only differ in replaced characters
+    ("bus/1" and "bus_1") or a driver named "default" never share the files of another driver
+
+    :param str driver_id: Driver or vehicle ID ('' for the default driver)
+
+    :return str: File name prefix
+    """
+    readable = re.sub(r"[^A-Za-z0-9_.-]", "_", driver_id) if driver_id else "default"
+    return f"{readable}_{hashlib.sha1(driver_id.encode()).hexdigest()[:8]}"
+
+
+# Writes the report files of one driver, runs in a worker process
+def render_driver_report(driver_id, hours, counts, output_dir):
+    """
+    Writes <driver>_hourly.csv with the sleep events per hour, <driver>_trend.png with the trend chart and
+    <driver>_common_hour.png with the most common sleep hour, <driver> being the driver ID followed by a short
+    hash (see _file_name)
+
+    The figures are created without pyplot, so nothing is kept around between reports and no window opens.
+
+    :param str driver_id: Driver or vehicle of the report
+    :param numpy.ndarray hours: datetime64 hours with sleep events, increasing
+    :param numpy.ndarray counts: Sleep events of each hour
+    :param str output_dir: Directory receiving the files
+
+    :return dict: Summary of the driver: events, most common hour of the day and its frequency, first and last hour
+    """
+    from matplotlib.figure import Figure
+
+    name = _file_name(driver_id)
+    base = os.path.join(output_dir, name)
+    with open(f"{base}_hourly.csv", "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["sleep_hour", "frequency"])
+        writer.writerows(zip(np.datetime_as_string(hours, unit="h"), counts.tolist()))
+
+    # Most common hour of the day, from the same hourly counts
+    by_hour = np.bincount(hours.astype(np.int64) % 24, weights=counts, minlength=24) # datetime64[h] counts hours since 1970-01-01 00:00
+    common_hour = int(np.argmax(by_hour)) if len(hours) else None
+
+    figure = Figure(figsize=(14, 6))
+    draw_sleep_trend(figure, hours, counts, f"Driver {driver_id or 'default'}: Sleep Frequency by Hour")
+    figure.savefig(f"{base}_trend.png", dpi=80)
+
+    figure = Figure(figsize=(8, 6))
+    draw_common_hour(figure, common_hour, int(by_hour[common_hour]) if common_hour is not None else 0)
+    figure.savefig(f"{base}_common_hour.png", dpi=80)
+
+    return {
+        "driver_id": driver_id,
+        "files": name,
+        "events": int(counts.sum()),
+        "most_common_hour": common_hour,
+        "most_common_hour_events": int(by_hour[common_hour]) if common_hour is not None else 0,
+        "first_hour": str(hours[0]) if len(hours) else None,
+        "last_hour": str(hours[-1]) if len(hours) else None
+    }
+
+
+# Reads the hourly counts of the next batch of drivers
+def fetch_hourly_batch(cursor, after=None, driver_ids=None, limit=100, since=None):
+    """
+    Fetches the rollup rows of up to limit drivers in one query, pre-aggregated per driver and hour
+
+    :param cursor: Cursor of a SleepDatabase connection
+    :param str after: Only drivers sorting after this ID (keyset paging, default: from the first driver)
+    :param list driver_ids: Only these drivers (default: every driver in the rollup)
+    :param int limit: Maximum number of drivers in the batch
+    :param datetime since: Only hours from this time on (default: all hours)
+
+    :return dict: Driver ID to (datetime64 hours, counts) arrays, in driver order
+    """
+    cursor.execute("""WITH batch AS (
+                SELECT DISTINCT driver_id FROM driver_hourly
+                WHERE (%(after)s::text IS NULL OR driver_id > %(after)s)
+                  AND (%(driver_ids)s::text[] IS NULL OR driver_id = ANY(%(driver_ids)s::text[]))
+                  AND (%(since)s::timestamp IS NULL OR sleep_hour >= %(since)s)
+                ORDER BY driver_id
+                LIMIT %(limit)s
+            )
+            SELECT driver_id, sleep_hour, frequency
+            FROM driver_hourly JOIN batch USING (driver_id)
+            WHERE %(since)s::timestamp IS NULL OR sleep_hour >= %(since)s
+            ORDER BY driver_id, sleep_hour;
+            """, {"after": after, "driver_ids": driver_ids, "limit": limit, "since": since})
+    rows = cursor.fetchall()
+
+    batch = {}
+    start = 0
+    for end in range(1, len(rows) + 1):
+        if end == len(rows) or rows[end][0] != rows[start][0]: # Last row of a driver
+            driver_rows = rows[start:end]
+            batch[rows[start][0]] = (
+                np.array([row[1] for row in driver_rows], dtype="datetime64[h]"),
+                np.array([row[2] for row in driver_rows], dtype=np.int64)
+            )
+            start = end
+    return batch
+
+
+# Writes the reports of every driver
+def generate_reports(output_dir, database=None, driver_ids=None, batch_size=100, workers=None, since=None):
+    """
+    Renders the reports of many drivers in parallel worker processes, one database query per batch of drivers
+
+    Only one batch of hourly counts is held at a time and each worker renders one driver at a time, so memory
+    stays flat however many drivers there are. reports.csv lists the summary of every driver.
+
+    :param str output_dir: Directory receiving the report files
+    :param class database: SleepDatabase to read from (default: a new connection, closed afterwards)
+    :param list driver_ids: Drivers to report (default: every driver in the rollup)
+    :param int batch_size: Drivers fetched per query
+    :param int workers: Number of worker processes (default: number of CPUs)
+    :param datetime since: Only report hours from this time on (default: all hours)
+
+    :return int: Number of drivers reported
+    """
+    from sleep_database import SleepDatabase
+
+    os.makedirs(output_dir, exist_ok=True)
+    own_database = database is None
+    database = database if database else SleepDatabase()
+    reported = 0
+    try:
+        context = multiprocessing.get_context("spawn") # Workers start without the parent's database connection
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool, \
+                open(os.path.join(output_dir, "reports.csv"), "w", newline="") as index_file:
+            index = None
+            after = None
+            while True:
+                batch = fetch_hourly_batch(database.cursor, after, driver_ids, batch_size, since)
+                if not batch:
+                    break
+                futures = [pool.submit(render_driver_report, driver_id, hours, counts, output_dir)
+                           for driver_id, (hours, counts) in batch.items()]
+                for future in futures: # The summaries are written in driver order
+                    summary = future.result()
+                    if index is None:
+                        index = csv.DictWriter(index_file, fieldnames=list(summary))
+                        index.writeheader()
+                    index.writerow(summary)
+                reported += len(batch)
+                after = next(reversed(batch)) # Last driver of the batch
+                del batch, futures
+                print(f"Reported {reported} drivers")
+    finally:
+        if own_database:
+            database.close_connection()
+    return reported
+
+
+# Allows the reports to be generated from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write sleep trend reports of every driver without a display")
+    parser.add_argument("--output", default="reports", help="Directory for the PNG/CSV reports")
+    parser.add_argument("--drivers", nargs="*", default=None, help="Driver IDs to report (default: all)")
+    parser.add_argument("--days", type=float, default=None, help="Only report the last this many days")
+    parser.add_argument("--batch-size", type=int, default=100, help="Drivers fetched per database query")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    since = datetime.now() - timedelta(days=args.days) if args.days is not None else None
+    generate_reports(args.output, driver_ids=args.drivers, batch_size=args.batch_size, workers=args.workers, since=since)